@@ -0,0 +1,61 @@
+"""
+Compare the shared serializer against the legacy DecimalEncoder on a catalog-shaped payload.
+
+Usage: python benchmarks/bench_serialization.py [--products 10000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.decimal_encoder import DecimalEncoder  # noqa: E402
+from utils import serialization  # noqa: E402
+
+
+def build_catalog(count):
+    # Mirrors what DynamoGateway.get_all_items returns: every number is a Decimal
+    return {
+        "items": [
+            {
+                "product_id": f"prod-{idx:07d}",
+                "product_name": f"Product {idx}",
+                "product_name_lower": f"product {idx}",
+                "price": Decimal(f"{(idx % 997) + 0.99:.2f}"),
+                "quantity": Decimal(idx % 500),
+                "sales_count": Decimal(idx % 73),
+            }
+            for idx in range(count)
+        ],
+        "status": "success",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = build_catalog(args.products)
+    candidates = {
+        "json + DecimalEncoder": lambda: json.dumps(payload, cls=DecimalEncoder),
+        f"utils.serialization ({'orjson' if serialization.orjson else 'json fallback'})": lambda: serialization.dumps(payload),
+    }
+
+    # Both encoders must agree on the decoded document before timing means anything
+    assert json.loads(candidates["json + DecimalEncoder"]()) == json.loads(serialization.dumps(payload))
+
+    print(f"Serializing {args.products} products, best of {args.repeat}")
+    baseline = None
+    for name, func in candidates.items():
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(f"  {name:<45} {best * 1000:9.2f} ms  ({baseline / best:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
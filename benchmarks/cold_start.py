@@ -0,0 +1,205 @@
+"""
+Measure the cold-start cost of every handler entry point in serverless.yml.
+
+For each function a fresh interpreter is started with `python -X importtime` and only
+imports the handler module, which gives the init cost Lambda pays before the first
+request and a per-module breakdown. A second fresh interpreter then invokes the
+handler once against the moto stand-in to measure the first (cold) invocation.
+Each run is appended to benchmarks/cold_start_history.jsonl so regressions show up
+against the previous run before deploy.
+
+Usage:
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --only getProduct createProduct --repeat 5 --top 15
+    python benchmarks/cold_start.py --no-invoke      # import cost only, moto not required
+
+Exits with status 1 when a handler's init time grows past --tolerance against the last run.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import harness  # noqa: E402
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cold_start_history.jsonl")
+
+# Kept free of json/argparse so the child's importtime output is only the handler's own imports
+IMPORT_SNIPPET = """
+import time, importlib, sys
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+module = importlib.import_module({module!r})
+getattr(module, {attr!r})
+print("init_ms=%.3f" % ((time.perf_counter() - started) * 1000))
+"""
+
+INVOKE_SNIPPET = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+from benchmarks import harness, run_handlers
+harness.configure_environment()
+import boto3
+from moto import mock_aws
+with mock_aws():
+    boto3.setup_default_session(region_name=harness.REGION)
+    harness.create_resources()
+    harness.seed_catalog(10, 5, 10)
+    make_event, setup = run_handlers.build_scenarios(10)[{name!r}]
+    if setup:
+        setup(0)
+    event = make_event(0)
+    started = time.perf_counter()
+    handler = harness.resolve_handler({path!r})
+    imported = time.perf_counter()
+    handler(event, run_handlers.BenchContext())
+    finished = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - started) * 1000, "first_invoke_ms": (finished - imported) * 1000}}))
+"""
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(stderr):
+    """Return {module: (self_us, cumulative_us)} from `-X importtime` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return modules
+
+
+def package_totals(modules):
+    """Sum self time per top-level package (boto3, botocore, models, ...)."""
+    totals = defaultdict(int)
+    for module, (self_us, _) in modules.items():
+        totals[module.split(".")[0]] += self_us
+    return totals
+
+
+def child_env():
+    return {**os.environ, **harness.BENCH_ENV}
+
+
+def measure_import(path):
+    module, _, attr = path.rpartition(".")
+    snippet = IMPORT_SNIPPET.format(root=harness.REPO_ROOT, module=module.replace("/", "."), attr=attr)
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", snippet],
+                          capture_output=True, text=True, env=child_env(), cwd=harness.REPO_ROOT)
+    process_ms = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    init_ms = float(re.search(r"init_ms=([\d.]+)", proc.stdout).group(1))
+    return init_ms, process_ms, parse_importtime(proc.stderr)
+
+
+def measure_invoke(name, path):
+    snippet = INVOKE_SNIPPET.format(root=harness.REPO_ROOT, name=name, path=path)
+    proc = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True, env=child_env(), cwd=harness.REPO_ROOT)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "invoke failed")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=harness.REPO_ROOT).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def last_run():
+    if not os.path.exists(HISTORY_PATH):
+        return None
+    with open(HISTORY_PATH) as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start and import-time benchmark per handler")
+    parser.add_argument("--only", nargs="*", help="function names from serverless.yml to measure")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per handler; the median is kept")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list per handler")
+    parser.add_argument("--no-invoke", action="store_true", help="skip the first-invocation run under moto")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed init time growth before failing")
+    parser.add_argument("--no-history", action="store_true", help="do not append this run to the history file")
+    args = parser.parse_args()
+
+    functions = harness.load_functions()
+    selected = args.only or list(functions)
+    results = {}
+
+    for name in selected:
+        path = functions[name]
+        try:
+            samples = [measure_import(path) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{name:<24} import failed: {e}")
+            continue
+
+        init_ms = statistics.median(sample[0] for sample in samples)
+        process_ms = statistics.median(sample[1] for sample in samples)
+        modules = samples[-1][2]
+        packages = sorted(package_totals(modules).items(), key=lambda item: item[1], reverse=True)
+        result = {
+            "handler": path,
+            "init_ms": round(init_ms, 2),
+            "process_ms": round(process_ms, 2),
+            "modules_imported": len(modules),
+            "packages_ms": {package: round(us / 1000, 2) for package, us in packages[:args.top]},
+        }
+
+        if not args.no_invoke:
+            try:
+                invoke = measure_invoke(name, path)
+                result["first_invoke_ms"] = round(invoke["first_invoke_ms"], 2)
+                result["time_to_first_response_ms"] = round(init_ms + invoke["first_invoke_ms"], 2)
+            except RuntimeError as e:
+                result["invoke_error"] = str(e)
+
+        results[name] = result
+        print(f"{name:<24} init {result['init_ms']:8.1f} ms  process {result['process_ms']:8.1f} ms  "
+              f"first invoke {result.get('first_invoke_ms', float('nan')):8.1f} ms  modules {len(modules)}")
+        slowest = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+        for module, (self_us, cumulative_us) in slowest:
+            print(f"    {module:<48} self {self_us / 1000:7.1f} ms  cumulative {cumulative_us / 1000:7.1f} ms")
+
+    previous = last_run()
+    regressions = []
+    if previous:
+        for name, result in results.items():
+            before = previous["results"].get(name)
+            if before and result["init_ms"] > before["init_ms"] * (1 + args.tolerance):
+                regressions.append(f"{name}: init {result['init_ms']} ms vs {before['init_ms']} ms at {previous.get('revision')}")
+
+    if not args.no_history:
+        with open(HISTORY_PATH, "a") as f:
+            f.write(json.dumps({
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "revision": git_revision(),
+                "python": sys.version.split()[0],
+                "results": results,
+            }, sort_keys=True) + "\n")
+
+    if regressions:
+        print("REGRESSIONS:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Generate synthetic catalog and inventory ledger data for scale testing.
+
+Writes, under --out-dir:
+    for_create/products.csv   rows for batch_create_products (product_id, product_name, price, quantity)
+    for_delete/products.csv   a sample of ids for batch_delete_products
+    ledger/inventory.csv      ledger rows (product_id, datetime, quantity, remarks) whose total per
+                              product equals its catalog quantity
+
+Sales and stock follow a Zipf distribution, and a configurable share of rows is
+duplicated or dirty (blank, non-numeric or negative values, padded names). Rows are
+streamed straight to disk, so a 10M-row catalog needs no more memory than a 1k one.
+
+Usage:
+    python benchmarks/generate_data.py --products 10000000 --gzip --out-dir /tmp/catalog
+    python benchmarks/generate_data.py --products 5000 --seed-ledger   # also writes the ledger to INVENTORY_TABLE_NAME
+"""
+import argparse
+import bisect
+import csv
+import gzip
+import itertools
+import os
+import random
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+ADJECTIVES = ["Classic", "Deluxe", "Eco", "Smart", "Mini", "Ultra", "Pro", "Organic", "Vintage", "Portable", "Premium", "Basic"]
+NOUNS = ["Lamp", "Kettle", "Backpack", "Notebook", "Headphones", "Mug", "Chair", "Blender", "Sneakers", "Watch", "Speaker", "Towel"]
+
+CATALOG_FIELDS = ["product_id", "product_name", "price", "quantity"]
+LEDGER_FIELDS = ["product_id", "datetime", "quantity", "remarks"]
+
+# Zipf ranks are sampled from a bounded support; beyond this the tail weight is negligible
+ZIPF_SUPPORT = 100_000
+
+
+class ZipfSampler:
+    """Inverse-CDF sampler for a Zipf(s) distribution over 1..support."""
+
+    def __init__(self, s, support, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1.0 / rank ** s for rank in range(1, support + 1)))
+        self.total = self.cumulative[-1]
+
+    def sample(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.total) + 1
+
+
+def open_output(path, use_gzip, level):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if use_gzip:
+        return gzip.open(path + ".gz", "wt", newline="", compresslevel=level)
+    return open(path, "w", newline="")
+
+
+def dirty(row, rng):
+    """Corrupt one field of a catalog row the way hand-edited CSVs tend to be."""
+    kind = rng.randrange(6)
+    if kind == 0:
+        row[2] = ""
+    elif kind == 1:
+        row[2] = f"${row[2]}"
+    elif kind == 2:
+        row[3] = "ten"
+    elif kind == 3:
+        row[3] = str(-abs(int(row[3])) - 1)
+    elif kind == 4:
+        row[1] = f"  {row[1]}  "
+    else:
+        row[1] = ""
+    return row
+
+
+def ledger_key(timestamp, rng):
+    """Same shape as gateways.dynamo_gateway.ledger_key, with a seeded suffix so runs are reproducible."""
+    return f"{timestamp.isoformat()}#{rng.getrandbits(48):012x}"
+
+
+def ledger_rows(product_id, quantity, sales, max_entries, start, days, rng):
+    """Yield a ledger whose entries sum to quantity: one receipt, then purchases splitting sales."""
+    purchases = min(sales, max_entries - 1)
+    offsets = sorted(rng.random() * days * 86400 for _ in range(purchases + 1))
+    yield [product_id, ledger_key(start + timedelta(seconds=offsets[0]), rng), quantity + sales, "Initial stock"]
+
+    remaining = sales
+    for n, offset in enumerate(offsets[1:], 1):
+        units = remaining if n == purchases else max(1, remaining // (purchases - n + 1))
+        remaining -= units
+        yield [product_id, ledger_key(start + timedelta(seconds=offset), rng), -units, f"Purchase of {units} units"]
+
+
+def seed_ledger(path, chunk_size):
+    """Stream a generated ledger file into INVENTORY_TABLE_NAME through DynamoGateway."""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from gateways.dynamo_gateway import DynamoGateway
+
+    gateway = DynamoGateway(os.environ["INVENTORY_TABLE_NAME"])
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", newline="") as f:
+        reader = csv.DictReader(f)
+        while True:
+            chunk = [dict(row, quantity=int(row["quantity"])) for row in itertools.islice(reader, chunk_size)]
+            if not chunk:
+                break
+            gateway.batch_create_items(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic catalog and ledger data")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--out-dir", default="generated")
+    parser.add_argument("--zipf", type=float, default=1.2, help="Zipf exponent for sales and stock")
+    parser.add_argument("--duplicate-rate", type=float, default=0.01, help="share of rows repeating a recent product_id")
+    parser.add_argument("--dirty-rate", type=float, default=0.005, help="share of rows with a corrupted field")
+    parser.add_argument("--delete-fraction", type=float, default=0.05, help="share of ids written to for_delete/")
+    parser.add_argument("--max-ledger-entries", type=int, default=20, help="cap on ledger rows per product")
+    parser.add_argument("--days", type=int, default=365, help="ledger history window")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--gzip-level", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--seed-ledger", action="store_true", help="write the ledger to INVENTORY_TABLE_NAME")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    zipf = ZipfSampler(args.zipf, ZIPF_SUPPORT, rng)
+    history_start = datetime.now(timezone.utc) - timedelta(days=args.days)
+    recent_ids = deque(maxlen=1000)
+    started = time.perf_counter()
+    ledger_path = os.path.join(args.out_dir, "ledger", "inventory.csv")
+
+    counts = {"catalog": 0, "duplicates": 0, "dirty": 0, "deletes": 0, "ledger": 0}
+    with open_output(os.path.join(args.out_dir, "for_create", "products.csv"), args.gzip, args.gzip_level) as create_file, \
+            open_output(os.path.join(args.out_dir, "for_delete", "products.csv"), args.gzip, args.gzip_level) as delete_file, \
+            open_output(ledger_path, args.gzip, args.gzip_level) as ledger_file:
+        create_writer, delete_writer, ledger_writer = csv.writer(create_file), csv.writer(delete_file), csv.writer(ledger_file)
+        create_writer.writerow(CATALOG_FIELDS)
+        delete_writer.writerow(["product_id"])
+        ledger_writer.writerow(LEDGER_FIELDS)
+
+        for idx in range(args.products):
+            duplicate = bool(recent_ids) and rng.random() < args.duplicate_rate
+            if duplicate:
+                product_id = rng.choice(recent_ids)
+                counts["duplicates"] += 1
+            else:
+                product_id = f"gen-{idx:08d}"
+                recent_ids.append(product_id)
+
+            quantity = zipf.sample() - 1
+            sales = zipf.sample() - 1
+            price = f"{rng.lognormvariate(3, 1):.2f}"
+            row = [product_id, f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {idx}", price, str(quantity)]
+
+            if rng.random() < args.dirty_rate:
+                row = dirty(row, rng)
+                counts["dirty"] += 1
+            elif not duplicate:
+                # Only the first row of a product gets a ledger, so ledger totals match its first import
+                for entry in ledger_rows(product_id, quantity, sales, args.max_ledger_entries, history_start, args.days, rng):
+                    ledger_writer.writerow(entry)
+                    counts["ledger"] += 1
+
+            create_writer.writerow(row)
+            counts["catalog"] += 1
+
+            if rng.random() < args.delete_fraction:
+                delete_writer.writerow([product_id])
+                counts["deletes"] += 1
+
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {counts['catalog']} catalog rows ({counts['duplicates']} duplicates, {counts['dirty']} dirty), "
+          f"{counts['deletes']} delete rows and {counts['ledger']} ledger rows to {args.out_dir} "
+          f"in {elapsed:.1f}s ({counts['catalog'] / max(elapsed, 1e-9):,.0f} products/s)")
+
+    if args.seed_ledger:
+        seed_ledger(ledger_path + (".gz" if args.gzip else ""), chunk_size=1000)
+        print(f"Seeded {counts['ledger']} ledger rows into {os.environ['INVENTORY_TABLE_NAME']}")
+
+
+if __name__ == "__main__":
+    main()
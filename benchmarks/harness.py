@@ -0,0 +1,175 @@
+"""
+Shared setup for the benchmark scripts: an in-process AWS stand-in (moto), seeded
+catalog and ledger data, and the handler entry points declared in serverless.yml.
+"""
+import csv
+import importlib
+import io
+import os
+import re
+import sys
+from decimal import Decimal
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERLESS_YML = os.path.join(REPO_ROOT, "serverless.yml")
+
+REGION = "us-east-2"
+ACCOUNT_ID = "123456789012"
+QUEUE_NAME = "products-queue-matt-sqs"
+
+BENCH_ENV = {
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_SESSION_TOKEN": "testing",
+    "AWS_DEFAULT_REGION": REGION,
+    "AWS_REGION": REGION,
+    "TABLE_NAME": "bench-products",
+    "INVENTORY_TABLE_NAME": "bench-product-inventory",
+    "OUTBOX_TABLE_NAME": "bench-outbox",
+    "STOCK_SHARDS_TABLE_NAME": "bench-stock-shards",
+    # Let the scheduled sweep pick up rows written moments earlier by the write benchmarks
+    "OUTBOX_SWEEP_MIN_AGE_SECONDS": "0",
+    "S3_BUCKET_NAME": "bench-products-bucket",
+    "SQS_QUEUE_URL": f"https://sqs.{REGION}.amazonaws.com/{ACCOUNT_ID}/{QUEUE_NAME}",
+    "EVENT_BUS_NAME": "bench-events",
+    "EVENT_BUS_ARN": f"arn:aws:events:{REGION}:{ACCOUNT_ID}:event-bus/bench-events",
+    # Keep benchmark output readable; EMF documents and INFO lines would dominate stdout
+    "LOG_LEVEL": "WARNING",
+    "METRICS_ENABLED": "false",
+    "TRACING_MODE": "off",
+}
+
+
+def configure_environment():
+    """Point every gateway at the stand-in resources. Must run before handlers are imported."""
+    os.environ.update(BENCH_ENV)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+
+def product_id(idx):
+    return f"prod-{idx:07d}"
+
+
+def load_functions():
+    """Return {function_name: "module/path.handler"} for every function in serverless.yml."""
+    with open(SERVERLESS_YML) as f:
+        text = f.read()
+    return dict(re.findall(r"^  (\w+):\s*\n\s+handler:\s*(\S+)", text, flags=re.MULTILINE))
+
+
+def resolve_handler(handler_path):
+    """Import "handlers/product_handler.get_product" and return the callable, or None if it does not exist."""
+    module_path, _, attr = handler_path.rpartition(".")
+    module = importlib.import_module(module_path.replace("/", "."))
+    return getattr(module, attr, None)
+
+
+def create_resources():
+    """Create the tables, bucket, queue and event bus from serverless.yml inside the active moto mock."""
+    import boto3
+
+    dynamodb = boto3.resource("dynamodb", region_name=REGION)
+    dynamodb.create_table(
+        TableName=BENCH_ENV["TABLE_NAME"],
+        AttributeDefinitions=[
+            {"AttributeName": "product_id", "AttributeType": "S"},
+            {"AttributeName": "low_stock_bucket", "AttributeType": "S"},
+        ],
+        KeySchema=[{"AttributeName": "product_id", "KeyType": "HASH"}],
+        BillingMode="PAY_PER_REQUEST",
+        GlobalSecondaryIndexes=[{
+            "IndexName": "LowStockIndex",
+            "KeySchema": [
+                {"AttributeName": "low_stock_bucket", "KeyType": "HASH"},
+                {"AttributeName": "product_id", "KeyType": "RANGE"},
+            ],
+            "Projection": {
+                "ProjectionType": "INCLUDE",
+                "NonKeyAttributes": ["product_name", "quantity", "low_stock_threshold", "low_stock_alerted_at"],
+            },
+        }],
+    )
+    dynamodb.create_table(
+        TableName=BENCH_ENV["INVENTORY_TABLE_NAME"],
+        AttributeDefinitions=[
+            {"AttributeName": "product_id", "AttributeType": "S"},
+            {"AttributeName": "datetime", "AttributeType": "S"},
+        ],
+        KeySchema=[
+            {"AttributeName": "product_id", "KeyType": "HASH"},
+            {"AttributeName": "datetime", "KeyType": "RANGE"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb.create_table(
+        TableName=BENCH_ENV["OUTBOX_TABLE_NAME"],
+        AttributeDefinitions=[{"AttributeName": "event_id", "AttributeType": "S"}],
+        KeySchema=[{"AttributeName": "event_id", "KeyType": "HASH"}],
+        BillingMode="PAY_PER_REQUEST",
+        StreamSpecification={"StreamEnabled": True, "StreamViewType": "NEW_IMAGE"},
+    )
+    dynamodb.create_table(
+        TableName=BENCH_ENV["STOCK_SHARDS_TABLE_NAME"],
+        AttributeDefinitions=[
+            {"AttributeName": "product_id", "AttributeType": "S"},
+            {"AttributeName": "shard_id", "AttributeType": "S"},
+        ],
+        KeySchema=[
+            {"AttributeName": "product_id", "KeyType": "HASH"},
+            {"AttributeName": "shard_id", "KeyType": "RANGE"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    boto3.client("s3", region_name=REGION).create_bucket(
+        Bucket=BENCH_ENV["S3_BUCKET_NAME"],
+        CreateBucketConfiguration={"LocationConstraint": REGION},
+    )
+    boto3.client("sqs", region_name=REGION).create_queue(QueueName=QUEUE_NAME)
+    boto3.client("events", region_name=REGION).create_event_bus(Name=BENCH_ENV["EVENT_BUS_NAME"])
+
+
+def seed_catalog(products, ledger_entries, ledger_products):
+    """
+    Write `products` catalog items and `ledger_entries` ledger rows for each of the
+    first `ledger_products` products (ledgers for the whole catalog would dwarf it).
+    """
+    import boto3
+    from utils.stock_levels import apply_low_stock_bucket
+
+    dynamodb = boto3.resource("dynamodb", region_name=REGION)
+    with dynamodb.Table(BENCH_ENV["TABLE_NAME"]).batch_writer() as batch:
+        for idx in range(products):
+            name = f"Bench Product {idx}"
+            batch.put_item(Item=apply_low_stock_bucket({
+                "product_id": product_id(idx),
+                "product_name": name,
+                "product_name_lower": name.lower(),
+                "price": Decimal(f"{(idx % 997) + 0.99:.2f}"),
+                "quantity": 5 + idx % 500,
+                "sales_count": idx % 73,
+            }))
+
+    with dynamodb.Table(BENCH_ENV["INVENTORY_TABLE_NAME"]).batch_writer() as batch:
+        for idx in range(min(ledger_products, products)):
+            for entry in range(ledger_entries):
+                batch.put_item(Item={
+                    "product_id": product_id(idx),
+                    "datetime": f"2025-01-01T00:00:00.{entry:06d}+00:00",
+                    "quantity": 10 if entry % 3 else -3,
+                    "remarks": "bench seed",
+                })
+
+
+def upload_csv(key, rows, fieldnames):
+    import boto3
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
+    boto3.client("s3", region_name=REGION).put_object(Bucket=BENCH_ENV["S3_BUCKET_NAME"], Key=key, Body=buffer.getvalue())
+
+
+def s3_event(key):
+    return {"Records": [{"s3": {"bucket": {"name": BENCH_ENV["S3_BUCKET_NAME"]}, "object": {"key": key}}}]}
@@ -0,0 +1,235 @@
+"""
+Benchmark every function in serverless.yml against an in-process AWS stand-in (moto).
+
+Reports p50/p95/p99 latency, peak memory allocated by one warm invocation and backend
+(AWS API) calls per invocation for each handler, and compares p95 and call counts against
+stored baselines.
+
+Usage:
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/run_handlers.py --products 1000 --ledger-entries 10
+    python benchmarks/run_handlers.py --products 100000 --ledger-entries 1000 --update-baseline
+
+Exits with status 1 when a handler regresses past --tolerance against benchmarks/baselines.json.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import harness  # noqa: E402
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+class BenchContext:
+    function_name = "benchmark"
+
+    def __init__(self):
+        self.aws_request_id = str(uuid.uuid4())
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def invocation_peak_mb(handler, event):
+    """
+    Peak Python memory allocated during one invocation. Process RSS only ever grows, so it
+    would charge every handler with the peak of the seeding and of the handlers run before it.
+    Tracing runs only around this call, outside the timed iterations.
+    """
+    tracemalloc.start()
+    try:
+        handler(event, BenchContext())
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def build_scenarios(products):
+    """Map serverless.yml function name -> (event factory, optional per-iteration setup)."""
+    def pid(i):
+        return harness.product_id(i % products)
+
+    def batch_create_setup(i):
+        rows = [{"product_id": f"bench-batch-{i}-{n}", "product_name": f"Batch {i}-{n}", "price": "9.99", "quantity": "20"}
+                for n in range(25)]
+        harness.upload_csv(f"for_create/bench-{i}.csv", rows, ["product_id", "product_name", "price", "quantity"])
+
+    def batch_delete_setup(i):
+        harness.upload_csv(f"for_delete/bench-{i}.csv", [{"product_id": f"bench-batch-{i}-{n}"} for n in range(25)], ["product_id"])
+
+    def create_event(i):
+        return {"body": json.dumps({"product_id": f"bench-new-{i}", "product_name": f"New {i}", "quantity": 30, "price": 4.5})}
+
+    return {
+        "setupInventoryCheck": (lambda i: {"body": json.dumps({"schedule": "rate(1 day)"})}, None),
+        "checkLowInventory": (lambda i: {"threshold": 10}, None),
+        "testEventTrigger": (lambda i: {"body": json.dumps({"detail": {"n": i}})}, None),
+        "replaySpooledEvents": (lambda i: {}, None),
+        "relayOutbox": (lambda i: {}, None),
+        "archiveLedger": (lambda i: {}, None),
+        "refreshSalesRollups": (lambda i: {}, None),
+        "getStockoutForecast": (lambda i: {"queryStringParameters": {"window": "28", "limit": "20"}}, None),
+        "getAllProducts": (lambda i: {"queryStringParameters": None}, None),
+        "createProduct": (create_event, None),
+        "getProduct": (lambda i: {"pathParameters": {"product_id": pid(i)}}, None),
+        "getProductHistory": (lambda i: {"pathParameters": {"product_id": pid(i)},
+                                         "queryStringParameters": {"limit": "20"}}, None),
+        "deleteProduct": (lambda i: {"pathParameters": {"product_id": f"bench-new-{i}"}}, None),
+        "modifyProduct": (lambda i: {"pathParameters": {"product_id": pid(i)},
+                                     "body": json.dumps({"product_name": f"Bench Product {i}", "quantity": 50, "price": 3.25})}, None),
+        "batchCreateProducts": (lambda i: harness.s3_event(f"for_create/bench-{i}.csv"), batch_create_setup),
+        "batchDeleteProducts": (lambda i: harness.s3_event(f"for_delete/bench-{i}.csv"), batch_delete_setup),
+        "receiveMessagesFromSqs": (lambda i: {"Records": [{"body": json.dumps({"product_id": f"bench-sqs-{i}", "product_name": "Sqs",
+                                                                                "price": "1.00", "quantity": "5"})}]}, None),
+        "addStocksToProduct": (lambda i: {"body": json.dumps({"product_id": pid(i), "quantity": 5, "remarks": "bench"})}, None),
+        "configureStockShards": (lambda i: {"pathParameters": {"product_id": pid(i)}, "body": json.dumps({"shards": 4})}, None),
+        "searchProductsByName": (lambda i: {"queryStringParameters": {"name": f"Product {i % products}"}}, None),
+        "buyProduct": (lambda i: {"pathParameters": {"product_id": pid(i)}, "queryStringParameters": {"quantity": "1"}}, None),
+        "buyProductByName": (lambda i: {"pathParameters": None, "queryStringParameters": {"product_name": f"Bench Product {i % products}"}}, None),
+        "createOrder": (lambda i: {"body": json.dumps({"items": [{"product_id": pid(i + n), "quantity": 1} for n in range(3)]})}, None),
+        "checkStock": (lambda i: {"pathParameters": {"product_id": pid(i)}}, None),
+        "checkStockByName": (lambda i: {"pathParameters": None, "queryStringParameters": {"product_name": f"Bench Product {i % products}"}}, None),
+        "verifyAdmin": (lambda i: {"body": json.dumps({"admin_id": "bench", "password": "bench"})}, None),
+        "getSpecializedProducts": (lambda i: {"queryStringParameters": None}, None),
+    }
+
+
+class CallCounter:
+    """Counts AWS API calls made by every client created from the default boto3 session."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, **kwargs):
+        self.count += 1
+
+
+def run(args):
+    harness.configure_environment()
+
+    import boto3
+    from moto import mock_aws
+
+    with mock_aws():
+        boto3.setup_default_session(region_name=harness.REGION)
+        harness.create_resources()
+        print(f"Seeding {args.products} products, {args.ledger_entries} ledger entries for {args.ledger_products} of them...")
+        harness.seed_catalog(args.products, args.ledger_entries, args.ledger_products)
+
+        # Registered before any handler module builds its clients, so every client inherits it
+        counter = CallCounter()
+        boto3.DEFAULT_SESSION.events.register("before-call", counter)
+
+        functions = harness.load_functions()
+        scenarios = build_scenarios(args.products)
+        selected = args.only or list(functions)
+
+        results = {}
+        for name in selected:
+            if name not in scenarios:
+                print(f"  {name:<24} no scenario defined, skipped")
+                continue
+            handler = harness.resolve_handler(functions[name])
+            if handler is None:
+                print(f"  {name:<24} handler {functions[name]} not found, skipped")
+                continue
+
+            make_event, setup = scenarios[name]
+            latencies, calls = [], 0
+            for i in range(args.iterations):
+                if setup:
+                    setup(i)
+                event = make_event(i)
+                before = counter.count
+                start = time.perf_counter()
+                handler(event, BenchContext())
+                latencies.append((time.perf_counter() - start) * 1000)
+                calls += counter.count - before
+
+            if setup:
+                setup(args.iterations)
+            peak_mb = invocation_peak_mb(handler, make_event(args.iterations))
+
+            latencies.sort()
+            results[name] = {
+                "p50_ms": round(percentile(latencies, 0.50), 3),
+                "p95_ms": round(percentile(latencies, 0.95), 3),
+                "p99_ms": round(percentile(latencies, 0.99), 3),
+                "peak_alloc_mb": round(peak_mb, 2),
+                "backend_calls": round(calls / args.iterations, 2),
+            }
+            r = results[name]
+            print(f"  {name:<24} p50 {r['p50_ms']:9.2f} ms  p95 {r['p95_ms']:9.2f} ms  p99 {r['p99_ms']:9.2f} ms  "
+                  f"alloc {r['peak_alloc_mb']:8.2f} MB  calls {r['backend_calls']:7.2f}")
+        return results
+
+
+def compare(results, baseline, tolerance):
+    """Return human readable regressions of results against a baseline for the same size."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']} ms vs baseline {previous['p95_ms']} ms")
+        # Call counts are deterministic, so any increase is a real change in access pattern
+        if current["backend_calls"] > previous["backend_calls"]:
+            regressions.append(f"{name}: {current['backend_calls']} backend calls vs baseline {previous['backend_calls']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serverless.yml handlers against moto")
+    parser.add_argument("--products", type=int, default=1000, help="catalog size (1k to 1M)")
+    parser.add_argument("--ledger-entries", type=int, default=10, help="ledger rows per seeded product (1 to 10k)")
+    parser.add_argument("--ledger-products", type=int, default=100, help="how many products get a ledger")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--only", nargs="*", help="function names from serverless.yml to run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 slowdown before failing")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args)
+    size_key = f"products={args.products},ledger={args.ledger_entries}"
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    if args.update_baseline:
+        baselines.setdefault(size_key, {}).update(results)
+        with open(BASELINES_PATH, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline for {size_key} written to {BASELINES_PATH}")
+        return 0
+
+    if size_key not in baselines:
+        print(f"No baseline for {size_key}; run with --update-baseline to record one")
+        return 0
+
+    regressions = compare(results, baselines[size_key], args.tolerance)
+    if regressions:
+        print("REGRESSIONS:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"No regressions against baseline {size_key}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
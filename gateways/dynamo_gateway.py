@@ -1,133 +1,299 @@
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import itertools
 import boto3
-import json
+import random
+import secrets
+import time
 from dotenv import load_dotenv
 import os
 from utils.logger import logger
-from utils.decimal_encoder import DecimalEncoder
+from utils.serialization import json_response
+from utils.metrics import instrument_gateway, register_client_hooks
+from gateways.transport import BATCH_MAX_WORKERS, HEDGED_READS, TRANSPORT_CONFIG, hedger
 
 load_dotenv()
 region_name = os.getenv("AWS_REGION")
 
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_RETRIES = 5
 
+# Ledger range keys: entries are ISO timestamps, which start with a digit and sort inside
+# [LEDGER_ENTRY_KEY_MIN, LEDGER_ENTRY_KEY_MAX]. Bookkeeping rows use lowercase prefixes that
+# sort after every entry, so a bounded key condition never mixes the two.
+LEDGER_ENTRY_KEY_MIN = "0"
+LEDGER_ENTRY_KEY_MAX = "9999"
+LEDGER_SNAPSHOT_PREFIX = "snapshot#"
+# Daily sales rollups are rollup#YYYY-MM-DD; rollup#state records the last entry folded into them
+LEDGER_ROLLUP_PREFIX = "rollup#"
+LEDGER_ROLLUP_STATE_KEY = "rollup#state"
+# Ledger attributes returned by history reads; product_id is implied by the request
+LEDGER_HISTORY_PROJECTION = {
+    "ProjectionExpression": "#dt, #qty, #rm",
+    "ExpressionAttributeNames": {"#dt": "datetime", "#qty": "quantity", "#rm": "remarks"},
+}
+# Entries past the latest snapshot that trigger a new one, and how old an entry must be to be folded in
+LEDGER_SNAPSHOT_EVERY = int(os.getenv("LEDGER_SNAPSHOT_EVERY", "100"))
+LEDGER_SNAPSHOT_LAG_SECONDS = int(os.getenv("LEDGER_SNAPSHOT_LAG_SECONDS", "300"))
+# New entry keys are "<UTC ISO timestamp>#<random hex>": they still sort by time, and writers
+# recording the same product in the same microsecond no longer overwrite each other
+LEDGER_KEY_SEPARATOR = "#"
+LEDGER_KEY_SUFFIX_BYTES = 6
+LEDGER_ENTRY_CONDITION = "attribute_not_exists(product_id)"
+
+# Attributes that reads may be narrowed to with a ProjectionExpression, each with a
+# precomputed expression-name placeholder so reserved words never reach the expression
+PROJECTABLE_ATTRIBUTES = ("product_id", "product_name", "price", "quantity", "sales_count")
+# Read alongside the public fields by models that need them, but never accepted from ?fields=
+INTERNAL_PROJECTED_ATTRIBUTES = ("stock_shards",)
+PROJECTION_PLACEHOLDERS = {
+    attr: f"#f{idx}" for idx, attr in enumerate(PROJECTABLE_ATTRIBUTES + INTERNAL_PROJECTED_ATTRIBUTES)
+}
+
+
+def ledger_key(timestamp=None):
+    """A new, unique ledger sort key for timestamp (now by default)."""
+    timestamp = timestamp or datetime.now(timezone.utc)
+    return f"{timestamp.isoformat()}{LEDGER_KEY_SEPARATOR}{secrets.token_hex(LEDGER_KEY_SUFFIX_BYTES)}"
+
+
+def parse_ledger_key(key):
+    """
+    The UTC time a ledger key records. Also reads the older key shapes: a bare
+    timezone-aware ISO timestamp, or a naive one, which was written in UTC.
+    """
+    timestamp = datetime.fromisoformat(key.split(LEDGER_KEY_SEPARATOR, 1)[0])
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+def is_condition_failure(error):
+    """True when a transaction was cancelled because one of its conditions no longer held."""
+    response = getattr(error, "response", None) or {}
+    if response.get("Error", {}).get("Code") != "TransactionCanceledException":
+        return False
+    return any(reason.get("Code") == "ConditionalCheckFailed" for reason in response.get("CancellationReasons", []))
+
+
+@lru_cache(maxsize=64)
+def build_projection(fields: tuple):
+    """Return the ProjectionExpression keyword arguments for a tuple of whitelisted attributes."""
+    if not fields:
+        return {}
+
+    unknown = [field for field in fields if field not in PROJECTION_PLACEHOLDERS]
+    if unknown:
+        raise ValueError(f"Unsupported fields: {', '.join(unknown)}")
+
+    placeholders = [PROJECTION_PLACEHOLDERS[field] for field in fields]
+    return {
+        "ProjectionExpression": ", ".join(placeholders),
+        "ExpressionAttributeNames": {PROJECTION_PLACEHOLDERS[field]: field for field in fields},
+    }
+
+
+# *_operation and stock_entry_item only build request dicts; there is no call to measure
+@instrument_gateway("dynamodb", exclude=(
+    "put_operation", "update_operation", "delete_operation", "stock_entry_item", "stock_entry_operation",
+))
 class DynamoGateway:
     def __init__(self, table_name: str, region_name: str = region_name):
-        logger.info(f"Initializing DynamoGateway with table: {table_name}, region: {region_name}")
+        logger.info("Initializing DynamoGateway with table: %s, region: %s", table_name, region_name)
         self.table_name = table_name
-        self.dynamodb = boto3.resource("dynamodb", region_name=region_name)
+        self.dynamodb = boto3.resource("dynamodb", region_name=region_name, config=TRANSPORT_CONFIG)
         self.table = self.dynamodb.Table(self.table_name)
-        logger.info(f"DynamoDB table initialized: {self.table.table_name}")
+        # The resource's client is thread-safe and keeps the high-level (de)serialization
+        self.client = register_client_hooks(self.dynamodb.meta.client, "dynamodb")
+        self.get_item_hedger = hedger("dynamodb", "GetItem") if HEDGED_READS else None
+        logger.info("DynamoDB table initialized: %s", self.table.table_name)
 
-    def get_all_items(self):
+    def iter_item_pages(self, fields: tuple = None):
+        """Yield scan pages as they arrive so callers never have to hold the whole table in memory."""
         try:
-            logger.info(f"Fetching all items from table: {self.table_name}")
+            scan_kwargs = dict(build_projection(fields))
+            while True:
+                response = self.table.scan(**scan_kwargs)
+                yield response.get("Items", [])
+
+                if "LastEvaluatedKey" not in response:
+                    break
+                scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        except Exception as e:
+            error_msg = f"Error scanning items: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            raise RuntimeError(error_msg)
+
+    def get_all_items(self, fields: tuple = None):
+        try:
+            logger.info("Fetching all items from table: %s", self.table_name)
             items = []
-            response = self.table.scan()
-            items.extend(response.get("Items", []))
+            for page in self.iter_item_pages(fields):
+                items.extend(page)
 
-            while "LastEvaluatedKey" in response:
-                response = self.table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
+            logger.info("Fetched %d items from table: %s", len(items), self.table_name)
+            return items
+        except Exception as e:
+            error_msg = f"Error fetching items: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            raise RuntimeError(error_msg)
+
+    def query_index(self, index_name: str, key_condition):
+        """
+        Query a secondary index through all of its pages. On a sparse index the cost
+        follows the number of indexed items rather than the size of the table.
+        """
+        try:
+            query_kwargs = {"IndexName": index_name, "KeyConditionExpression": key_condition}
+            items = []
+            while True:
+                response = self.table.query(**query_kwargs)
                 items.extend(response.get("Items", []))
 
-            logger.info(f"Fetched {len(items)} items from table: {self.table_name}")
+                if "LastEvaluatedKey" not in response:
+                    break
+                query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+            logger.info("Fetched %d items from index %s of table: %s", len(items), index_name, self.table_name)
             return items
         except Exception as e:
-            error_msg = f"Error fetching items: {str(e)}"
+            error_msg = f"Error querying index {index_name}: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            raise RuntimeError(error_msg)
+
+    def query_partition(self, hash_key: str, value, consistent_read: bool = False):
+        """Every item under one partition key, following all query pages."""
+        try:
+            query_kwargs = {
+                "KeyConditionExpression": boto3.dynamodb.conditions.Key(hash_key).eq(value),
+                "ConsistentRead": consistent_read,
+            }
+            items = []
+            while True:
+                response = self.table.query(**query_kwargs)
+                items.extend(response.get("Items", []))
+
+                if "LastEvaluatedKey" not in response:
+                    return items
+                query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        except Exception as e:
+            error_msg = f"Error querying partition {value}: {str(e)}"
             logger.error(error_msg, exc_info=True)
             raise RuntimeError(error_msg)
 
     def create_item(self, item: dict):
         try:
-            logger.info(f"Creating item in table: {self.table_name}")
-            logger.debug(f"Item preview: {json.dumps(item, indent=2, cls=DecimalEncoder)}")
+            logger.info("Creating item in table: %s", self.table_name)
+            logger.debug("Item preview", extra={"item": item})
             self.table.put_item(Item=item)
-            logger.info(f"Item created successfully in table: {self.table_name}")
-            return {
-                "statusCode": 200,
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({"message": "Item created successfully"}, cls=DecimalEncoder),
-            }
+            logger.info("Item created successfully in table: %s", self.table_name)
+            return json_response(200, {"message": "Item created successfully"})
         except Exception as e:
             error_msg = f"Failed to create item: {str(e)}"
             logger.error(error_msg, exc_info=True)
-            return {
-                "statusCode": 500,
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({"message": "Failed to create item", "error": str(e)}, cls=DecimalEncoder),
-            }
+            return json_response(500, {"message": "Failed to create item", "error": str(e)})
 
-    def get_item(self, key: dict):
+    def get_item(self, key: dict, fields: tuple = None, consistent_read: bool = False):
         try:
-            logger.info(f"Fetching item from table: {self.table_name} with key: {key}")
-            response = self.table.get_item(Key=key)
+            logger.info("Fetching item from table: %s with key: %s", self.table_name, key)
+            read_kwargs = {"Key": key, "ConsistentRead": consistent_read, **build_projection(fields)}
+            if self.get_item_hedger:
+                # The low-level client is thread-safe, unlike the Table resource
+                response = self.get_item_hedger.call(self.client.get_item, TableName=self.table_name, **read_kwargs)
+            else:
+                response = self.table.get_item(**read_kwargs)
             item = response.get("Item", None)
-            logger.info(f"Fetched item from table: {self.table_name} with key: {key}")
+            logger.info("Fetched item from table: %s with key: %s", self.table_name, key)
             return item
         except Exception as e:
             error_msg = f"Error fetching item: {str(e)}"
             logger.error(error_msg, exc_info=True)
             raise RuntimeError(error_msg)
 
+    def batch_get_items(self, keys: list, fields: tuple = None):
+        """Fetch many items with BatchGetItem, 100 keys per request, running the chunks in parallel."""
+        try:
+            if not keys:
+                return []
+
+            projection = build_projection(fields)
+
+            chunks = [keys[i:i + BATCH_GET_MAX_KEYS] for i in range(0, len(keys), BATCH_GET_MAX_KEYS)]
+            logger.info("Batch fetching %d items from table: %s in %d chunks", len(keys), self.table_name, len(chunks))
+
+            items = []
+            with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(chunks))) as executor:
+                for chunk_items in executor.map(lambda chunk: self._batch_get_chunk(chunk, projection), chunks):
+                    items.extend(chunk_items)
+
+            logger.info("Batch fetched %d of %d items from table: %s", len(items), len(keys), self.table_name)
+            return items
+        except Exception as e:
+            error_msg = f"Error batch fetching items: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            raise RuntimeError(error_msg)
+
+    def _batch_get_chunk(self, keys: list, projection: dict):
+        """Fetch one chunk of keys, retrying UnprocessedKeys with jittered exponential backoff."""
+        request_items = {self.table_name: {"Keys": keys, **projection}}
+        items = []
+
+        for attempt in range(BATCH_GET_MAX_RETRIES + 1):
+            response = self.client.batch_get_item(RequestItems=request_items)
+            items.extend(response.get("Responses", {}).get(self.table_name, []))
+
+            request_items = response.get("UnprocessedKeys") or {}
+            if not request_items:
+                return items
+
+            if attempt < BATCH_GET_MAX_RETRIES:
+                unprocessed = len(request_items[self.table_name]["Keys"])
+                logger.warning("Retrying %s unprocessed keys for table: %s (attempt %s)", unprocessed, self.table_name, attempt + 1)
+                time.sleep(random.uniform(0, min(0.05 * 2 ** attempt, 1.0)))
+
+        raise RuntimeError(f"Keys still unprocessed after {BATCH_GET_MAX_RETRIES} retries")
+
     def delete_item(self, key: dict):
         try:
-            logger.info(f"Deleting item from table: {self.table_name} with key: {key}")
+            logger.info("Deleting item from table: %s with key: %s", self.table_name, key)
             self.table.delete_item(Key=key)
-            logger.info(f"Item deleted successfully from table: {self.table_name} with key: {key}")
-            return {
-                "statusCode": 200,
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({"message": "Item deleted successfully"}, cls=DecimalEncoder),
-            }
+            logger.info("Item deleted successfully from table: %s with key: %s", self.table_name, key)
+            return json_response(200, {"message": "Item deleted successfully"})
         except Exception as e:
             error_msg = f"Failed to delete item: {str(e)}"
             logger.error(error_msg, exc_info=True)
-            return {
-                "statusCode": 500,
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({"message": "Failed to delete item", "error": str(e)}, cls=DecimalEncoder),
-            }
+            return json_response(500, {"message": "Failed to delete item", "error": str(e)})
 
-    def update_item(self, key: dict, update_expression: str, expression_values: dict):
+    def update_item(self, key: dict, update_expression: str, expression_values: dict = None,
+                    condition_expression: str = None):
         try:
-            logger.info(f"Updating item in table: {self.table_name} with key: {key}")
-            logger.debug(f"Update expression: {update_expression}")
-            logger.debug(f"Expression values: {json.dumps(expression_values, indent=2, cls=DecimalEncoder)}")
-            self.table.update_item(
+            logger.info("Updating item in table: %s with key: %s", self.table_name, key)
+            logger.debug("Update expression: %s", update_expression, extra={"expression_values": expression_values})
+            # A REMOVE-only expression has no values, and DynamoDB rejects an empty map
+            values = {"ExpressionAttributeValues": expression_values} if expression_values else {}
+            if condition_expression:
+                values["ConditionExpression"] = condition_expression
+            # On the client, which is thread-safe: the sales counter flushes from worker threads
+            self.client.update_item(
+                TableName=self.table_name,
                 Key=key,
                 UpdateExpression=update_expression,
-                ExpressionAttributeValues=expression_values,
+                **values,
             )
-            logger.info(f"Item updated successfully in table: {self.table_name} with key: {key}")
-            return {
-                "statusCode": 200,
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({"message": "Item updated successfully"}, cls=DecimalEncoder),
-            }
+            logger.info("Item updated successfully in table: %s with key: %s", self.table_name, key)
+            return json_response(200, {"message": "Item updated successfully"})
         except Exception as e:
+            if (getattr(e, "response", None) or {}).get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                logger.info("Condition not met updating item in table: %s with key: %s", self.table_name, key)
+                return json_response(409, {"message": "Condition not met"})
             error_msg = f"Failed to update item: {str(e)}"
             logger.error(error_msg, exc_info=True)
-            return {
-                "statusCode": 500,
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({"message": "Failed to update item", "error": str(e)}, cls=DecimalEncoder),
-            }
+            return json_response(500, {"message": "Failed to update item", "error": str(e)})
 
     def batch_create_items(self, items: list):
         try:
-            logger.info(f"Starting batch create operation for {len(items)} items in table {self.table_name}")
-            logger.debug(f"First item preview: {json.dumps(items[0] if items else 'No items', indent=2, cls=DecimalEncoder)}")
+            logger.info("Starting batch create operation for %d items in table %s", len(items), self.table_name)
+            logger.debug("First item preview", extra={"first_item": items[0] if items else None})
             
             successful_items = 0
             failed_items = []
@@ -135,30 +301,24 @@ class DynamoGateway:
             with self.table.batch_writer() as batch:
                 for idx, item in enumerate(items, 1):
                     try:
-                        logger.debug(f"Writing item {idx}/{len(items)}: {item.get('product_id', 'unknown')}")
+                        logger.debug("Writing item %d/%d: %s", idx, len(items), item.get('product_id', 'unknown'))
                         batch.put_item(Item=item)
                         successful_items += 1
                     except Exception as item_error:
-                        logger.error(f"Failed to write item {idx}: {str(item_error)}")
+                        logger.error("Failed to write item %d: %s", idx, item_error)
                         failed_items.append({"item": item, "error": str(item_error)})
             
             if failed_items:
-                logger.warning(f"Batch create completed with {len(failed_items)} failures")
-                logger.debug(f"Failed items: {json.dumps(failed_items, indent=2, cls=DecimalEncoder)}")
+                logger.warning("Batch create completed with %d failures", len(failed_items))
+                logger.debug("Failed items", extra={"failed_items": failed_items})
             
-            logger.info(f"Batch create completed. Success: {successful_items}, Failed: {len(failed_items)}")
+            logger.info("Batch create completed. Success: %s, Failed: %d", successful_items, len(failed_items))
             
-            return {
-                "statusCode": 200,
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({
-                    "message": f"{successful_items} items created successfully",
-                    "failed_items": len(failed_items),
-                    "details": failed_items if failed_items else None
-                }, cls=DecimalEncoder)
-            }
+            return json_response(200, {
+                "message": f"{successful_items} items created successfully",
+                "failed_items": len(failed_items),
+                "details": failed_items if failed_items else None
+            })
         except Exception as e:
             error_msg = f"Error in batch create: {str(e)}"
             logger.error(error_msg, exc_info=True)
@@ -166,8 +326,8 @@ class DynamoGateway:
 
     def batch_delete_items(self, keys: list):
         try:
-            logger.info(f"Starting batch delete operation for {len(keys)} items in table {self.table_name}")
-            logger.debug(f"First key preview: {json.dumps(keys[0] if keys else 'No keys', indent=2, cls=DecimalEncoder)}")
+            logger.info("Starting batch delete operation for %d items in table %s", len(keys), self.table_name)
+            logger.debug("First key preview", extra={"first_key": keys[0] if keys else None})
             
             successful_items = 0
             failed_items = []
@@ -175,102 +335,286 @@ class DynamoGateway:
             with self.table.batch_writer() as batch:
                 for idx, key in enumerate(keys, 1):
                     try:
-                        logger.debug(f"Deleting item {idx}/{len(keys)}: {key.get('product_id', 'unknown')}")
+                        logger.debug("Deleting item %d/%d: %s", idx, len(keys), key.get('product_id', 'unknown'))
                         batch.delete_item(Key=key)
                         successful_items += 1
                     except Exception as item_error:
-                        logger.error(f"Failed to delete item {idx}: {str(item_error)}")
+                        logger.error("Failed to delete item %d: %s", idx, item_error)
                         failed_items.append({"key": key, "error": str(item_error)})
             
             if failed_items:
-                logger.warning(f"Batch delete completed with {len(failed_items)} failures")
-                logger.debug(f"Failed items: {json.dumps(failed_items, indent=2, cls=DecimalEncoder)}")
+                logger.warning("Batch delete completed with %d failures", len(failed_items))
+                logger.debug("Failed items", extra={"failed_items": failed_items})
             
-            logger.info(f"Batch delete completed. Success: {successful_items}, Failed: {len(failed_items)}")
+            logger.info("Batch delete completed. Success: %s, Failed: %d", successful_items, len(failed_items))
             
-            return {
-                "statusCode": 200,
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({
-                    "message": f"{successful_items} items deleted successfully",
-                    "failed_items": len(failed_items),
-                    "details": failed_items if failed_items else None
-                }, cls=DecimalEncoder)
-            }
+            return json_response(200, {
+                "message": f"{successful_items} items deleted successfully",
+                "failed_items": len(failed_items),
+                "details": failed_items if failed_items else None
+            })
         except Exception as e:
             error_msg = f"Error in batch delete: {str(e)}"
             logger.error(error_msg, exc_info=True)
             raise RuntimeError(error_msg)
         
+    def put_operation(self, item: dict, condition_expression: str = None, expression_values: dict = None):
+        """Build a Put entry for transact_write against this table."""
+        put = {"TableName": self.table_name, "Item": item}
+        if condition_expression:
+            put["ConditionExpression"] = condition_expression
+        if expression_values:
+            put["ExpressionAttributeValues"] = expression_values
+        return {"Put": put}
+
+    def update_operation(self, key: dict, update_expression: str, expression_values: dict, condition_expression: str = None,
+                         expression_names: dict = None):
+        """Build an Update entry for transact_write against this table."""
+        update = {
+            "TableName": self.table_name,
+            "Key": key,
+            "UpdateExpression": update_expression,
+            "ExpressionAttributeValues": expression_values,
+        }
+        if condition_expression:
+            update["ConditionExpression"] = condition_expression
+        if expression_names:
+            update["ExpressionAttributeNames"] = expression_names
+        return {"Update": update}
+
+    def delete_operation(self, key: dict, condition_expression: str = None, expression_values: dict = None):
+        """Build a Delete entry for transact_write against this table."""
+        delete = {"TableName": self.table_name, "Key": key}
+        if condition_expression:
+            delete["ConditionExpression"] = condition_expression
+        if expression_values:
+            delete["ExpressionAttributeValues"] = expression_values
+        return {"Delete": delete}
+
+    def transact_write(self, operations: list):
+        """
+        Apply put/update operations (possibly on several tables) atomically with TransactWriteItems.
+        Errors are re-raised unchanged so callers can inspect cancellation reasons. A failed
+        condition is an expected outcome callers retry or answer, so it is logged without a traceback.
+        """
+        try:
+            logger.info("Writing transaction of %d operations from table: %s", len(operations), self.table_name)
+            self.client.transact_write_items(TransactItems=operations)
+            return json_response(200, {"message": "Transaction committed"})
+        except Exception as e:
+            if is_condition_failure(e):
+                logger.info("Transaction cancelled by a failed condition: %s", e)
+            else:
+                logger.error("Transaction failed: %s", e, exc_info=True)
+            raise
+
+    def stock_entry_item(self, product_id, quantity, remarks):
+        """Build a ledger row for a product under a fresh ledger_key."""
+        return {
+            "product_id": product_id,
+            "datetime": ledger_key(),
+            "quantity": quantity,
+            "remarks": remarks,
+        }
+
+    def stock_entry_operation(self, product_id, quantity, remarks):
+        """Transaction put for a new ledger row that can never replace an existing one."""
+        return self.put_operation(self.stock_entry_item(product_id, quantity, remarks), LEDGER_ENTRY_CONDITION)
+
     def add_stock_entry(self, product_id, quantity, remarks):
         """Adds a stock entry for a product with a timestamp."""
-        timestamp = datetime.now(timezone.utc).isoformat() 
-
         try:
-            logger.info(f"Adding stock entry for product: {product_id}")
-            logger.debug(f"Stock entry details: product_id={product_id}, quantity={quantity}, remarks={remarks}")
+            logger.info("Adding stock entry for product: %s", product_id)
+            logger.debug("Stock entry details: product_id=%s, quantity=%s, remarks=%s", product_id, quantity, remarks)
             self.table.put_item(
-                Item={
-                    "product_id": product_id,
-                    "datetime": timestamp,
-                    "quantity": quantity,
-                    "remarks": remarks,
-                }
+                Item=self.stock_entry_item(product_id, quantity, remarks),
+                ConditionExpression=LEDGER_ENTRY_CONDITION,
             )
-            logger.info(f"Stock entry added successfully for product: {product_id}")
-            return {
-                "statusCode": 200,
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({"message": "Stock entry added successfully"}, cls=DecimalEncoder),
-            }
+            logger.info("Stock entry added successfully for product: %s", product_id)
+            return json_response(200, {"message": "Stock entry added successfully"})
         except Exception as e:
             error_msg = f"Failed to add stock entry: {str(e)}"
             logger.error(error_msg, exc_info=True)
-            return {
-                "statusCode": 500,
-                "body": json.dumps({"message": "Failed to add stock entry", "error": str(e)}, cls=DecimalEncoder),
-            }
-        
+            return json_response(500, {"message": "Failed to add stock entry", "error": str(e)})
+
     def get_stock_entries(self, product_id):
-        """Fetch stock entries for a given product_id."""
+        """Fetch every ledger entry for a product, oldest first, following all query pages."""
         try:
-            logger.info(f"Fetching stock entries for product: {product_id}")
-            response = self.table.query(
-                KeyConditionExpression=boto3.dynamodb.conditions.Key("product_id").eq(product_id)
-            )
-            items = response.get("Items", [])
-            logger.info(f"Fetched {len(items)} stock entries for product: {product_id}")
-            return items
+            logger.info("Fetching stock entries for product: %s", product_id)
+            entries = self._query_ledger_entries(product_id, scan_forward=True)
+            logger.info("Fetched %d stock entries for product: %s", len(entries), product_id)
+            return entries
         except Exception as e:
             error_msg = f"Error fetching stock entries: {str(e)}"
             logger.error(error_msg, exc_info=True)
             raise RuntimeError(error_msg)
-            
-    def search_products_by_name(self, product_name):
-        """Search for products by name using a scan with filter expression and in-memory filtering."""
+
+    def query_stock_entries(self, product_id, start=None, end=None, scan_forward=True, page_size=None, projection=None):
+        """
+        Lazily yield a product's ledger entries with start <= datetime <= end, one query page
+        at a time, so callers stop reading as soon as they have the window they need.
+        The key condition stops at LEDGER_ENTRY_KEY_MAX, so snapshot rows are never read as entries.
+        page_size caps each page (Limit); projection is e.g. LEDGER_HISTORY_PROJECTION.
+        """
+        conditions = boto3.dynamodb.conditions
+        key_condition = conditions.Key("product_id").eq(product_id) & conditions.Key("datetime").between(
+            start or LEDGER_ENTRY_KEY_MIN, end or LEDGER_ENTRY_KEY_MAX
+        )
+        query_kwargs = {
+            "TableName": self.table_name,
+            "KeyConditionExpression": key_condition,
+            "ScanIndexForward": scan_forward,
+            **(projection or {}),
+        }
+        if page_size:
+            query_kwargs["Limit"] = page_size
+        while True:
+            response = self.client.query(**query_kwargs)
+            yield response.get("Items", [])
+
+            if "LastEvaluatedKey" not in response:
+                break
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def _query_ledger_entries(self, product_id, after=None, scan_forward=False):
+        """Ledger entries strictly newer than the `after` key (all of them when None)."""
+        entries = []
+        for page in self.query_stock_entries(product_id, start=after, scan_forward=scan_forward):
+            # between is inclusive; the entry at `after` is already counted by the snapshot
+            entries.extend(entry for entry in page if entry["datetime"] != after)
+        return entries
+
+    def get_latest_snapshot(self, product_id):
+        """Return the newest ledger snapshot row for a product, or None."""
+        conditions = boto3.dynamodb.conditions
+        response = self.client.query(
+            TableName=self.table_name,
+            KeyConditionExpression=conditions.Key("product_id").eq(product_id)
+            & conditions.Key("datetime").begins_with(LEDGER_SNAPSHOT_PREFIX),
+            ScanIndexForward=False,
+            Limit=1,
+        )
+        items = response.get("Items", [])
+        return items[0] if items else None
+
+    def get_rollups(self, product_id, first_day, last_day):
+        """
+        Daily rollup rows for first_day..last_day (ISO dates, inclusive), oldest first,
+        including rows keyed rollup#<day>#<suffix> ('~' sorts after any suffix).
+        """
+        conditions = boto3.dynamodb.conditions
+        query_kwargs = {
+            "TableName": self.table_name,
+            "KeyConditionExpression": conditions.Key("product_id").eq(product_id) & conditions.Key("datetime").between(
+                f"{LEDGER_ROLLUP_PREFIX}{first_day}", f"{LEDGER_ROLLUP_PREFIX}{last_day}~"
+            ),
+        }
+        rollups = []
+        while True:
+            response = self.client.query(**query_kwargs)
+            rollups.extend(response.get("Items", []))
+
+            if "LastEvaluatedKey" not in response:
+                return rollups
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def get_stock_total(self, product_id):
+        """
+        Reconstruct a product's ledger total from its latest snapshot plus the entries written
+        after it, so the cost does not grow with the age of the product. Returns None when the
+        product has no ledger at all. Once LEDGER_SNAPSHOT_EVERY entries have piled up past
+        the snapshot, a newer snapshot is written on the way out.
+        get_stock_totals runs this from worker threads, so every call in it goes through
+        self.client; the resource Table is not thread-safe.
+        """
+        try:
+            snapshot = self.get_latest_snapshot(product_id)
+            entries = self._query_ledger_entries(product_id, after=snapshot["as_of"] if snapshot else None)
+            if snapshot is None and not entries:
+                return None
+
+            base = int(snapshot["total"]) if snapshot else 0
+            total = base + sum(int(entry["quantity"]) for entry in entries)
+            if len(entries) >= LEDGER_SNAPSHOT_EVERY:
+                self._write_snapshot(product_id, base, entries)
+            return total
+        except Exception as e:
+            error_msg = f"Error fetching stock total: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            raise RuntimeError(error_msg)
+
+    def _write_snapshot(self, product_id, base, entries):
+        """
+        Fold the entries older than LEDGER_SNAPSHOT_LAG_SECONDS into a new snapshot row. The lag
+        keeps entries that may still be in flight out of it; a failed write only costs a later retry.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=LEDGER_SNAPSHOT_LAG_SECONDS)
+        # The snapshot must cover a prefix of the table's key order, so stop at the first entry that is too new
+        covered = list(itertools.takewhile(
+            lambda entry: parse_ledger_key(entry["datetime"]) <= cutoff,
+            sorted(entries, key=lambda entry: entry["datetime"]),
+        ))
+        if not covered:
+            return
+
+        as_of = covered[-1]["datetime"]
+        try:
+            self.client.put_item(TableName=self.table_name, Item={
+                "product_id": product_id,
+                "datetime": f"{LEDGER_SNAPSHOT_PREFIX}{as_of}",
+                "as_of": as_of,
+                "total": base + sum(int(entry["quantity"]) for entry in covered),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            })
+            logger.info("Wrote ledger snapshot for product %s as of %s covering %d new entries", product_id, as_of, len(covered))
+        except Exception as e:
+            logger.warning("Failed to write ledger snapshot for product %s: %s", product_id, e)
+
+    def get_stock_totals(self, product_ids: list):
+        """
+        Resolve the ledger total for many products in one parallel pass.
+        Products without ledger entries map to None so callers can fall back to the product quantity.
+        """
+        try:
+            if not product_ids:
+                return {}
+
+            logger.info("Fetching stock totals for %d products", len(product_ids))
+            with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(product_ids))) as executor:
+                return dict(zip(product_ids, executor.map(self.get_stock_total, product_ids)))
+        except Exception as e:
+            error_msg = f"Error fetching stock totals: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            raise RuntimeError(error_msg)
+
+    def search_products_by_name(self, product_name, fields: tuple = None):
+        """
+        Search for products by name using a scan with filter expression and in-memory filtering.
+        When fields are given, product_name is always projected as the search runs against it.
+        """
         try:
-            logger.info(f"Searching for products with name containing: {product_name}")
+            logger.info("Searching for products with name containing: %s", product_name)
             # Convert to lowercase for case-insensitive search
             search_term = product_name.lower().strip()
             
             # Get all products first, then filter in memory for case-insensitive matching
             # This is more reliable than depending on DynamoDB's case-sensitive filtering
-            logger.info(f"Getting all products to perform case-insensitive search")
-            response = self.table.scan()
+            logger.info("Getting all products to perform case-insensitive search")
+            if fields and "product_name" not in fields:
+                fields = fields + ("product_name",)
+            projection = build_projection(fields)
+            response = self.table.scan(**projection)
             all_products = response.get("Items", [])
             
             # Continue scanning if there are more items (pagination)
             while 'LastEvaluatedKey' in response:
                 response = self.table.scan(
-                    ExclusiveStartKey=response['LastEvaluatedKey']
+                    ExclusiveStartKey=response['LastEvaluatedKey'],
+                    **projection
                 )
                 all_products.extend(response.get("Items", []))
             
-            logger.info(f"Retrieved {len(all_products)} total products for filtering")
+            logger.info("Retrieved %d total products for filtering", len(all_products))
             
             # Perform in-memory filtering for case-insensitive matching
             filtered_products = []
@@ -298,7 +642,7 @@ class DynamoGateway:
             # Combine the results with exact beginning matches first
             sorted_products = exact_beginning_matches + other_matches
             
-            logger.info(f"Found {len(sorted_products)} products matching '{product_name}'")
+            logger.info("Found %d products matching '%s'", len(sorted_products), product_name)
             return sorted_products
         except Exception as e:
             error_msg = f"Error searching for products by name: {str(e)}"
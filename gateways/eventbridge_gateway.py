@@ -1,37 +1,95 @@
 import boto3
 import json
+import time
 from utils.logger import logger
+from utils.metrics import instrument_gateway, register_client_hooks
+from utils.circuit_breaker import get_breaker
+from gateways.transport import SIDE_EFFECT_CONFIG
+from gateways.spool import EventSpool
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
+@instrument_gateway("eventbridge")
 class EventBridgeGateway:
     def __init__(self, region_name="us-east-2"):
-        self.client = boto3.client('events', region_name=region_name)
+        # Fails fast: PutEvents falls back to the spool instead of spending the full retry budget
+        self.client = register_client_hooks(boto3.client('events', region_name=region_name, config=SIDE_EFFECT_CONFIG), "eventbridge")
+        self.breaker = get_breaker("eventbridge")
+        self.spool = EventSpool("eventbridge")
         self.event_bus_name = os.environ.get('EVENT_BUS_NAME', 'default')
-        logger.info(f"Initialized EventBridge gateway in region {region_name} using event bus: {self.event_bus_name}")
+        logger.info("Initialized EventBridge gateway in region %s using event bus: %s", region_name, self.event_bus_name)
 
     def put_events(self, entries):
         """
         Put events to EventBridge
         entries: List of event entries to put
+
+        While the eventbridge circuit is open, or when the call fails, the entries are
+        spooled to S3 for replay instead of raising, so callers keep their normal latency.
         """
+        # Ensure all entries have the EventBusName set
+        for entry in entries:
+            if 'EventBusName' not in entry:
+                entry['EventBusName'] = self.event_bus_name
+
+        if not self.breaker.allow():
+            logger.warning("EventBridge circuit open, spooling %d events", len(entries))
+            self.spool.spool(entries, reason="circuit_open")
+            return {"FailedEntryCount": 0, "Entries": [], "Spooled": len(entries)}
+
+        logger.info("Putting %d events to EventBridge bus: %s", len(entries), self.event_bus_name)
+        logger.debug("Event entries", extra={"entries": entries})
+
+        start = time.perf_counter()
         try:
-            # Ensure all entries have the EventBusName set
-            for entry in entries:
-                if 'EventBusName' not in entry:
-                    entry['EventBusName'] = self.event_bus_name
-            
-            logger.info(f"Putting {len(entries)} events to EventBridge bus: {self.event_bus_name}")
-            logger.debug(f"Event entries: {json.dumps(entries, indent=2)}")
-            
             response = self.client.put_events(Entries=entries)
-            logger.info(f"Successfully put events. Response: {json.dumps(response, indent=2)}")
-            return response
         except Exception as e:
-            logger.error(f"Failed to put events: {str(e)}", exc_info=True)
-            raise
+            self.breaker.record_failure()
+            logger.error("Failed to put events: %s", e, exc_info=True)
+            self.spool.spool(entries, reason=str(e))
+            return {"FailedEntryCount": len(entries), "Entries": [], "Spooled": len(entries)}
+        self.breaker.record_success((time.perf_counter() - start) * 1000)
+
+        logger.info("Successfully put events", extra={"failed_entry_count": response.get("FailedEntryCount", 0)})
+        logger.debug("Put events response", extra={"response": response})
+
+        if response.get("FailedEntryCount"):
+            failed = [entry for entry, result in zip(entries, response.get("Entries", [])) if result.get("ErrorCode")]
+            self.spool.spool(failed, reason="partial_failure")
+            response["Spooled"] = len(failed)
+        return response
+
+    def put_event_batch(self, entries):
+        """
+        Put up to 10 entries in one PutEvents call without spooling. The indexes of
+        entries that were not delivered are returned under "failed"; the outbox relay
+        keeps those rows and retries them itself.
+        """
+        if not self.breaker.allow():
+            logger.warning("EventBridge circuit open, leaving %d events in the outbox", len(entries))
+            return {"failed": list(range(len(entries)))}
+
+        start = time.perf_counter()
+        try:
+            response = self.client.put_events(Entries=entries)
+        except Exception as e:
+            self.breaker.record_failure()
+            logger.error("Failed to put event batch: %s", e)
+            return {"failed": list(range(len(entries)))}
+        self.breaker.record_success((time.perf_counter() - start) * 1000)
+
+        return {"failed": [idx for idx, result in enumerate(response.get("Entries", [])) if result.get("ErrorCode")]}
+
+    def replay_spooled_events(self, limit=None):
+        """Re-publish spooled entries, oldest first, while the circuit allows it."""
+        def send(entries):
+            response = self.client.put_events(Entries=entries)
+            if response.get("FailedEntryCount"):
+                raise RuntimeError(f"{response['FailedEntryCount']} of {len(entries)} events failed")
+
+        return self.spool.replay(send, self.breaker, limit)
 
     def create_rule(self, name, schedule_expression, description="", state="ENABLED", event_bus_name=None):
         """
@@ -43,12 +101,12 @@ class EventBridgeGateway:
         try:
             # Use provided event bus name or fall back to default
             bus_name = event_bus_name or self.event_bus_name
-            logger.info(f"Creating rule '{name}' with schedule {schedule_expression} on event bus {bus_name}")
+            logger.info("Creating rule '%s' with schedule %s on event bus %s", name, schedule_expression, bus_name)
             
             # For scheduled rules, we need to use the default event bus
             if schedule_expression.startswith('rate(') or schedule_expression.startswith('cron('):
                 bus_name = 'default'
-                logger.info(f"Using default event bus for scheduled rule as required by EventBridge")
+                logger.info("Using default event bus for scheduled rule as required by EventBridge")
             
             response = self.client.put_rule(
                 Name=name,
@@ -57,10 +115,10 @@ class EventBridgeGateway:
                 Description=description,
                 EventBusName=bus_name
             )
-            logger.info(f"Successfully created rule. Response: {json.dumps(response, indent=2)}")
+            logger.info("Successfully created rule", extra={"rule_arn": response.get("RuleArn")})
             return response
         except Exception as e:
-            logger.error(f"Failed to create rule: {str(e)}", exc_info=True)
+            logger.error("Failed to create rule: %s", e, exc_info=True)
             raise
             
     def put_single_event(self, source, detail_type, detail):
@@ -78,12 +136,12 @@ class EventBridgeGateway:
                 'EventBusName': self.event_bus_name
             }
             
-            logger.info(f"Putting event to EventBridge bus: {self.event_bus_name}")
-            logger.debug(f"Event entry: {json.dumps(entry, indent=2)}")
+            logger.info("Putting event to EventBridge bus: %s", self.event_bus_name)
+            logger.debug("Event entry", extra={"entry": entry})
             
             return self.put_events([entry])
         except Exception as e:
-            logger.error(f"Failed to put event: {str(e)}", exc_info=True)
+            logger.error("Failed to put event: %s", e, exc_info=True)
             raise
             
     def create_event_pattern_rule(self, name, event_pattern, targets, description="", state="ENABLED"):
@@ -94,8 +152,8 @@ class EventBridgeGateway:
         targets: List of targets for the rule
         """
         try:
-            logger.info(f"Creating rule '{name}' with event pattern on event bus {self.event_bus_name}")
-            logger.debug(f"Event pattern: {json.dumps(event_pattern, indent=2)}")
+            logger.info("Creating rule '%s' with event pattern on event bus %s", name, self.event_bus_name)
+            logger.debug("Event pattern", extra={"event_pattern": event_pattern})
             
             # Create the rule
             rule_response = self.client.put_rule(
@@ -113,16 +171,15 @@ class EventBridgeGateway:
                 Targets=targets
             )
             
-            logger.info(f"Successfully created rule and targets")
-            logger.debug(f"Rule response: {json.dumps(rule_response, indent=2)}")
-            logger.debug(f"Targets response: {json.dumps(targets_response, indent=2)}")
+            logger.info("Successfully created rule and targets")
+            logger.debug("Rule and targets responses", extra={"rule_response": rule_response, "targets_response": targets_response})
             
             return {
                 'RuleResponse': rule_response,
                 'TargetsResponse': targets_response
             }
         except Exception as e:
-            logger.error(f"Failed to create rule with event pattern: {str(e)}", exc_info=True)
+            logger.error("Failed to create rule with event pattern: %s", e, exc_info=True)
             raise
             
     def add_targets_to_rule(self, rule_name, targets, event_bus_name=None):
@@ -134,8 +191,8 @@ class EventBridgeGateway:
         """
         try:
             bus_name = event_bus_name or self.event_bus_name
-            logger.info(f"Adding {len(targets)} targets to rule '{rule_name}' on event bus {bus_name}")
-            logger.debug(f"Targets: {json.dumps(targets, indent=2)}")
+            logger.info("Adding %d targets to rule '%s' on event bus %s", len(targets), rule_name, bus_name)
+            logger.debug("Targets", extra={"targets": targets})
             
             response = self.client.put_targets(
                 Rule=rule_name,
@@ -143,8 +200,8 @@ class EventBridgeGateway:
                 Targets=targets
             )
             
-            logger.info(f"Successfully added targets. Response: {json.dumps(response, indent=2)}")
+            logger.info("Successfully added targets", extra={"failed_entry_count": response.get("FailedEntryCount", 0)})
             return response
         except Exception as e:
-            logger.error(f"Failed to add targets to rule: {str(e)}", exc_info=True)
+            logger.error("Failed to add targets to rule: %s", e, exc_info=True)
             raise
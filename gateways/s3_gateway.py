@@ -3,28 +3,75 @@ import os
 import urllib.parse
 import csv
 from utils.logger import logger
+from utils.metrics import instrument_gateway, register_client_hooks
+from gateways.transport import TRANSPORT_CONFIG
 
+@instrument_gateway("s3", exclude=("read_csv", "get_file_key_from_event", "is_valid_file"))
 class S3Gateway:
     def __init__(self, bucket_name: str):
         self.bucket_name = bucket_name
-        self.s3_client = boto3.client('s3', region_name='us-east-2')
+        self.s3_client = register_client_hooks(boto3.client('s3', region_name='us-east-2', config=TRANSPORT_CONFIG), "s3")
     
     def download_file(self, key: str, local_filename: str):
         try:
-            logger.info(f"Downloading file from S3: {self.bucket_name}/{key}")
+            logger.info("Downloading file from S3: %s/%s", self.bucket_name, key)
             self.s3_client.download_file(self.bucket_name, key, local_filename)
             return local_filename
         except Exception as e:
-            logger.error(f"Error downloading file from S3: {str(e)}")
+            logger.error("Error downloading file from S3: %s", e)
+            raise e
+
+    def upload_file(self, local_filename: str, key: str):
+        try:
+            logger.info("Uploading file to S3: %s/%s", self.bucket_name, key)
+            self.s3_client.upload_file(local_filename, self.bucket_name, key)
+            return key
+        except Exception as e:
+            logger.error("Error uploading file to S3: %s", e)
             raise e
     
+    def put_object(self, key: str, body, content_type: str = "application/json", metadata: dict = None):
+        try:
+            extra = {"Metadata": metadata} if metadata else {}
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=body, ContentType=content_type, **extra)
+            return key
+        except Exception as e:
+            logger.error("Error writing object to S3: %s", e)
+            raise e
+
+    def get_object(self, key: str):
+        try:
+            return self.s3_client.get_object(Bucket=self.bucket_name, Key=key)["Body"].read()
+        except Exception as e:
+            logger.error("Error reading object from S3: %s", e)
+            raise e
+
+    def iter_key_pages(self, prefix: str, start_after: str = None):
+        """Yield every key under prefix (after start_after, if given) in key order, one listing page at a time."""
+        try:
+            list_kwargs = {"Bucket": self.bucket_name, "Prefix": prefix}
+            if start_after:
+                list_kwargs["StartAfter"] = start_after
+            for page in self.s3_client.get_paginator("list_objects_v2").paginate(**list_kwargs):
+                yield [obj["Key"] for obj in page.get("Contents", [])]
+        except Exception as e:
+            logger.error("Error listing objects in S3: %s", e)
+            raise e
+
+    def delete_object(self, key: str):
+        try:
+            self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+        except Exception as e:
+            logger.error("Error deleting object from S3: %s", e)
+            raise e
+
     def read_csv(self, local_filename: str):
         try:
             with open(local_filename, 'r') as f:
                 csv_reader = csv.DictReader(f)
                 return [row for row in csv_reader]
         except Exception as e:
-            logger.error(f"Error reading CSV file: {str(e)}")
+            logger.error("Error reading CSV file: %s", e)
             raise e
 
     def get_file_key_from_event(self, event):
@@ -0,0 +1,72 @@
+import os
+import uuid
+from datetime import datetime, timezone
+
+from gateways.s3_gateway import S3Gateway
+from utils.logger import logger
+from utils.serialization import dumps, loads
+
+S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+SPOOL_PREFIX = os.getenv("SPOOL_PREFIX", "spool/")
+
+
+class EventSpool:
+    """
+    DLQ-style fallback for side effects that could not be delivered: each payload is
+    written as one S3 object under spool/<dependency>/, keyed by UTC time so listing
+    returns them oldest first, and replayed through the dependency once it recovers.
+    """
+
+    def __init__(self, dependency: str, bucket_name: str = S3_BUCKET_NAME):
+        self.dependency = dependency
+        self.bucket_name = bucket_name
+        self.prefix = f"{SPOOL_PREFIX}{dependency}/"
+        self._s3 = None
+
+    @property
+    def s3(self):
+        # Built on first spool or replay so healthy invocations never pay for an extra client
+        if self._s3 is None:
+            self._s3 = S3Gateway(self.bucket_name)
+        return self._s3
+
+    def spool(self, payload, reason: str):
+        now = datetime.now(timezone.utc)
+        key = f"{self.prefix}{now:%Y/%m/%d/%H%M%S%f}-{uuid.uuid4().hex[:8]}.json"
+        record = {"dependency": self.dependency, "reason": reason, "spooled_at": now.isoformat(), "payload": payload}
+        try:
+            self.s3.put_object(key, dumps(record))
+            logger.warning("Spooled %s payload to s3://%s/%s", self.dependency, self.bucket_name, key, extra={"reason": reason})
+            return key
+        except Exception as e:
+            # Last resort: the log line is the only copy left of this payload
+            logger.error("Failed to spool %s payload: %s", self.dependency, e, extra={"payload": payload, "reason": reason})
+            return None
+
+    def replay(self, send, breaker, limit: int = None):
+        """
+        Re-send spooled payloads oldest first with send(payload), deleting each once it
+        is delivered. Stops at the first failure or when the breaker refuses calls.
+        """
+        replayed = 0
+        for keys in self.s3.iter_key_pages(self.prefix):
+            for key in keys:
+                if limit is not None and replayed >= limit:
+                    return {"replayed": replayed, "drained": False}
+                if not breaker.allow():
+                    logger.info("Circuit for %s still open, stopping replay after %d payloads", self.dependency, replayed)
+                    return {"replayed": replayed, "drained": False}
+                record = loads(self.s3.get_object(key))
+                try:
+                    send(record["payload"])
+                except Exception as e:
+                    breaker.record_failure()
+                    logger.warning("Replay of %s failed, stopping: %s", key, e)
+                    return {"replayed": replayed, "drained": False}
+                breaker.record_success()
+                self.s3.delete_object(key)
+                replayed += 1
+
+        if replayed:
+            logger.info("Replayed %d spooled %s payloads", replayed, self.dependency)
+        return {"replayed": replayed, "drained": True}
@@ -1,10 +1,19 @@
 import boto3
 import json
+import time
 import string
 import random
 import csv
 import os
+from functools import lru_cache
 from utils.logger import logger
+from utils.metrics import instrument_gateway, register_client_hooks
+from utils.circuit_breaker import get_breaker
+from utils.serialization import dumps
+from utils.stock_levels import apply_low_stock_bucket
+from gateways.transport import SIDE_EFFECT_CONFIG, TRANSPORT_CONFIG
+from gateways.spool import EventSpool
+from utils.invocation import lambda_handler
 from dotenv import load_dotenv
 from gateways.dynamo_gateway import DynamoGateway
 
@@ -14,32 +23,79 @@ SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")  
 TABLE_NAME = os.getenv("TABLE_NAME")  
 
+@instrument_gateway("sqs", exclude=("generate_code",))
 class SQSService:
     def __init__(self, region="us-east-2"):
-        self.sqs_client = boto3.client('sqs', region_name=region)
+        self.sqs_client = register_client_hooks(boto3.client('sqs', region_name=region, config=SIDE_EFFECT_CONFIG), "sqs")
         self.queue_url = SQS_QUEUE_URL
+        self.breaker = get_breaker("sqs")
+        self.spool = EventSpool("sqs")
 
     def send_to_sqs(self, data):
+        # While the sqs circuit is open, or when the send fails, the message goes to the S3 spool
+        if not self.breaker.allow():
+            logger.warning("SQS circuit open, spooling message")
+            self.spool.spool(data, reason="circuit_open")
+            return {
+                'statusCode': 202,
+                'body': json.dumps({'message': 'SQS unavailable, message spooled for replay'})
+            }
+
+        start = time.perf_counter()
         try:
             response = self.sqs_client.send_message(
                 QueueUrl=self.queue_url,
-                MessageBody=json.dumps(data)
+                MessageBody=dumps(data)
             )
-            return {
-                'statusCode': 200,
-                'body': json.dumps({'message': 'Product created and message sent to SQS', 'response': response})
-            }
         except Exception as e:
+            self.breaker.record_failure()
+            logger.error("Error sending message to SQS: %s", e)
+            self.spool.spool(data, reason=str(e))
             return {
-                'statusCode': 500,
-                'body': json.dumps({'message': 'Error sending message to SQS', 'error': str(e)})
+                'statusCode': 202,
+                'body': json.dumps({'message': 'Error sending message to SQS, message spooled for replay', 'error': str(e)})
             }
+        self.breaker.record_success((time.perf_counter() - start) * 1000)
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'Product created and message sent to SQS', 'response': response})
+        }
+
+    def send_message_batch(self, bodies):
+        """
+        Send up to 10 already serialized message bodies in one SendMessageBatch call without
+        spooling. The indexes of messages that were not delivered are returned under "failed".
+        """
+        if not self.breaker.allow():
+            logger.warning("SQS circuit open, leaving %d messages in the outbox", len(bodies))
+            return {"failed": list(range(len(bodies)))}
+
+        start = time.perf_counter()
+        try:
+            response = self.sqs_client.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{"Id": str(idx), "MessageBody": body} for idx, body in enumerate(bodies)]
+            )
+        except Exception as e:
+            self.breaker.record_failure()
+            logger.error("Error sending message batch to SQS: %s", e)
+            return {"failed": list(range(len(bodies)))}
+        self.breaker.record_success((time.perf_counter() - start) * 1000)
+
+        return {"failed": [int(failure["Id"]) for failure in response.get("Failed", [])]}
+
+    def replay_spooled_messages(self, limit=None):
+        """Re-send spooled messages, oldest first, while the circuit allows it."""
+        def send(data):
+            self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=dumps(data))
+
+        return self.spool.replay(send, self.breaker, limit)
 
     def receive_message_from_sqs(self, event, context):
         try:
             logger.info("=== Starting SQS message processing ===")
-            logger.info(f"Environment check - TABLE_NAME: {TABLE_NAME}")
-            logger.info(f"Received event with {len(event.get('Records', []))} records")
+            logger.info("Environment check - TABLE_NAME: %s", TABLE_NAME)
+            logger.info("Received event with %d records", len(event.get('Records', [])))
             
             fieldnames = ["product_id", "product_name", "price", "quantity"]
             file_randomized_prefix = self.generate_code("pycon_", 8)
@@ -48,7 +104,7 @@ class SQSService:
             object_name = f'product_created_{file_randomized_prefix}.csv'
             
             # Initialize DynamoDB gateway
-            logger.info(f"Initializing DynamoDB gateway with table: {TABLE_NAME}")
+            logger.info("Initializing DynamoDB gateway with table: %s", TABLE_NAME)
             dynamo_gateway = DynamoGateway(TABLE_NAME)
             
             # Collect all products to be created
@@ -61,50 +117,64 @@ class SQSService:
                 writer.writeheader()
                 
                 for idx, payload in enumerate(event["Records"], 1):
-                    logger.info(f"Processing record {idx}")
+                    logger.debug("Processing record %d", idx)
                     try:
                         json_payload = json.loads(payload["body"])
-                        logger.debug(f"Message payload: {json.dumps(json_payload)}")
+                        logger.debug("Message payload", extra={"payload": json_payload})
                         
                         if isinstance(json_payload, list):
-                            logger.info(f"Found batch of {len(json_payload)} products")
+                            logger.info("Found batch of %d products", len(json_payload))
                             for product in json_payload:
-                                logger.debug(f"Processing product: {product.get('product_id', 'unknown')}")
+                                logger.debug("Processing product: %s", product.get('product_id', 'unknown'))
                                 all_products.append(product)
                                 writer.writerow(product)
                         else:
-                            logger.debug(f"Processing single product: {json_payload.get('product_id', 'unknown')}")
+                            logger.debug("Processing single product: %s", json_payload.get('product_id', 'unknown'))
                             all_products.append(json_payload)
                             writer.writerow(json_payload)
                     except json.JSONDecodeError as je:
-                        logger.error(f"Failed to parse message body: {str(je)}")
+                        logger.error("Failed to parse message body: %s", je)
                         continue
             
             # Write to DynamoDB
             if all_products:
-                logger.info(f"Writing {len(all_products)} products to DynamoDB table: {TABLE_NAME}")
+                for product in all_products:
+                    apply_low_stock_bucket(product)
+                logger.info("Writing %d products to DynamoDB table: %s", len(all_products), TABLE_NAME)
                 try:
                     batch_response = dynamo_gateway.batch_create_items(all_products)
-                    logger.info(f"DynamoDB response: {json.dumps(batch_response)}")
+                    logger.info("DynamoDB response", extra={"status_code": batch_response.get("statusCode")})
                 except Exception as db_error:
-                    logger.error(f"DynamoDB write failed: {str(db_error)}")
+                    logger.error("DynamoDB write failed: %s", db_error)
                     raise db_error
             else:
                 logger.warning("No products found to write to DynamoDB")
             
             # Upload CSV to S3
-            logger.info(f"Uploading CSV to S3: {bucket}/{object_name}")
-            s3_client = boto3.client('s3')
+            logger.info("Uploading CSV to S3: %s/%s", bucket, object_name)
+            s3_client = register_client_hooks(boto3.client('s3', config=TRANSPORT_CONFIG), "s3")
             s3_client.upload_file(file_name, bucket, object_name)
             
-            logger.info(f"Successfully processed {len(all_products)} products")
+            logger.info("Successfully processed %d products", len(all_products))
             logger.info("=== SQS message processing completed ===")
             return {}
             
         except Exception as e:
-            logger.error(f"Error in receive_message_from_sqs: {str(e)}", exc_info=True)
+            logger.error("Error in receive_message_from_sqs: %s", e, exc_info=True)
             return {"statusCode": 500, "body": f"Error: {str(e)}"}
 
     def generate_code(self, prefix, string_length):
         letters = string.ascii_uppercase
         return prefix + ''.join(random.choice(letters) for i in range(string_length))
+
+
+@lru_cache(maxsize=None)
+def sqs_service():
+    """The SQSService of the receive handler, built on its first invocation rather than on every import."""
+    return SQSService()
+
+
+@lambda_handler(allocation_sites=True)
+def receive_message_from_sqs(event, context):
+    """Entry point for the receiveMessagesFromSqs function in serverless.yml."""
+    return sqs_service().receive_message_from_sqs(event, context)
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+
+from botocore.config import Config
+
+from utils.logger import logger
+from utils.metrics import metrics
+from utils.tracing import annotate
+
+# Shared botocore transport settings for every gateway client.
+#
+#   AWS_CONNECT_TIMEOUT        seconds to establish a connection, defaults to 1
+#   AWS_READ_TIMEOUT           seconds to wait on a socket read, defaults to 5
+#   AWS_MAX_ATTEMPTS           total attempts including the first, defaults to 4
+#   SIDE_EFFECT_READ_TIMEOUT   read timeout for EventBridge/SQS publishing, defaults to 2
+#   SIDE_EFFECT_MAX_ATTEMPTS   attempts for EventBridge/SQS publishing, defaults to 2
+#   HEDGED_READS               "true" to hedge DynamoDB get_item calls (see Hedger)
+#   HEDGE_MIN_DELAY_MS         floor for the hedge delay, defaults to 5
+
+CONNECT_TIMEOUT = float(os.getenv("AWS_CONNECT_TIMEOUT", "1"))
+READ_TIMEOUT = float(os.getenv("AWS_READ_TIMEOUT", "5"))
+MAX_ATTEMPTS = int(os.getenv("AWS_MAX_ATTEMPTS", "4"))
+
+# Threads used by the DynamoDB gateway for BatchGetItem chunks and ledger queries
+BATCH_MAX_WORKERS = 8
+# Room for every batch worker plus a hedged duplicate of each, so no request waits on the pool
+MAX_POOL_CONNECTIONS = BATCH_MAX_WORKERS * 2
+
+# Publishing sits behind a circuit breaker with an S3 spool, so it fails fast instead of
+# spending the full retry budget inside the request
+SIDE_EFFECT_READ_TIMEOUT = float(os.getenv("SIDE_EFFECT_READ_TIMEOUT", "2"))
+SIDE_EFFECT_MAX_ATTEMPTS = int(os.getenv("SIDE_EFFECT_MAX_ATTEMPTS", "2"))
+
+HEDGED_READS = os.getenv("HEDGED_READS", "false").lower() == "true"
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "5"))
+# Latencies observed before the p95 is trusted; calls are not hedged until then
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+HEDGE_THREAD_PREFIX = "hedge"
+
+TRANSPORT_CONFIG = Config(
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=READ_TIMEOUT,
+    retries={"mode": "adaptive", "max_attempts": MAX_ATTEMPTS},
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+)
+
+SIDE_EFFECT_CONFIG = TRANSPORT_CONFIG.merge(Config(
+    read_timeout=SIDE_EFFECT_READ_TIMEOUT,
+    retries={"mode": "adaptive", "max_attempts": SIDE_EFFECT_MAX_ATTEMPTS},
+))
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies, used to pick the hedge delay."""
+
+    def __init__(self, window=HEDGE_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms):
+        with self._lock:
+            self._samples.append(latency_ms)
+
+    def percentile(self, fraction):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+def hedge_executor():
+    """The process-wide pool running hedged requests, created on first use."""
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=MAX_POOL_CONNECTIONS,
+                                                 thread_name_prefix=HEDGE_THREAD_PREFIX)
+        return _hedge_executor
+
+
+@lru_cache(maxsize=None)
+def hedger(dependency, operation):
+    """The Hedger shared by every gateway calling operation, so they share one latency window."""
+    return Hedger(dependency, operation)
+
+
+class Hedger:
+    """
+    Runs an idempotent read and, if it has not answered within the recent p95
+    latency, sends an identical second request and returns whichever finishes first.
+    Only the slowest ~5% of calls pay for a second request. Until the p95 is known,
+    and on hedge threads themselves, the read is simply made on the calling thread.
+    """
+
+    def __init__(self, dependency, operation):
+        self.dependency = dependency
+        self.operation = operation
+        self.latencies = LatencyTracker()
+
+    def _timed(self, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.latencies.record((time.perf_counter() - started) * 1000)
+        return result
+
+    def call(self, func, *args, **kwargs):
+        p95 = self.latencies.percentile(0.95)
+        if p95 is None or threading.current_thread().name.startswith(HEDGE_THREAD_PREFIX):
+            return self._timed(func, *args, **kwargs)
+
+        delay = max(HEDGE_MIN_DELAY_MS, p95) / 1000
+        executor = hedge_executor()
+        primary = executor.submit(self._timed, func, *args, **kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        logger.debug("Hedging %s after %.1f ms", self.operation, delay * 1000)
+        annotate("hedged", True)
+        # Recorded as its own operation so hedge rate and delay show up next to GetItem
+        metrics.record(self.dependency, f"{self.operation}Hedge", delay * 1000)
+        pending = {primary, executor.submit(self._timed, func, *args, **kwargs)}
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The slower request is left to finish in the background; its answer is discarded
+                    return future.result()
+                error = future.exception()
+        raise error
+
@@ -0,0 +1,70 @@
+import time
+
+from models.analytics_model import (
+    FORECAST_DEFAULT_ROLLING_DAYS, FORECAST_DEFAULT_WINDOW_DAYS, FORECAST_MAX_WINDOW_DAYS, AnalyticsModel,
+)
+from utils.logger import logger
+from utils.invocation import lambda_handler
+from utils.serialization import json_response
+
+analytics_model = AnalyticsModel()
+
+# Leave this much of the invocation for the product being folded when the budget runs out
+REFRESH_TIME_MARGIN_MS = 30_000
+
+def bounded_int(query_parameters, name, default, low, high):
+    value = query_parameters.get(name)
+    if value is None:
+        return default
+    value = int(value)
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+@lambda_handler
+def refresh_sales_rollups(event, context):
+    """
+    Fold ledger entries written since the last run into the daily sales rollups.
+    Triggered on a schedule; a run that hits its time budget is picked up by the next one.
+    """
+    try:
+        deadline = None
+        if hasattr(context, 'get_remaining_time_in_millis'):
+            deadline = time.monotonic() + (context.get_remaining_time_in_millis() - REFRESH_TIME_MARGIN_MS) / 1000
+
+        return json_response(200, analytics_model.refresh_rollups(deadline))
+    except Exception as e:
+        logger.error("Failed to refresh sales rollups: %s", e)
+        return json_response(500, {
+            "message": "Failed to refresh sales rollups",
+            "error": str(e)
+        })
+
+@lambda_handler
+def get_stockout_forecast(event, context):
+    """
+    Products ordered by projected days to stockout, from the daily sales rollups.
+    Query parameters:
+        window   days of sales history, defaults to 28, at most 365
+        rolling  days in the rolling average used for the projection, defaults to 7
+        horizon  only products expected to run out within this many days
+        limit    number of products returned
+    """
+    query_parameters = event.get('queryStringParameters') or {}
+
+    try:
+        window = bounded_int(query_parameters, 'window', FORECAST_DEFAULT_WINDOW_DAYS, 1, FORECAST_MAX_WINDOW_DAYS)
+        rolling = bounded_int(query_parameters, 'rolling', FORECAST_DEFAULT_ROLLING_DAYS, 1, window)
+        horizon = bounded_int(query_parameters, 'horizon', None, 1, 10_000)
+        limit = bounded_int(query_parameters, 'limit', None, 1, 10_000)
+    except ValueError as e:
+        return json_response(400, {'message': 'Invalid forecast parameters', 'error': str(e)})
+
+    try:
+        return json_response(200, analytics_model.forecast_stockouts(window, rolling, limit, horizon))
+    except Exception as e:
+        logger.error("Failed to forecast stockouts: %s", e)
+        return json_response(500, {
+            "message": "Failed to forecast stockouts",
+            "error": str(e)
+        })
@@ -1,9 +1,14 @@
 from models.event_model import EventModel
+from gateways.sqs_gateway import SQSService
 from utils.logger import logger
+from utils.invocation import lambda_handler
+from utils.serialization import json_response
 import json
 
 event_model = EventModel()
+sqs_service = SQSService()
 
+@lambda_handler
 def setup_inventory_check(event, context):
     """
     Setup a scheduled inventory check
@@ -16,49 +21,50 @@ def setup_inventory_check(event, context):
         body = json.loads(event.get('body', '{}'))
         schedule = body.get('schedule', 'rate(1 day)')
         
-        logger.info(f"Setting up inventory check with schedule: {schedule}")
+        logger.info("Setting up inventory check with schedule: %s", schedule)
         return event_model.schedule_inventory_check(schedule)
     except Exception as e:
-        logger.error(f"Failed to setup inventory check: {str(e)}")
-        return {
-            "statusCode": 500,
-            "body": json.dumps({
-                "message": "Failed to setup inventory check",
-                "error": str(e)
-            })
-        }
+        logger.error("Failed to setup inventory check: %s", e)
+        return json_response(500, {
+            "message": "Failed to setup inventory check",
+            "error": str(e)
+        })
 
+@lambda_handler
 def check_low_inventory(event, context):
     """
     Check for products with low inventory
     This function can be triggered by EventBridge schedule or called directly via API
     Example event for API:
     {
-        "threshold": 10  # Optional, defaults to 10
+        "threshold": 10,  # Optional, defaults to 10
+        "backfill": true  # Optional, flags existing products in LowStockIndex instead of checking
     }
     """
     try:
         # Handle both EventBridge and API Gateway events
         if 'body' in event:
             # API Gateway event
-            body = json.loads(event.get('body', '{}'))
-            threshold = int(body.get('threshold', 10))
+            body = json.loads(event.get('body') or '{}')
         else:
             # EventBridge event
-            threshold = int(event.get('threshold', 10))
+            body = event
+        threshold = int(body.get('threshold', 10))
+
+        if body.get('backfill'):
+            logger.info("Backfilling low_stock_bucket for LowStockIndex")
+            return event_model.backfill_low_stock_index()
         
-        logger.info(f"Checking inventory with threshold: {threshold}")
+        logger.info("Checking inventory with threshold: %s", threshold)
         return event_model.check_low_inventory(threshold)
     except Exception as e:
-        logger.error(f"Failed to check inventory: {str(e)}")
-        return {
-            "statusCode": 500,
-            "body": json.dumps({
-                "message": "Failed to check inventory",
-                "error": str(e)
-            })
-        }
+        logger.error("Failed to check inventory: %s", e)
+        return json_response(500, {
+            "message": "Failed to check inventory",
+            "error": str(e)
+        })
 
+@lambda_handler
 def test_event_trigger(event, context):
     """
     Test function to manually trigger EventBridge events
@@ -80,14 +86,30 @@ def test_event_trigger(event, context):
         detail_type = body.get('detail_type', 'test-event')
         detail = body.get('detail', {'message': 'This is a test event'})
         
-        logger.info(f"Triggering test event: {source} - {detail_type}")
+        logger.info("Triggering test event: %s - %s", source, detail_type)
         return event_model.send_test_event(source, detail_type, detail)
     except Exception as e:
-        logger.error(f"Failed to trigger test event: {str(e)}")
-        return {
-            "statusCode": 500,
-            "body": json.dumps({
-                "message": "Failed to trigger test event",
-                "error": str(e)
-            })
-        }
+        logger.error("Failed to trigger test event: %s", e)
+        return json_response(500, {
+            "message": "Failed to trigger test event",
+            "error": str(e)
+        })
+
+@lambda_handler
+def replay_spooled_events(event, context):
+    """
+    Re-send EventBridge events and SQS messages spooled to S3 while their circuit was open.
+    Triggered on a schedule; stops per dependency at the first failure.
+    """
+    try:
+        limit = event.get('limit') if isinstance(event, dict) else None
+        eventbridge_result = event_model.eventbridge.replay_spooled_events(limit)
+        sqs_result = sqs_service.replay_spooled_messages(limit)
+        logger.info("Spool replay finished", extra={"eventbridge": eventbridge_result, "sqs": sqs_result})
+        return json_response(200, {"eventbridge": eventbridge_result, "sqs": sqs_result})
+    except Exception as e:
+        logger.error("Failed to replay spooled events: %s", e)
+        return json_response(500, {
+            "message": "Failed to replay spooled events",
+            "error": str(e)
+        })
@@ -0,0 +1,88 @@
+import time
+from datetime import datetime, timezone
+
+from models.inventory_model import (
+    HISTORY_DEFAULT_LIMIT, HISTORY_MAX_LIMIT, LEDGER_RETENTION_DAYS, InventoryModel, decode_cursor,
+)
+from utils.logger import logger
+from utils.invocation import lambda_handler
+from utils.serialization import json_response
+
+inventory_model = InventoryModel()
+
+# Leave this much of the invocation for the product being archived when the budget runs out
+ARCHIVE_TIME_MARGIN_MS = 60_000
+
+def parse_history_bound(value, upper=False):
+    """
+    Turn a from/to parameter into a ledger key bound. Timestamps are converted to UTC and
+    formatted like ledger_key (naive ones are taken as UTC). Keys carry a suffix after the
+    timestamp and a bare date covers the whole day, so an upper bound is extended with '~',
+    which sorts after any suffix or time component.
+    """
+    if not value:
+        return None
+    timestamp = datetime.fromisoformat(value)
+    if len(value) == 10:
+        bound = timestamp.date().isoformat()
+    else:
+        aware = timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+        bound = aware.astimezone(timezone.utc).isoformat()
+    return f"{bound}~" if upper else bound
+
+@lambda_handler
+def archive_ledger(event, context):
+    """
+    Move inventory ledger entries older than the retention window to S3.
+    Triggered on a schedule; a run that hits its time budget is picked up by the next one.
+    Example event:
+    {
+        "retention_days": 90  # Optional, defaults to LEDGER_RETENTION_DAYS
+    }
+    """
+    try:
+        retention_days = int((event or {}).get('retention_days', LEDGER_RETENTION_DAYS))
+        deadline = None
+        if hasattr(context, 'get_remaining_time_in_millis'):
+            deadline = time.monotonic() + (context.get_remaining_time_in_millis() - ARCHIVE_TIME_MARGIN_MS) / 1000
+
+        logger.info("Archiving ledger entries older than %s days", retention_days)
+        return json_response(200, inventory_model.archive_ledger(retention_days, deadline))
+    except Exception as e:
+        logger.error("Failed to archive ledger: %s", e)
+        return json_response(500, {
+            "message": "Failed to archive ledger",
+            "error": str(e)
+        })
+
+@lambda_handler
+def get_product_history(event, context):
+    """
+    Page through a product's inventory movements, oldest first.
+    Query parameters:
+        from    ISO date or timestamp, inclusive
+        to      ISO date or timestamp, inclusive (a date covers the whole day)
+        limit   entries per page, defaults to 50, at most 500
+        cursor  next_cursor from the previous page
+    """
+    product_id = event['pathParameters']['product_id']
+    query_parameters = event.get('queryStringParameters') or {}
+
+    try:
+        start = parse_history_bound(query_parameters.get('from'))
+        end = parse_history_bound(query_parameters.get('to'), upper=True)
+        limit = int(query_parameters.get('limit', HISTORY_DEFAULT_LIMIT))
+        if not 1 <= limit <= HISTORY_MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {HISTORY_MAX_LIMIT}")
+        after = decode_cursor(query_parameters['cursor']) if query_parameters.get('cursor') else None
+    except ValueError as e:
+        return json_response(400, {'message': 'Invalid history parameters', 'error': str(e)})
+
+    try:
+        return json_response(200, inventory_model.get_history_page(product_id, start, end, limit, after))
+    except Exception as e:
+        logger.error("Failed to fetch history for product %s: %s", product_id, e)
+        return json_response(500, {
+            "message": "Failed to fetch product history",
+            "error": str(e)
+        })
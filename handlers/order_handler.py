@@ -0,0 +1,36 @@
+import json
+
+from models.order_model import OrderModel, parse_cart
+from utils.logger import logger
+from utils.invocation import lambda_handler
+from utils.serialization import json_response
+
+order_model = OrderModel()
+
+@lambda_handler
+def create_order(event, context):
+    """
+    Check out a multi-item cart in one request.
+    Example body:
+    {
+        "order_id": "optional client supplied id",
+        "items": [
+            {"product_id": "p-1", "quantity": 2},
+            {"product_id": "p-2", "quantity": 1}
+        ]
+    }
+    """
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except json.JSONDecodeError as e:
+        return json_response(400, {'message': 'Invalid JSON in request body', 'error': str(e)})
+    if not isinstance(body, dict):
+        return json_response(400, {'message': 'Request body must be a JSON object'})
+
+    try:
+        cart = parse_cart(body.get('items'))
+    except ValueError as e:
+        return json_response(400, {'message': str(e)})
+
+    logger.info("Placing order with %d products", len(cart))
+    return order_model.place_order(cart, body.get('order_id'))
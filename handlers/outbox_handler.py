@@ -0,0 +1,24 @@
+from models.outbox_model import OutboxModel
+from utils.logger import logger
+from utils.invocation import lambda_handler
+from utils.serialization import json_response
+
+outbox_model = OutboxModel()
+
+@lambda_handler
+def relay_outbox(event, context):
+    """
+    Publish outbox rows to EventBridge and SQS in batches of 10.
+    Triggered by the outbox table's stream with the freshly inserted rows, and on a
+    schedule (no Records) to sweep rows that the stream path could not deliver.
+    """
+    try:
+        if isinstance(event, dict) and event.get('Records'):
+            result = outbox_model.relay_stream_records(event['Records'])
+        else:
+            result = outbox_model.sweep()
+        return json_response(200, result)
+    except Exception as e:
+        logger.error("Failed to relay outbox: %s", e)
+        # Raising makes the stream retry the batch instead of skipping its rows
+        raise
@@ -1,40 +1,73 @@
-import json, boto3
-from models.product_model import ProductModel
-from models.event_model import EventModel
-from utils.decimal_encoder import DecimalEncoder
+import json
+from models.product_model import ProductModel, parse_fields
+from utils.serialization import dumps_bytes, json_response
 from utils.logger import logger
-from datetime import datetime
-import os
+from utils.invocation import lambda_handler
+from utils.http_cache import StreamedBody, conditional_response, get_header, streamed_response
 from decimal import Decimal
 
 product_model = ProductModel()
-event_model = EventModel()
-event_bus_name = os.getenv('EVENT_BUS_NAME')
 
+# Upper bound on ids accepted by a single bulk lookup (GET /products?ids=a,b,c)
+MAX_LOOKUP_IDS = 500
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+def invalid_fields_response(error):
+    return json_response(400, {'message': 'Invalid fields parameter', 'error': str(error)})
+
+def wants_ndjson(event, query_parameters):
+    return query_parameters.get('format') == 'ndjson' or NDJSON_CONTENT_TYPE in (get_header(event, 'Accept') or '')
+
+def stream_all_products(event, fields):
+    """
+    Write the catalog as NDJSON, one product per line, while scan pages arrive.
+    Each page is serialized, hashed and written (gzipped when accepted) into a single
+    buffer before the next one is fetched, so memory holds one page plus the encoded
+    output, and the final body string made from it.
+    """
+    body = StreamedBody(event)
+    count = 0
+    for page in product_model.iter_product_pages(fields):
+        body.write(b"".join(dumps_bytes(item) + b"\n" for item in page))
+        count += len(page)
+
+    logger.info("Streamed %d products as NDJSON", count)
+    return streamed_response(event, body, {"Content-Type": NDJSON_CONTENT_TYPE})
+
+@lambda_handler
 def get_all_products(event, context):
-    return_body = product_model.get_all_products() 
-    logger.info("Fetching all products")
-    response = {
-        "statusCode": 200,
-        "headers": {
-            "Content-Type": "application/json"
-        },
-        "body": json.dumps(return_body, cls=DecimalEncoder)
-    }
+    query_parameters = event.get('queryStringParameters') or {}
+
+    try:
+        fields = parse_fields(query_parameters.get('fields'))
+    except ValueError as e:
+        return invalid_fields_response(e)
+
+    if query_parameters.get('ids'):
+        product_ids = [pid.strip() for pid in query_parameters['ids'].split(',') if pid.strip()]
+        if len(product_ids) > MAX_LOOKUP_IDS:
+            return json_response(400, {'message': f'Too many ids, at most {MAX_LOOKUP_IDS} are allowed per lookup'})
+        logger.info("Bulk lookup of %d products", len(product_ids))
+        return_body = product_model.get_products_by_ids(product_ids, fields)
+    elif wants_ndjson(event, query_parameters):
+        try:
+            return stream_all_products(event, fields)
+        except Exception as e:
+            logger.error("Error streaming products: %s", e)
+            return product_model.handle_exception(e, "Failed to fetch products")
+    else:
+        return_body = product_model.get_all_products(fields)
+        logger.info("Fetching all products")
+    response = json_response(200, return_body)
     
-    return response
+    return conditional_response(event, response)
 
+@lambda_handler
 def create_product(event, context):
     try:
         body = json.loads(event['body'])
     except json.JSONDecodeError as e:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({'message': 'Invalid JSON in request body', 'error': str(e)})
-        }
+        return json_response(400, {'message': 'Invalid JSON in request body', 'error': str(e)})
 
     product_name = body.get('product_name')
     quantity = body.get('quantity')
@@ -42,84 +75,46 @@ def create_product(event, context):
     product_id = body.get('product_id')
 
     if not all([product_name, quantity, price, product_id]):
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({'message': 'Missing required fields'})
-        }
-
-    create_response = product_model.create_product(product_name, quantity, price, product_id)
-    
-    # Send event to EventBridge
-    try:
-        event_entry = {
-            'Source': 'custom.products.mattenarle',
-            'DetailType': 'product-created',
-            'Detail': json.dumps({
-                'product_id': product_id,
-                'product_name': product_name,
-                'quantity': quantity,
-                'price': price,
-                'timestamp': datetime.now().isoformat()
-            }, cls=DecimalEncoder),
-            'EventBusName': event_bus_name
-        }
-        event_model.eventbridge.put_events([event_entry])
-        logger.info(f"Product created event sent: {product_name}, ID: {product_id}")
-    except Exception as e:
-        logger.error(f"Failed to send product created event: {str(e)}")
+        return json_response(400, {'message': 'Missing required fields'})
 
-    # Also send to SQS for backward compatibility
-    try:
-        sqs = boto3.resource('sqs', region_name='us-east-2')
-        queue = sqs.get_queue_by_name(QueueName='products-queue-matt-sqs')
-        queue.send_message(MessageBody=json.dumps(body, cls=DecimalEncoder))
-    except Exception as e:
-        logger.error(f"Failed to send message to SQS: {str(e)}")
+    # The product-created event and the SQS copy of the request are written to the outbox
+    # in the same transaction and published by the relay
+    create_response = product_model.create_product(product_name, quantity, price, product_id, message_body=body,
+                                                  low_stock_threshold=body.get('low_stock_threshold'))
 
     return create_response
 
+@lambda_handler
 def get_product(event, context):
     product_id = event['pathParameters']['product_id']
-    return_body = product_model.get_product(product_id)
+    query_parameters = event.get('queryStringParameters') or {}
+
+    try:
+        fields = parse_fields(query_parameters.get('fields'))
+    except ValueError as e:
+        return invalid_fields_response(e)
+
+    return_body = product_model.get_product(product_id, fields)
     
     if return_body:
-        response = {
-            "statusCode": 200,
-            "headers": {
-                "Content-Type": "application/json"
-            },
-            "body": json.dumps(return_body, cls=DecimalEncoder)
-        }
+        response = json_response(200, return_body)
     else:
-        response = {
-            "statusCode": 404,
-            "headers": {
-                "Content-Type": "application/json"
-            },
-            "body": json.dumps({'message': f'Product with ID {product_id} not found'})
-        }
+        response = json_response(404, {'message': f'Product with ID {product_id} not found'})
     
     return response
 
+@lambda_handler
 def delete_product(event, context):
     product_id = event['pathParameters']['product_id']
     delete_response = product_model.delete_product(product_id)
     return delete_response
 
+@lambda_handler
 def modify_product(event, context):
     try:
         body = json.loads(event['body'])
     except json.JSONDecodeError as e:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({'message': 'Invalid JSON in request body', 'error': str(e)})
-        }
+        return json_response(400, {'message': 'Invalid JSON in request body', 'error': str(e)})
 
     product_id = event['pathParameters']['product_id']
     product_name = body.get('product_name')
@@ -127,41 +122,17 @@ def modify_product(event, context):
     price = Decimal(str(body.get('price'))) if body.get('price') is not None else None
 
     if not all([product_name, quantity, price]):
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({'message': 'Missing required fields'})
-        }
+        return json_response(400, {'message': 'Missing required fields'})
 
     modify_response = product_model.modify_product(product_id, product_name, quantity, price)
-    
-    # Send event to EventBridge
-    try:
-        event_entry = {
-            'Source': 'custom.products.mattenarle',
-            'DetailType': 'product-updated',
-            'Detail': json.dumps({
-                'product_id': product_id,
-                'product_name': product_name,
-                'quantity': quantity,
-                'price': price,
-                'timestamp': datetime.now().isoformat()
-            }, cls=DecimalEncoder),
-            'EventBusName': event_bus_name
-        }
-        event_model.eventbridge.put_events([event_entry])
-        logger.info(f"Product updated event sent: {product_name}, ID: {product_id}")
-    except Exception as e:
-        logger.error(f"Failed to send product updated event: {str(e)}")
 
     return modify_response
 
+@lambda_handler(allocation_sites=True)
 def batch_create_products(event, context):
     try:
         logger.info("File uploaded trigger for creation")
-        logger.debug(event)
+        logger.debug("Received event", extra={"lambda_event": event})
         
         response = product_model.batch_create_products(event)
         
@@ -174,28 +145,17 @@ def batch_create_products(event, context):
                 }
             return response
         else:
-            return {
-                "statusCode": 200, 
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps(response, cls=DecimalEncoder)
-            }
+            return json_response(200, response)
     
     except Exception as e:
-        logger.error(f"Error processing batch create: {str(e)}")
-        return {
-            "statusCode": 500, 
-            "headers": {
-                "Content-Type": "application/json"
-            },
-            "body": json.dumps({"message": f"Error processing batch create: {str(e)}"}, cls=DecimalEncoder)
-        }
+        logger.error("Error processing batch create: %s", e)
+        return json_response(500, {"message": f"Error processing batch create: {str(e)}"})
 
+@lambda_handler(allocation_sites=True)
 def batch_delete_products(event, context):
     try:
         logger.info("File uploaded trigger for deletion")
-        logger.debug(event)
+        logger.debug("Received event", extra={"lambda_event": event})
         
         # Delegate the work to ProductModel
         response = product_model.batch_delete_products(event)
@@ -209,35 +169,18 @@ def batch_delete_products(event, context):
                 }
             return response
         else:
-            return {
-                "statusCode": 200, 
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps(response, cls=DecimalEncoder)
-            }
+            return json_response(200, response)
     
     except Exception as e:
-        logger.error(f"Error processing batch delete: {str(e)}")
-        return {
-            "statusCode": 500, 
-            "headers": {
-                "Content-Type": "application/json"
-            },
-            "body": json.dumps({"message": f"Error processing batch delete: {str(e)}"}, cls=DecimalEncoder)
-        }
+        logger.error("Error processing batch delete: %s", e)
+        return json_response(500, {"message": f"Error processing batch delete: {str(e)}"})
     
+@lambda_handler
 def add_stocks_to_product(event, context):
     try:
         body = json.loads(event['body'])
     except json.JSONDecodeError as e:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({'message': 'Invalid JSON in request body', 'error': str(e)}, cls=DecimalEncoder)
-        }
+        return json_response(400, {'message': 'Invalid JSON in request body', 'error': str(e)})
 
     product_id = body.get('product_id')  
     remarks = body.get('remarks', '')
@@ -246,29 +189,40 @@ def add_stocks_to_product(event, context):
     try:
         quantity = int(body.get('quantity'))
     except (ValueError, TypeError) as e:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                'message': 'Invalid quantity value. Must be a number.',
-                'error': str(e)
-            }, cls=DecimalEncoder)
-        }
+        return json_response(400, {
+            'message': 'Invalid quantity value. Must be a number.',
+            'error': str(e)
+        })
 
     if not product_id:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({'message': 'Missing required field: product_id'}, cls=DecimalEncoder)
-        }
+        return json_response(400, {'message': 'Missing required field: product_id'})
 
     response = product_model.add_stock_entry(product_id, quantity, remarks)
     return response
 
+@lambda_handler
+def configure_stock_shards(event, context):
+    """
+    Spread a hot product's stock over N shard items so concurrent purchases stop contending
+    on one row. Example body: {"shards": 8}; {"shards": 0} folds the shards back.
+    """
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except json.JSONDecodeError as e:
+        return json_response(400, {'message': 'Invalid JSON in request body', 'error': str(e)})
+
+    product_id = event['pathParameters']['product_id']
+    try:
+        shards = int(body.get('shards'))
+    except (ValueError, TypeError) as e:
+        return json_response(400, {
+            'message': 'Invalid shards value. Must be a number.',
+            'error': str(e)
+        })
+
+    return product_model.configure_stock_shards(product_id, shards)
+
+@lambda_handler
 def search_products_by_name(event, context):
     """
     Handler for searching products by name
@@ -277,36 +231,30 @@ def search_products_by_name(event, context):
         # Get the product name from query parameters
         query_parameters = event.get('queryStringParameters', {})
         if not query_parameters or 'name' not in query_parameters:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps({'message': 'Missing required query parameter: name'})
-            }
+            return json_response(400, {'message': 'Missing required query parameter: name'})
         
         product_name = query_parameters.get('name')
-        logger.info(f"Searching for products with name: {product_name}")
+        logger.info("Searching for products with name: %s", product_name)
+
+        try:
+            fields = parse_fields(query_parameters.get('fields'))
+        except ValueError as e:
+            return invalid_fields_response(e)
         
         # Call the model function to search for products
-        response = product_model.search_products_by_name(product_name)
+        response = product_model.search_products_by_name(product_name, fields)
         
         # Return the response directly as it's already properly formatted
         return response
         
     except Exception as e:
-        logger.error(f"Error searching for products by name: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                'message': 'Error searching for products', 
-                'error': str(e)
-            }, cls=DecimalEncoder)
-        }
+        logger.error("Error searching for products by name: %s", e)
+        return json_response(500, {
+            'message': 'Error searching for products', 
+            'error': str(e)
+        })
 
+@lambda_handler
 def buy_product(event, context):
     """
     Handler for buying a product (reducing inventory)
@@ -323,35 +271,23 @@ def buy_product(event, context):
             try:
                 quantity = int(query_parameters.get('quantity'))
             except ValueError:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json'
-                    },
-                    'body': json.dumps({'message': 'Invalid quantity parameter, must be a number'}, cls=DecimalEncoder)
-                }
+                return json_response(400, {'message': 'Invalid quantity parameter, must be a number'})
         
         # First check if we have a product_id in the path
         if path_parameters and 'product_id' in path_parameters:
             product_identifier = path_parameters.get('product_id')
             is_product_id = True
-            logger.info(f"Processing purchase for product ID: {product_identifier}, quantity: {quantity}")
+            logger.info("Processing purchase for product ID: %s, quantity: %s", product_identifier, quantity)
         # Then check if we have a product_name in the query parameters
         elif query_parameters and 'product_name' in query_parameters:
             product_identifier = query_parameters.get('product_name')
             is_product_id = False
-            logger.info(f"Processing purchase for product name: {product_identifier}, quantity: {quantity}")
+            logger.info("Processing purchase for product name: %s, quantity: %s", product_identifier, quantity)
         # If neither, return an error
         else:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps({
-                    'message': 'Missing required parameter: either product_id in path or product_name in query'
-                }, cls=DecimalEncoder)
-            }
+            return json_response(400, {
+                'message': 'Missing required parameter: either product_id in path or product_name in query'
+            })
         
         # Call the appropriate model function based on what we received
         if is_product_id:
@@ -368,15 +304,9 @@ def buy_product(event, context):
                     product_id = search_data.get('product_id')
                     response = product_model.buy_product(product_id, quantity)
                 else:
-                    response = {
-                        'statusCode': 404,
-                        'headers': {
-                            'Content-Type': 'application/json'
-                        },
-                        'body': json.dumps({
-                            'message': f"No product found matching name: {product_identifier}"
-                        }, cls=DecimalEncoder)
-                    }
+                    response = json_response(404, {
+                        'message': f"No product found matching name: {product_identifier}"
+                    })
             else:
                 # Pass through the search error response
                 response = search_response
@@ -385,18 +315,13 @@ def buy_product(event, context):
         return response
         
     except Exception as e:
-        logger.error(f"Error processing purchase: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                'message': 'Error processing purchase', 
-                'error': str(e)
-            }, cls=DecimalEncoder)
-        }
+        logger.error("Error processing purchase: %s", e)
+        return json_response(500, {
+            'message': 'Error processing purchase', 
+            'error': str(e)
+        })
 
+@lambda_handler
 def check_stock(event, context):
     """
     Handler for checking product stock levels
@@ -411,23 +336,17 @@ def check_stock(event, context):
         if path_parameters and 'product_id' in path_parameters:
             product_identifier = path_parameters.get('product_id')
             is_product_id = True
-            logger.info(f"Checking stock for product ID: {product_identifier}")
+            logger.info("Checking stock for product ID: %s", product_identifier)
         # Then check if we have a product_name in the query parameters
         elif query_parameters and 'product_name' in query_parameters:
             product_identifier = query_parameters.get('product_name')
             is_product_id = False
-            logger.info(f"Checking stock for product name: {product_identifier}")
+            logger.info("Checking stock for product name: %s", product_identifier)
         # If neither, return an error
         else:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps({
-                    'message': 'Missing required parameter: either product_id in path or product_name in query'
-                }, cls=DecimalEncoder)
-            }
+            return json_response(400, {
+                'message': 'Missing required parameter: either product_id in path or product_name in query'
+            })
         
         # Call the appropriate model function based on what we received
         if is_product_id:
@@ -444,15 +363,9 @@ def check_stock(event, context):
                     product_id = search_data.get('product_id')
                     response = product_model.check_stock(product_id)
                 else:
-                    response = {
-                        'statusCode': 404,
-                        'headers': {
-                            'Content-Type': 'application/json'
-                        },
-                        'body': json.dumps({
-                            'message': f"No product found matching name: {product_identifier}"
-                        }, cls=DecimalEncoder)
-                    }
+                    response = json_response(404, {
+                        'message': f"No product found matching name: {product_identifier}"
+                    })
             else:
                 # Pass through the search error response
                 response = search_response
@@ -461,18 +374,13 @@ def check_stock(event, context):
         return response
         
     except Exception as e:
-        logger.error(f"Error checking stock: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                'message': 'Error checking stock', 
-                'error': str(e)
-            }, cls=DecimalEncoder)
-        }
+        logger.error("Error checking stock: %s", e)
+        return json_response(500, {
+            'message': 'Error checking stock', 
+            'error': str(e)
+        })
 
+@lambda_handler
 def verify_admin(event, context):
     """
     Simple admin verification endpoint with fixed credentials
@@ -482,16 +390,10 @@ def verify_admin(event, context):
         try:
             body = json.loads(event.get('body', '{}'))
         except json.JSONDecodeError as e:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps({
-                    'message': 'Invalid JSON in request body', 
-                    'error': str(e)
-                }, cls=DecimalEncoder)
-            }
+            return json_response(400, {
+                'message': 'Invalid JSON in request body', 
+                'error': str(e)
+            })
         
         # Get admin_id and password from request body
         admin_id = body.get('admin_id', '')
@@ -503,39 +405,21 @@ def verify_admin(event, context):
         
         # Check if credentials match
         if admin_id == valid_admin_id and password == valid_password:
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps({
-                    'message': 'Admin verification successful',
-                    'valid': True,
-                    'admin_id': admin_id,
-                    'access_level': 'admin'
-                }, cls=DecimalEncoder)
-            }
+            return json_response(200, {
+                'message': 'Admin verification successful',
+                'valid': True,
+                'admin_id': admin_id,
+                'access_level': 'admin'
+            })
         else:
-            return {
-                'statusCode': 401,
-                'headers': {
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps({
-                    'message': 'Invalid admin credentials',
-                    'valid': False
-                }, cls=DecimalEncoder)
-            }
+            return json_response(401, {
+                'message': 'Invalid admin credentials',
+                'valid': False
+            })
         
     except Exception as e:
-        logger.error(f"Error verifying admin: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                'message': 'Error verifying admin', 
-                'error': str(e)
-            }, cls=DecimalEncoder)
-        }
+        logger.error("Error verifying admin: %s", e)
+        return json_response(500, {
+            'message': 'Error verifying admin', 
+            'error': str(e)
+        })
@@ -1,10 +1,12 @@
-import json
 from models.product_model import ProductModel
-from utils.decimal_encoder import DecimalEncoder
+from utils.serialization import json_response
 from utils.logger import logger
+from utils.invocation import lambda_handler
+from utils.http_cache import conditional_response
 
 product_model = ProductModel()
 
+@lambda_handler
 def get_specialized_products(event, context):
     """
     Handler for retrieving specialized product data.
@@ -20,33 +22,21 @@ def get_specialized_products(event, context):
         if query_type is not None:
             valid_types = ['most_expensive', 'least_expensive', 'most_stock', 'least_stock', 'best_seller']
             if query_type not in valid_types:
-                return {
-                    "statusCode": 400,
-                    "headers": {
-                        "Content-Type": "application/json"
-                    },
-                    "body": json.dumps({
-                        "message": f"Invalid query type. Must be one of: {', '.join(valid_types)}",
-                        "valid_types": valid_types
-                    })
-                }
-            logger.info(f"Processing specialized product query for type: {query_type}")
+                return json_response(400, {
+                    "message": f"Invalid query type. Must be one of: {', '.join(valid_types)}",
+                    "valid_types": valid_types
+                })
+            logger.info("Processing specialized product query for type: %s", query_type)
         else:
             logger.info("Processing request for all specialized product types")
         
         # Call the model method to get specialized products
         # If query_type is None, it will return all types in a single response
-        return product_model.get_specialized_products(query_type)
+        return conditional_response(event, product_model.get_specialized_products(query_type))
         
     except Exception as e:
-        logger.error(f"Error in get_specialized_products: {str(e)}")
-        return {
-            "statusCode": 500,
-            "headers": {
-                "Content-Type": "application/json"
-            },
-            "body": json.dumps({
-                "message": "Error processing specialized product query",
-                "error": str(e)
-            }, cls=DecimalEncoder)
-        }
+        logger.error("Error in get_specialized_products: %s", e)
+        return json_response(500, {
+            "message": "Error processing specialized product query",
+            "error": str(e)
+        })
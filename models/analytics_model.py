@@ -0,0 +1,228 @@
+import hashlib
+import itertools
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+from gateways.dynamo_gateway import (
+    DynamoGateway, LEDGER_ROLLUP_PREFIX, LEDGER_ROLLUP_STATE_KEY, parse_ledger_key,
+)
+from models.sharded_stock import ShardedStock, stock_projection
+from utils.logger import logger
+from utils.tracing import trace_methods
+
+load_dotenv()
+table_name = os.getenv("TABLE_NAME")
+inventory_table_name = os.getenv("INVENTORY_TABLE_NAME")
+outbox_table_name = os.getenv("OUTBOX_TABLE_NAME")
+
+# Sales analytics over the inventory ledger.
+#
+# refresh_rollups folds new ledger entries into one rollup#YYYY-MM-DD row per product and
+# day (units sold, units received, entry count) and advances rollup#state to the last
+# entry folded, in the same transaction, so each entry is counted exactly once and no run
+# re-reads history it has already seen. The same transaction adds each day's units sold to
+# a cross-product catalog rollup, so forecast_stockouts reads the whole window with a single
+# query and computes velocity, rolling averages and days-to-stockout for every product at once
+# with NumPy. Catalog rows only exist from the first refresh that writes them; days folded
+# earlier are missing from them.
+ROLLUP_LAG_SECONDS = int(os.getenv("ROLLUP_LAG_SECONDS", "300"))
+# TransactWriteItems takes at most 100 items: up to 49 days of product and catalog rows plus the state row
+ROLLUP_DAYS_PER_TRANSACTION = 49
+# Catalog rollups live under this reserved ledger partition as rollup#YYYY-MM-DD#NN rows, with
+# one sold#<product_id> attribute per product sold that day. Each day is split over
+# CATALOG_ROLLUP_SEGMENTS rows by product so no row nears the 400 KB item limit.
+CATALOG_ROLLUP_PARTITION = "catalog#rollups"
+CATALOG_ROLLUP_SEGMENTS = 16
+CATALOG_SOLD_PREFIX = "sold#"
+FORECAST_DEFAULT_WINDOW_DAYS = 28
+FORECAST_MAX_WINDOW_DAYS = 365
+FORECAST_DEFAULT_ROLLING_DAYS = 7
+
+
+def day_range(window_days, today=None):
+    """The window_days complete UTC days before today, oldest first."""
+    today = today or datetime.now(timezone.utc).date()
+    return [(today - timedelta(days=offset)).isoformat() for offset in range(window_days, 0, -1)]
+
+
+def catalog_segment(product_id):
+    """The catalog rollup row a product's daily sales go to; stable across processes, unlike hash()."""
+    digest = hashlib.blake2b(product_id.encode("utf-8"), digest_size=2).digest()
+    return int.from_bytes(digest, "big") % CATALOG_ROLLUP_SEGMENTS
+
+
+def catalog_sales(rows):
+    """{day: {product_id: units sold}} from catalog rollup rows."""
+    sales = defaultdict(dict)
+    for row in rows:
+        day = row["datetime"][len(LEDGER_ROLLUP_PREFIX):].split("#", 1)[0]
+        for name, units in row.items():
+            if name.startswith(CATALOG_SOLD_PREFIX):
+                sales[day][name[len(CATALOG_SOLD_PREFIX):]] = float(units)
+    return sales
+
+
+def forecast(products, sales_by_day, days, rolling_days=FORECAST_DEFAULT_ROLLING_DAYS):
+    """
+    Vectorised velocity and stockout projection. Returns one dict per product with the mean
+    daily sales over `days`, the mean over the last rolling_days, and the days until the
+    current quantity runs out at the rolling rate (the window rate when nothing sold lately).
+    """
+    # Only the analytics functions pay for importing NumPy
+    import numpy as np
+
+    row_index = {product["product_id"]: row for row, product in enumerate(products)}
+    sold = np.zeros((len(products), len(days)))
+    for column, day in enumerate(days):
+        for product_id, units in sales_by_day.get(day, {}).items():
+            row = row_index.get(product_id)
+            if row is not None:
+                sold[row, column] = units
+    quantity = np.array([float(product.get("quantity") or 0) for product in products])
+
+    rolling_days = max(1, min(rolling_days, len(days)))
+    cumulative = np.concatenate([np.zeros((len(products), 1)), np.cumsum(sold, axis=1)], axis=1)
+    velocity = cumulative[:, -1] / len(days)
+    rolling_average = (cumulative[:, -1] - cumulative[:, -1 - rolling_days]) / rolling_days
+
+    rate = np.where(rolling_average > 0, rolling_average, velocity)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_to_stockout = np.where(rate > 0, np.maximum(quantity, 0) / rate, np.inf)
+
+    return [{
+        "product_id": product["product_id"],
+        "product_name": product.get("product_name"),
+        "quantity": int(quantity[row]),
+        "velocity": round(float(velocity[row]), 3),
+        "rolling_average": round(float(rolling_average[row]), 3),
+        "days_to_stockout": None if np.isinf(days_to_stockout[row]) else round(float(days_to_stockout[row]), 1),
+    } for row, product in enumerate(products)]
+
+
+@trace_methods
+class AnalyticsModel:
+    def __init__(self, table_name=table_name, inventory_table_name=inventory_table_name,
+                 outbox_table_name=outbox_table_name):
+        self.product_table = DynamoGateway(table_name)
+        self.inventory_table = DynamoGateway(inventory_table_name)
+        # Only read here, to resolve the quantity of sharded products
+        self.sharded_stock = ShardedStock(self.product_table, self.inventory_table, DynamoGateway(outbox_table_name))
+
+    def refresh_rollups(self, deadline=None):
+        """
+        Fold every product's new ledger entries into its daily rollups. deadline is a
+        time.monotonic() value after which no further product is started.
+        """
+        products, entries = 0, 0
+        for page in self.product_table.iter_item_pages(("product_id",)):
+            for product in page:
+                if deadline is not None and time.monotonic() >= deadline:
+                    logger.info("Rollup refresh stopped at its time budget after %d products", products)
+                    return {"products": products, "entries": entries, "complete": False}
+                entries += self.refresh_product_rollups(product["product_id"])
+                products += 1
+
+        logger.info("Folded %d ledger entries into daily rollups across %d products", entries, products)
+        return {"products": products, "entries": entries, "complete": True}
+
+    def refresh_product_rollups(self, product_id):
+        """
+        Fold one product's entries written since its rollup#state into the daily rows.
+        Entries younger than ROLLUP_LAG_SECONDS wait for the next run, as writes may still
+        land before them. A concurrent refresh of the same product fails its state condition
+        and leaves the rows to the winner.
+        """
+        state = self.inventory_table.get_item({"product_id": product_id, "datetime": LEDGER_ROLLUP_STATE_KEY})
+        through = state.get("through") if state else None
+
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=ROLLUP_LAG_SECONDS)
+        new_entries = []
+        for page in self.inventory_table.query_stock_entries(product_id, start=through):
+            new_entries.extend(entry for entry in page if entry["datetime"] != through)
+        # Stop at the first entry still inside the lag so the state only ever advances over a key prefix
+        new_entries = list(itertools.takewhile(lambda entry: parse_ledger_key(entry["datetime"]) <= cutoff, new_entries))
+        if not new_entries:
+            return 0
+
+        by_day = defaultdict(list)
+        for entry in new_entries:
+            by_day[parse_ledger_key(entry["datetime"]).date().isoformat()].append(entry)
+
+        days = list(by_day)
+        for start in range(0, len(days), ROLLUP_DAYS_PER_TRANSACTION):
+            chunk = days[start:start + ROLLUP_DAYS_PER_TRANSACTION]
+            last_key = by_day[chunk[-1]][-1]["datetime"]
+            operations = []
+            for day in chunk:
+                operations.append(self._rollup_operation(product_id, day, by_day[day]))
+                sold = sum(-int(entry["quantity"]) for entry in by_day[day] if int(entry["quantity"]) < 0)
+                if sold:
+                    operations.append(self._catalog_operation(product_id, day, sold))
+            operations.append(self._state_operation(product_id, through, last_key))
+            self.inventory_table.transact_write(operations)
+            through = last_key
+
+        return len(new_entries)
+
+    def _rollup_operation(self, product_id, day, entries):
+        quantities = [int(entry["quantity"]) for entry in entries]
+        return self.inventory_table.update_operation(
+            {"product_id": product_id, "datetime": f"{LEDGER_ROLLUP_PREFIX}{day}"},
+            "ADD units_sold :sold, units_received :received, entry_count :count",
+            {
+                ":sold": sum(-quantity for quantity in quantities if quantity < 0),
+                ":received": sum(quantity for quantity in quantities if quantity > 0),
+                ":count": len(quantities),
+            },
+        )
+
+    def _catalog_operation(self, product_id, day, sold):
+        return self.inventory_table.update_operation(
+            {"product_id": CATALOG_ROLLUP_PARTITION,
+             "datetime": f"{LEDGER_ROLLUP_PREFIX}{day}#{catalog_segment(product_id):02d}"},
+            "ADD #sold :sold",
+            {":sold": sold},
+            expression_names={"#sold": f"{CATALOG_SOLD_PREFIX}{product_id}"},
+        )
+
+    def _state_operation(self, product_id, previous, through):
+        values = {":through": through, ":updated_at": datetime.now(timezone.utc).isoformat()}
+        if previous is None:
+            condition = "attribute_not_exists(through)"
+        else:
+            condition = "through = :previous"
+            values[":previous"] = previous
+        return self.inventory_table.update_operation(
+            {"product_id": product_id, "datetime": LEDGER_ROLLUP_STATE_KEY},
+            "SET through = :through, updated_at = :updated_at",
+            values,
+            condition,
+        )
+
+    def forecast_stockouts(self, window_days=FORECAST_DEFAULT_WINDOW_DAYS, rolling_days=FORECAST_DEFAULT_ROLLING_DAYS,
+                           limit=None, horizon_days=None):
+        """
+        Project stockouts for the whole catalog from the catalog rollups of the last window_days,
+        soonest first. horizon_days keeps only products expected to run out within it.
+        """
+        days = day_range(window_days)
+        fields = ("product_id", "product_name", "quantity")
+        products = self.sharded_stock.resolve_totals(self.product_table.get_all_items(stock_projection(fields)), fields)
+        sales_by_day = catalog_sales(self.inventory_table.get_rollups(CATALOG_ROLLUP_PARTITION, days[0], days[-1]))
+
+        results = forecast(products, sales_by_day, days, rolling_days)
+        if horizon_days is not None:
+            results = [result for result in results
+                       if result["days_to_stockout"] is not None and result["days_to_stockout"] <= horizon_days]
+        results.sort(key=lambda result: (result["days_to_stockout"] is None, result["days_to_stockout"] or 0))
+        logger.info("Forecast stockouts for %d products over %d days", len(products), window_days)
+
+        return {
+            "window": {"from": days[0], "to": days[-1], "days": window_days, "rolling_days": rolling_days},
+            "items": results[:limit] if limit else results,
+            "count": len(results),
+        }
@@ -1,19 +1,28 @@
 from gateways.eventbridge_gateway import EventBridgeGateway
 from gateways.dynamo_gateway import DynamoGateway
+from boto3.dynamodb.conditions import Key
+from models.low_stock import alert_suppressed, low_stock_alert
+from utils.stock_levels import (
+    DEFAULT_LOW_STOCK_THRESHOLD, LOW_STOCK_BUCKET, LOW_STOCK_INDEX, is_low, parse_quantity, threshold_for,
+)
 from utils.logger import logger
-from utils.decimal_encoder import DecimalEncoder
+from utils.tracing import trace_methods
+from utils.serialization import dumps, json_response
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
 table_name = os.getenv("TABLE_NAME")
+outbox_table_name = os.getenv("OUTBOX_TABLE_NAME")
 
+@trace_methods
 class EventModel:
     def __init__(self, region_name="us-east-2"):
         self.eventbridge = EventBridgeGateway(region_name)
         self.product_table = DynamoGateway(table_name)
+        self.outbox_table = DynamoGateway(outbox_table_name)
 
     def schedule_inventory_check(self, schedule_expression):
         """
@@ -21,7 +30,7 @@ class EventModel:
         Note: Scheduled events must use the default event bus.
         """
         try:
-            logger.info(f"Setting up inventory check schedule: {schedule_expression}")
+            logger.info("Setting up inventory check schedule: %s", schedule_expression)
             
             # Get the Lambda function ARN from environment or construct it
             function_name = "python-serverless-mattenarle10-dev-checkLowInventory"
@@ -51,113 +60,125 @@ class EventModel:
                 ]
             )
             
-            logger.info(f"Successfully set up inventory check schedule: {json.dumps(response, indent=2)}")
-            return {
-                "statusCode": 200,
-                "body": json.dumps({
-                    "message": "Inventory check schedule created",
-                    "ruleArn": response.get("RuleArn"),
-                    "targetResponse": target_response
-                })
-            }
+            logger.info("Successfully set up inventory check schedule", extra={"rule_arn": response.get("RuleArn")})
+            return json_response(200, {
+                "message": "Inventory check schedule created",
+                "ruleArn": response.get("RuleArn"),
+                "targetResponse": target_response
+            })
         except Exception as e:
-            logger.error(f"Failed to set up inventory check schedule: {str(e)}")
-            return {
-                "statusCode": 500,
-                "body": json.dumps({
-                    "message": "Failed to set up inventory check schedule",
-                    "error": str(e)
-                })
-            }
+            logger.error("Failed to set up inventory check schedule: %s", e)
+            return json_response(500, {
+                "message": "Failed to set up inventory check schedule",
+                "error": str(e)
+            })
 
-    def check_low_inventory(self, threshold=10):
+    def check_low_inventory(self, threshold=DEFAULT_LOW_STOCK_THRESHOLD):
         """
-        Check for products with low inventory and send alerts
+        Reconcile low-stock alerts. Alerts normally fire on the write that crosses a
+        product's threshold; this scheduled pass only alerts for low products that have
+        not been alerted within the suppression window (e.g. changed by a path without
+        detection). Only products flagged in the sparse LowStockIndex are read, so the
+        pass scales with the number of low products, not the catalog. Those are flagged
+        against the threshold in effect at write time, so threshold can narrow the
+        result but not widen it.
         """
         try:
-            logger.info(f"Checking for products with inventory below {threshold}")
-            items = self.product_table.get_all_items()
+            logger.info("Reconciling low stock alerts with default threshold %s", threshold)
+            items = self.product_table.query_index(LOW_STOCK_INDEX, Key("low_stock_bucket").eq(LOW_STOCK_BUCKET))
             
             low_stock_items = [
                 item for item in items 
-                if int(item.get("quantity", 0)) < threshold
+                if is_low(parse_quantity(item.get("quantity")), threshold_for(item, threshold))
             ]
+            missed = [item for item in low_stock_items if not alert_suppressed(item)]
             
-            if low_stock_items:
-                logger.info(f"Found {len(low_stock_items)} items with low stock")
-                # Create event for each low stock item
-                entries = [{
-                    'Source': 'custom.inventory.mattenarle',
-                    'DetailType': 'low-stock-alert',
-                    'Detail': json.dumps({
-                        'product_id': item['product_id'],
-                        'product_name': item['product_name'],
-                        'current_quantity': item['quantity'],
-                        'threshold': threshold,
-                        'timestamp': datetime.now().isoformat()
-                    }, cls=DecimalEncoder),
-                    'EventBusName': os.getenv('EVENT_BUS_NAME')
-                } for item in low_stock_items]
-                
-                response = self.eventbridge.put_events(entries)
-                logger.info(f"Successfully sent low stock alerts: {json.dumps(response, indent=2)}")
-                
-                return {
-                    "statusCode": 200,
-                    "body": json.dumps({
-                        "message": f"Found {len(low_stock_items)} items with low stock",
-                        "items": low_stock_items
-                    }, cls=DecimalEncoder)
-                }
+            if missed:
+                logger.info("Found %d low stock items without a recent alert", len(missed))
+                alerted_at = datetime.now(timezone.utc).isoformat()
+                self.outbox_table.batch_create_items([
+                    low_stock_alert(item, int(item["quantity"]), threshold_for(item, threshold)) for item in missed
+                ])
+                for item in missed:
+                    self.product_table.update_item(
+                        key={"product_id": item["product_id"]},
+                        update_expression="SET low_stock_alerted_at = :alerted_at",
+                        expression_values={":alerted_at": alerted_at},
+                    )
             else:
-                logger.info("No items found with low stock")
-                return {
-                    "statusCode": 200,
-                    "body": json.dumps({
-                        "message": "No items found with low stock"
-                    })
-                }
+                logger.info("No low stock items without a recent alert")
+
+            for item in items:
+                item.pop("low_stock_bucket", None)
+
+            return json_response(200, {
+                "message": f"Found {len(low_stock_items)} items with low stock, {len(missed)} alerted by reconciliation",
+                "items": low_stock_items,
+                "alerts_sent": len(missed)
+            })
         except Exception as e:
-            logger.error(f"Failed to check inventory: {str(e)}")
-            return {
-                "statusCode": 500,
-                "body": json.dumps({
-                    "message": "Failed to check inventory",
-                    "error": str(e)
-                })
-            }
+            logger.error("Failed to check inventory: %s", e)
+            return json_response(500, {
+                "message": "Failed to check inventory",
+                "error": str(e)
+            })
+
+    def backfill_low_stock_index(self):
+        """
+        One-off full scan that sets or removes low_stock_bucket on products written before
+        the index existed. Only items whose flag is wrong are updated.
+        """
+        try:
+            updated = 0
+            for page in self.product_table.iter_item_pages():
+                for item in page:
+                    flagged = "low_stock_bucket" in item
+                    if flagged == is_low(parse_quantity(item.get("quantity")), threshold_for(item)):
+                        continue
+                    if flagged:
+                        self.product_table.update_item({"product_id": item["product_id"]}, "REMOVE low_stock_bucket", None)
+                    else:
+                        self.product_table.update_item(
+                            {"product_id": item["product_id"]},
+                            "SET low_stock_bucket = :low_stock_bucket",
+                            {":low_stock_bucket": LOW_STOCK_BUCKET},
+                        )
+                    updated += 1
+
+            logger.info("Backfilled low_stock_bucket on %s products", updated)
+            return json_response(200, {"message": f"Updated low_stock_bucket on {updated} products", "updated": updated})
+        except Exception as e:
+            logger.error("Failed to backfill low stock index: %s", e)
+            return json_response(500, {
+                "message": "Failed to backfill low stock index",
+                "error": str(e)
+            })
             
     def send_test_event(self, source, detail_type, detail):
         """
         Send a test event to EventBridge
         """
         try:
-            logger.info(f"Sending test event to EventBridge: {source} - {detail_type}")
+            logger.info("Sending test event to EventBridge: %s - %s", source, detail_type)
             
             event_entry = {
                 'Source': source,
                 'DetailType': detail_type,
-                'Detail': json.dumps(detail, cls=DecimalEncoder),
+                'Detail': dumps(detail),
                 'EventBusName': os.getenv('EVENT_BUS_NAME')
             }
             
             response = self.eventbridge.put_events([event_entry])
-            logger.info(f"Successfully sent test event: {json.dumps(response, indent=2)}")
+            logger.info("Successfully sent test event", extra={"failed_entry_count": response.get("FailedEntryCount", 0)})
             
-            return {
-                "statusCode": 200,
-                "body": json.dumps({
-                    "message": "Test event sent successfully",
-                    "eventBusName": os.getenv('EVENT_BUS_NAME'),
-                    "response": response
-                })
-            }
+            return json_response(200, {
+                "message": "Test event sent successfully",
+                "eventBusName": os.getenv('EVENT_BUS_NAME'),
+                "response": response
+            })
         except Exception as e:
-            logger.error(f"Failed to send test event: {str(e)}")
-            return {
-                "statusCode": 500,
-                "body": json.dumps({
-                    "message": "Failed to send test event",
-                    "error": str(e)
-                })
-            }
+            logger.error("Failed to send test event: %s", e)
+            return json_response(500, {
+                "message": "Failed to send test event",
+                "error": str(e)
+            })
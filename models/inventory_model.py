@@ -0,0 +1,207 @@
+import base64
+import gzip
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+from gateways.dynamo_gateway import DynamoGateway, LEDGER_HISTORY_PROJECTION, parse_ledger_key
+from gateways.s3_gateway import S3Gateway
+from utils.logger import logger
+from utils.serialization import dumps, loads
+from utils.tracing import trace_methods
+
+load_dotenv()
+table_name = os.getenv("TABLE_NAME")
+inventory_table_name = os.getenv("INVENTORY_TABLE_NAME")
+bucket_name = os.getenv("S3_BUCKET_NAME")
+
+# Cold tier for the inventory ledger.
+#
+# Entries older than LEDGER_RETENTION_DAYS, and already folded into a ledger snapshot, move
+# to gzip NDJSON files under ledger-archive/product_id=<id>/month=<YYYY-MM>/ and are then
+# deleted from the hot table, so totals keep coming from the snapshot. Each file is named
+# <first datetime>_<last datetime>.ndjson.gz, with the same range in its object metadata,
+# so history reads can skip files outside the requested range from a key listing alone.
+LEDGER_ARCHIVE_PREFIX = "ledger-archive"
+LEDGER_ARCHIVE_SUFFIX = ".ndjson.gz"
+LEDGER_RETENTION_DAYS = int(os.getenv("LEDGER_RETENTION_DAYS", "90"))
+LEDGER_ARCHIVE_CHUNK_ROWS = int(os.getenv("LEDGER_ARCHIVE_CHUNK_ROWS", "5000"))
+
+HISTORY_FIELDS = ("datetime", "quantity", "remarks")
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 500
+
+
+def archive_prefix(product_id):
+    return f"{LEDGER_ARCHIVE_PREFIX}/product_id={product_id}/"
+
+
+def archive_key(product_id, entries):
+    first, last = entries[0]["datetime"], entries[-1]["datetime"]
+    return f"{archive_prefix(product_id)}month={first[:7]}/{first}_{last}{LEDGER_ARCHIVE_SUFFIX}"
+
+
+def archive_range(key):
+    """(first, last) datetime covered by an archive file, read from its key."""
+    first, _, last = key.rsplit("/", 1)[-1][:-len(LEDGER_ARCHIVE_SUFFIX)].partition("_")
+    return first, last
+
+
+def encode_cursor(key):
+    """History cursors are the last returned ledger key, opaque to clients."""
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for anything it did not produce."""
+    try:
+        return base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    except (UnicodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def in_range(value, start=None, end=None):
+    return (start is None or value >= start) and (end is None or value <= end)
+
+
+@trace_methods
+class InventoryModel:
+    def __init__(self, table_name=table_name, inventory_table_name=inventory_table_name, bucket_name=bucket_name):
+        self.product_table = DynamoGateway(table_name)
+        self.inventory_table = DynamoGateway(inventory_table_name)
+        self.s3_gateway = S3Gateway(bucket_name)
+
+    def archive_ledger(self, retention_days=LEDGER_RETENTION_DAYS, deadline=None):
+        """
+        Archive every product's old ledger entries. deadline is a time.monotonic() value after
+        which no further product is started; the next run carries on where this one stopped.
+        """
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).isoformat()
+        products, archived, files = 0, 0, 0
+
+        for page in self.product_table.iter_item_pages(("product_id",)):
+            for product in page:
+                if deadline is not None and time.monotonic() >= deadline:
+                    logger.info("Ledger archival stopped at its time budget after %d products", products)
+                    return {"products": products, "archived": archived, "files": files, "complete": False}
+                result = self.archive_product(product["product_id"], cutoff)
+                products += 1
+                archived += result["archived"]
+                files += result["files"]
+
+        logger.info("Archived %d ledger entries into %d files across %d products", archived, files, products)
+        return {"products": products, "archived": archived, "files": files, "complete": True}
+
+    def archive_product(self, product_id, cutoff):
+        """
+        Move one product's entries older than cutoff and covered by its latest snapshot to S3.
+        Each file is written before its entries are deleted, so a failure leaves entries in
+        both tiers at worst; history reads drop the duplicates.
+        """
+        snapshot = self.inventory_table.get_latest_snapshot(product_id)
+        if not snapshot:
+            return {"archived": 0, "files": 0}
+
+        end = min(cutoff, snapshot["as_of"])
+        archived, files, chunk = 0, 0, []
+        for page in self.inventory_table.query_stock_entries(product_id, end=end):
+            for entry in page:
+                # Files never straddle a month, so the month= partition holds everything in it
+                if chunk and (len(chunk) >= LEDGER_ARCHIVE_CHUNK_ROWS or entry["datetime"][:7] != chunk[0]["datetime"][:7]):
+                    archived += self._archive_chunk(product_id, chunk)
+                    files += 1
+                    chunk = []
+                chunk.append(entry)
+        if chunk:
+            archived += self._archive_chunk(product_id, chunk)
+            files += 1
+        return {"archived": archived, "files": files}
+
+    def _archive_chunk(self, product_id, entries):
+        key = archive_key(product_id, entries)
+        body = gzip.compress("".join(dumps(entry) + "\n" for entry in entries).encode("utf-8"))
+        self.s3_gateway.put_object(key, body, content_type="application/x-ndjson", metadata={
+            "range-start": entries[0]["datetime"],
+            "range-end": entries[-1]["datetime"],
+            "entry-count": str(len(entries)),
+        })
+        self.inventory_table.batch_delete_items([
+            {"product_id": entry["product_id"], "datetime": entry["datetime"]} for entry in entries
+        ])
+        return len(entries)
+
+    def iter_archived_entries(self, product_id, start=None, end=None):
+        """
+        Lazily yield archived entries with start <= datetime <= end, oldest first. Archive keys
+        list in time order (month, then first datetime), so the listing starts at start's month
+        and stops at the first file beginning after end; only overlapping files are downloaded.
+        """
+        prefix = archive_prefix(product_id)
+        start_after = f"{prefix}month={start[:7]}" if start else None
+        for keys in self.s3_gateway.iter_key_pages(prefix, start_after=start_after):
+            for key in keys:
+                if not key.endswith(LEDGER_ARCHIVE_SUFFIX):
+                    continue
+                first, last = archive_range(key)
+                if end is not None and first > end:
+                    return
+                if start is not None and last < start:
+                    continue
+                for line in gzip.decompress(self.s3_gateway.get_object(key)).splitlines():
+                    entry = loads(line)
+                    if in_range(entry["datetime"], start, end):
+                        yield entry
+
+    def read_archived_entries(self, product_id, start=None, end=None):
+        """Entries from the archive files whose range overlaps [start, end]."""
+        return list(self.iter_archived_entries(product_id, start, end))
+
+    def get_history(self, product_id, start=None, end=None):
+        """
+        A product's ledger entries between start and end (inclusive ISO timestamps), oldest
+        first, merged from the archive and the hot table.
+        """
+        merged = {entry["datetime"]: entry for entry in self.read_archived_entries(product_id, start, end)}
+        for page in self.inventory_table.query_stock_entries(product_id, start=start, end=end):
+            merged.update((entry["datetime"], entry) for entry in page)
+        return [merged[key] for key in sorted(merged)]
+
+    def get_history_page(self, product_id, start=None, end=None, limit=HISTORY_DEFAULT_LIMIT, after=None):
+        """
+        One page of a product's ledger history, oldest first: at most `limit` entries with
+        start <= datetime <= end and datetime > after (the previous page's cursor).
+        The hot table is read lazily, `limit` entries per query. The archive is only read
+        when the window reaches back past the oldest entry still in the hot table, and then
+        file by file in time order until the page is full, like the hot table.
+        """
+        lower = max(start, after) if start and after else (after or start)
+        # One entry past the limit tells whether another page exists
+        wanted = limit + 1
+
+        oldest_hot = next(iter(self.inventory_table.query_stock_entries(
+            product_id, page_size=1, projection=LEDGER_HISTORY_PROJECTION)), [])
+        oldest_hot_key = oldest_hot[0]["datetime"] if oldest_hot else None
+
+        merged = {}
+        if oldest_hot_key is None or lower is None or lower < oldest_hot_key:
+            archive_end = min(end, oldest_hot_key) if end and oldest_hot_key else (end or oldest_hot_key)
+            # Every archived entry precedes the hot ones, so a full page of them ends the page
+            for entry in self.iter_archived_entries(product_id, lower, archive_end):
+                if entry["datetime"] != after:
+                    merged[entry["datetime"]] = {field: entry.get(field) for field in HISTORY_FIELDS}
+                    if len(merged) >= wanted:
+                        break
+
+        for page in self.inventory_table.query_stock_entries(
+                product_id, start=lower, end=end, page_size=wanted, projection=LEDGER_HISTORY_PROJECTION):
+            merged.update((entry["datetime"], entry) for entry in page)
+            if sum(1 for key in merged if key != after) >= wanted:
+                break
+
+        keys = [key for key in sorted(merged) if key != after]
+        # recorded_at normalises every key shape, old and new, to a UTC timestamp
+        items = [dict(merged[key], recorded_at=parse_ledger_key(key).isoformat()) for key in keys[:limit]]
+        next_cursor = encode_cursor(keys[limit - 1]) if len(keys) > limit else None
+        return {"product_id": product_id, "items": items, "count": len(items), "next_cursor": next_cursor}
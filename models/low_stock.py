@@ -0,0 +1,51 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from models.outbox_model import outbox_event
+from utils.stock_levels import is_low, threshold_for
+
+# Low-stock detection on the write path.
+#
+# What counts as low is defined in utils.stock_levels. Every stock mutation
+# compares the quantity before and after the write and emits a low-stock-alert only
+# when it crosses the threshold downwards. low_stock_alerted_at records the last alert
+# so a quantity flapping around the threshold alerts at most once per
+# LOW_STOCK_SUPPRESSION_SECONDS. Alerts go through the outbox in the same write.
+
+LOW_STOCK_SUPPRESSION_SECONDS = int(os.getenv("LOW_STOCK_SUPPRESSION_SECONDS", "3600"))
+
+
+def crossed_below(old_quantity, new_quantity, threshold):
+    """True when a write takes the quantity from above the threshold to at or below it (or creates it low)."""
+    return is_low(new_quantity, threshold) and (old_quantity is None or not is_low(old_quantity, threshold))
+
+
+def alert_suppressed(product, now=None):
+    alerted_at = product.get("low_stock_alerted_at") if product else None
+    if not alerted_at:
+        return False
+    now = now or datetime.now(timezone.utc)
+    return now - datetime.fromisoformat(alerted_at) < timedelta(seconds=LOW_STOCK_SUPPRESSION_SECONDS)
+
+
+def low_stock_alert(product, new_quantity, threshold=None):
+    """Outbox row for a low-stock-alert event."""
+    return outbox_event('custom.inventory.mattenarle', 'low-stock-alert', {
+        'product_id': product['product_id'],
+        'product_name': product.get('product_name', 'Unknown'),
+        'current_quantity': new_quantity,
+        'threshold': threshold if threshold is not None else threshold_for(product),
+        'timestamp': datetime.now().isoformat()
+    })
+
+
+def detect_crossing(product, old_quantity, new_quantity):
+    """
+    Return (outbox_row, alerted_at) when this change should raise an alert, else (None, None).
+    Callers persist alerted_at as low_stock_alerted_at together with the new quantity.
+    """
+    threshold = threshold_for(product)
+    if not crossed_below(old_quantity, new_quantity, threshold) or alert_suppressed(product):
+        return None, None
+    return low_stock_alert(product, new_quantity, threshold), datetime.now(timezone.utc).isoformat()
+
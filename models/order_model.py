@@ -0,0 +1,282 @@
+import os
+import uuid
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from gateways.dynamo_gateway import DynamoGateway, is_condition_failure
+from models.low_stock import detect_crossing
+from models.outbox_model import outbox_event
+from models.sales_counter import sales_counter
+from models.sharded_stock import ShardedStock, shard_key, unsharded_only
+from utils.logger import logger
+from utils.serialization import json_response
+from utils.stock_levels import parse_quantity, with_low_stock_bucket
+from utils.tracing import trace_methods
+
+load_dotenv()
+table_name = os.getenv("TABLE_NAME")
+inventory_table_name = os.getenv("INVENTORY_TABLE_NAME")
+outbox_table_name = os.getenv("OUTBOX_TABLE_NAME")
+
+# TransactWriteItems takes at most 100 items. Each order line needs up to three (product
+# update, ledger entry, low-stock alert), a sharded line one per shard it draws on plus its
+# ledger entry, and the final chunk also carries the order event.
+TRANSACTION_MAX_ITEMS = 100
+LINE_MAX_ITEMS = 3
+# Lines whose stock changed between the read and the write are re-read and retried this often
+ORDER_MAX_ATTEMPTS = 3
+MAX_ORDER_LINES = 200
+
+
+class OrderRejected(Exception):
+    """The cart cannot be fulfilled; carries the per-product shortages."""
+
+    def __init__(self, shortages):
+        super().__init__(f"Not enough stock for {len(shortages)} products")
+        self.shortages = shortages
+
+
+def parse_cart(items):
+    """
+    Validate the request's items into {product_id: quantity}, merging repeated products.
+    Raises ValueError with a client-facing message.
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list")
+
+    cart = {}
+    for item in items:
+        product_id = item.get("product_id") if isinstance(item, dict) else None
+        quantity = parse_quantity(item.get("quantity", 1)) if isinstance(item, dict) else None
+        if not product_id or quantity is None or quantity <= 0:
+            raise ValueError("Every item needs a product_id and a positive integer quantity")
+        cart[product_id] = cart.get(product_id, 0) + quantity
+
+    if len(cart) > MAX_ORDER_LINES:
+        raise ValueError(f"Too many products, at most {MAX_ORDER_LINES} are allowed per order")
+    return cart
+
+
+def shortages_for(cart, products):
+    return [
+        {"product_id": pid, "available": int(products[pid].get("quantity", 0)), "requested": quantity}
+        for pid, quantity in cart.items()
+        if int(products[pid].get("quantity", 0)) < quantity
+    ]
+
+
+@trace_methods
+class OrderModel:
+    def __init__(self, table_name=table_name, inventory_table_name=inventory_table_name,
+                 outbox_table_name=outbox_table_name):
+        self.product_table = DynamoGateway(table_name)
+        self.inventory_table = DynamoGateway(inventory_table_name)
+        self.outbox_table = DynamoGateway(outbox_table_name)
+        self.sharded_stock = ShardedStock(self.product_table, self.inventory_table, self.outbox_table)
+
+    def place_order(self, cart, order_id=None):
+        """
+        Check out a whole cart: one BatchGetItem validates every line, then each chunk of
+        lines that fits one transaction commits its stock decrements, sales_count increments,
+        ledger entries and low-stock alerts in one TransactWriteItems call. Every decrement is
+        conditional on the quantity that was read. If a later chunk cannot commit, the
+        chunks already committed are reversed. Lines for sharded products take their units
+        from one random shard instead, conditional on that shard holding enough.
+        """
+        order_id = order_id or uuid.uuid4().hex
+        try:
+            products = self._read_products(list(cart))
+            missing = [pid for pid in cart if pid not in products]
+            if missing:
+                return json_response(404, {"message": "Products not found", "missing": missing})
+
+            shortages = shortages_for(cart, products)
+            if shortages:
+                return json_response(409, {"message": "Not enough stock available", "shortages": shortages})
+
+            lines = list(cart.items())
+            chunks = self._chunk_lines(lines, products)
+            committed, alerts = [], 0
+            for idx, chunk in enumerate(chunks):
+                try:
+                    alerts += self._commit_chunk(order_id, chunk, products, cart, final=idx == len(chunks) - 1)
+                except Exception:
+                    if committed:
+                        self._compensate(order_id, committed, products)
+                    raise
+                committed.extend(chunk)
+
+            items = []
+            for pid, quantity in lines:
+                price = float(products[pid].get("price", 0))
+                items.append({
+                    "product_id": pid,
+                    "product_name": products[pid].get("product_name"),
+                    "quantity": quantity,
+                    "price_per_unit": price,
+                    "line_total": round(price * quantity, 2),
+                    "remaining_stock": int(products[pid]["quantity"]) - quantity,
+                })
+            logger.info("Order %s placed with %d lines in %d transactions", order_id, len(lines), len(chunks))
+
+            return json_response(200, {
+                "message": "Order placed successfully",
+                "order_id": order_id,
+                "items": items,
+                "total_cost": round(sum(item["line_total"] for item in items), 2),
+                "low_stock_alerts": alerts
+            })
+        except OrderRejected as e:
+            return json_response(409, {"message": "Not enough stock available", "shortages": e.shortages})
+        except Exception as e:
+            if is_condition_failure(e):
+                return json_response(409, {"message": "Stock kept changing while placing the order, please retry"})
+            return self.handle_exception(e, "Failed to place order")
+
+    def _read_products(self, product_ids):
+        products = {product["product_id"]: product
+                    for product in self.product_table.batch_get_items([{"product_id": pid} for pid in product_ids])}
+        for product in products.values():
+            if product.get("stock_shards"):
+                # Check sharded products against their shards; the row's own quantity is only a synced view
+                product["shards"] = self.sharded_stock.shards(product["product_id"])
+                product["synced_quantity"] = product.get("quantity")
+                product["quantity"] = sum(int(shard.get("quantity", 0)) for shard in product["shards"])
+        return products
+
+    def _chunk_lines(self, lines, products):
+        """Split lines into chunks whose worst-case item count fits one transaction next to the order event."""
+        chunks, chunk, budget = [], [], TRANSACTION_MAX_ITEMS - 1
+        for pid, quantity in lines:
+            stock_shards = int(products[pid].get("stock_shards") or 0)
+            cost = stock_shards + 1 if stock_shards else LINE_MAX_ITEMS
+            if chunk and cost > budget:
+                chunks.append(chunk)
+                chunk, budget = [], TRANSACTION_MAX_ITEMS - 1
+            chunk.append((pid, quantity))
+            budget -= cost
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _commit_chunk(self, order_id, chunk, products, cart, final):
+        """
+        Commit one chunk, re-reading its products and retrying when another writer changed
+        their stock in between. Returns the number of low-stock alerts written.
+        """
+        for attempt in range(1, ORDER_MAX_ATTEMPTS + 1):
+            operations, alerts = [], 0
+            for pid, quantity in chunk:
+                line_operations = self._line_operations(order_id, products[pid], quantity)
+                alerts += 0 if products[pid].get("stock_shards") else len(line_operations) - 2
+                operations.extend(line_operations)
+            if final:
+                operations.append(self.outbox_table.put_operation(outbox_event('custom.orders.mattenarle', 'order-placed', {
+                    'order_id': order_id,
+                    'items': [{'product_id': pid, 'quantity': quantity} for pid, quantity in cart.items()],
+                    'timestamp': datetime.now().isoformat()
+                })))
+
+            try:
+                self.product_table.transact_write(operations)
+            except Exception as e:
+                if not is_condition_failure(e) or attempt == ORDER_MAX_ATTEMPTS:
+                    raise
+                logger.info("Stock changed while placing order %s, retrying chunk (attempt %d)", order_id, attempt)
+                # The shard picked may have been short while the product as a whole is not
+                for pid, _ in chunk:
+                    if products[pid].get("stock_shards"):
+                        self.sharded_stock.rebalance(products[pid])
+                fresh = self._read_products([pid for pid, _ in chunk])
+                products.update(fresh)
+                # A product deleted in the meantime counts as out of stock
+                shortages = shortages_for(dict(chunk), {pid: fresh.get(pid, {}) for pid, _ in chunk})
+                if shortages:
+                    raise OrderRejected(shortages)
+                continue
+
+            for pid, quantity in chunk:
+                if products[pid].get("stock_shards"):
+                    sales_counter.add(pid, quantity)
+                    alerts += self.sharded_stock.refresh(products[pid])[1]
+            return alerts
+
+    def _line_operations(self, order_id, product, quantity):
+        """Conditional stock decrement, sales_count increment, ledger entry and any low-stock alert for one line."""
+        product_id = product["product_id"]
+        ledger_operation = self.inventory_table.stock_entry_operation(
+            product_id, -quantity, f"Order {order_id}: purchase of {quantity} units")
+        if product.get("stock_shards"):
+            return [*self._shard_operations(product, quantity), ledger_operation]
+
+        current_stock = int(product.get("quantity", 0))
+        new_stock = current_stock - quantity
+
+        update_expression = "SET quantity = :quantity"
+        expression_values = {":quantity": new_stock, ":read": product.get("quantity", 0), ":sold": quantity}
+        alert, alerted_at = detect_crossing(product, current_stock, new_stock)
+        if alerted_at:
+            update_expression += ", low_stock_alerted_at = :alerted_at"
+            expression_values[":alerted_at"] = alerted_at
+        update_expression, expression_values = with_low_stock_bucket(update_expression, expression_values, product, new_stock)
+
+        condition, expression_values = unsharded_only("quantity = :read", expression_values)
+        operations = [
+            self.product_table.update_operation(
+                {"product_id": product_id},
+                f"{update_expression} ADD sales_count :sold",
+                expression_values,
+                condition,
+            ),
+            ledger_operation,
+        ]
+        if alert:
+            operations.append(self.outbox_table.put_operation(alert))
+        return operations
+
+    def _shard_operations(self, product, quantity):
+        """
+        Decrements for a sharded line: one random shard holding enough, else the fullest shards
+        together. Sharded lines write no alert; the product row is re-synced after the commit
+        and its sales_count goes through the write-behind sales_counter.
+        """
+        product_id, shards = product["product_id"], product["shards"]
+        shard = self.sharded_stock.pick_shard(shards, quantity)
+        if shard is not None:
+            return [self.sharded_stock.decrement_operation(product_id, shard, quantity)]
+        # The stock check passed, so the shards read cover the line between them
+        return self.sharded_stock.take_operations(product_id, shards, quantity)
+
+    def _compensate(self, order_id, lines, products):
+        """
+        Give back the stock of lines already committed when a later chunk failed. The reversal
+        is unconditional (other writers may have moved the quantity since) and is recorded in
+        the ledger; low_stock_bucket catches up on the product's next write. Sharded products
+        get their units back on a random shard and their sales through the sales_counter.
+        """
+        logger.warning("Reversing %d committed lines of order %s", len(lines), order_id)
+        for start in range(0, len(lines), TRANSACTION_MAX_ITEMS // 2):
+            operations = []
+            for pid, quantity in lines[start:start + TRANSACTION_MAX_ITEMS // 2]:
+                if products[pid].get("stock_shards"):
+                    sales_counter.add(pid, -quantity)
+                    operations.append(self.sharded_stock.shard_table.update_operation(
+                        shard_key(pid, self.sharded_stock.random_shard(products[pid])),
+                        "ADD quantity :returned",
+                        {":returned": quantity},
+                    ))
+                else:
+                    operations.append(self.product_table.update_operation(
+                        {"product_id": pid},
+                        "ADD quantity :returned, sales_count :unsold",
+                        {":returned": quantity, ":unsold": -quantity},
+                    ))
+                operations.append(self.inventory_table.stock_entry_operation(
+                    pid, quantity, f"Order {order_id}: reversal of {quantity} units"
+                ))
+            self.product_table.transact_write(operations)
+
+    def handle_exception(self, e, custom_message="An error occurred"):
+        logger.error("%s: %s", custom_message, e)
+        return json_response(500, {"message": custom_message, "error": str(e)})
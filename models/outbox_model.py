@@ -0,0 +1,123 @@
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from boto3.dynamodb.types import TypeDeserializer
+from dotenv import load_dotenv
+
+from gateways.dynamo_gateway import DynamoGateway
+from gateways.eventbridge_gateway import EventBridgeGateway
+from gateways.sqs_gateway import SQSService
+from utils.logger import logger
+from utils.serialization import dumps
+from utils.tracing import trace_methods
+
+load_dotenv()
+outbox_table_name = os.getenv("OUTBOX_TABLE_NAME")
+event_bus_name = os.getenv("EVENT_BUS_NAME")
+
+# PutEvents and SendMessageBatch both accept at most 10 entries per call
+RELAY_BATCH_SIZE = 10
+# The sweep leaves fresh rows to the stream-triggered relay so they are not sent twice
+OUTBOX_SWEEP_MIN_AGE_SECONDS = int(os.getenv("OUTBOX_SWEEP_MIN_AGE_SECONDS", "60"))
+OUTBOX_SWEEP_MAX_ROWS = int(os.getenv("OUTBOX_SWEEP_MAX_ROWS", "1000"))
+
+_deserializer = TypeDeserializer()
+
+
+def new_event_id():
+    return uuid.uuid4().hex
+
+
+def outbox_event(source, detail_type, detail):
+    """Outbox row for an EventBridge event, written in the same transaction as the change it describes."""
+    return {
+        "event_id": new_event_id(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "destination": "eventbridge",
+        "source": source,
+        "detail_type": detail_type,
+        "detail": dumps(detail),
+    }
+
+
+def outbox_message(body):
+    """Outbox row for an SQS message."""
+    return {
+        "event_id": new_event_id(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "destination": "sqs",
+        "body": dumps(body),
+    }
+
+
+def _chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+@trace_methods
+class OutboxModel:
+    def __init__(self, table_name=outbox_table_name):
+        self.outbox_table = DynamoGateway(table_name)
+        self.eventbridge = EventBridgeGateway()
+        self.sqs_gateway = SQSService()
+
+    def relay(self, rows):
+        """
+        Deliver outbox rows in batches of 10 and delete the delivered ones.
+        Undelivered rows stay in the outbox for the next sweep, so delivery is at least once.
+        """
+        delivered = []
+        events = [row for row in rows if row.get("destination") == "eventbridge"]
+        messages = [row for row in rows if row.get("destination") == "sqs"]
+
+        for batch in _chunks(events, RELAY_BATCH_SIZE):
+            entries = [{
+                "Source": row["source"],
+                "DetailType": row["detail_type"],
+                "Detail": row["detail"],
+                "EventBusName": event_bus_name,
+            } for row in batch]
+            failed = set(self.eventbridge.put_event_batch(entries)["failed"])
+            delivered.extend(row for idx, row in enumerate(batch) if idx not in failed)
+
+        for batch in _chunks(messages, RELAY_BATCH_SIZE):
+            failed = set(self.sqs_gateway.send_message_batch([row["body"] for row in batch])["failed"])
+            delivered.extend(row for idx, row in enumerate(batch) if idx not in failed)
+
+        if delivered:
+            self.outbox_table.batch_delete_items([{"event_id": row["event_id"]} for row in delivered])
+
+        pending = len(events) + len(messages) - len(delivered)
+        logger.info("Relayed %d outbox rows, %d left for retry", len(delivered), pending)
+        return {"relayed": len(delivered), "pending": pending}
+
+    def relay_stream_records(self, records):
+        """Relay the rows inserted into the outbox, as delivered by its DynamoDB stream."""
+        rows = [
+            {key: _deserializer.deserialize(value) for key, value in record["dynamodb"]["NewImage"].items()}
+            for record in records
+            if record.get("eventName") == "INSERT" and "NewImage" in record.get("dynamodb", {})
+        ]
+        return self.relay(rows)
+
+    def sweep(self, min_age_seconds=OUTBOX_SWEEP_MIN_AGE_SECONDS, max_rows=OUTBOX_SWEEP_MAX_ROWS):
+        """Relay rows the stream path missed or failed to deliver, oldest pages first."""
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=min_age_seconds)).isoformat()
+        relayed, pending, seen = 0, 0, 0
+        started = time.perf_counter()
+
+        for page in self.outbox_table.iter_item_pages():
+            rows = [row for row in page if row.get("created_at", "") <= cutoff][:max_rows - seen]
+            if rows:
+                result = self.relay(rows)
+                relayed += result["relayed"]
+                pending += result["pending"]
+                seen += len(rows)
+            if seen >= max_rows:
+                break
+
+        logger.info("Outbox sweep relayed %d rows in %.0f ms", relayed, (time.perf_counter() - started) * 1000)
+        return {"relayed": relayed, "pending": pending}
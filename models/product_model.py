@@ -2,35 +2,109 @@ from decimal import Decimal
 from datetime import datetime
 from gateways.sqs_gateway import SQSService 
 from gateways.s3_gateway import S3Gateway
-from gateways.dynamo_gateway import DynamoGateway
-from models.event_model import EventModel
-from utils.decimal_encoder import DecimalEncoder
-import json, os
+from gateways.dynamo_gateway import DynamoGateway, PROJECTABLE_ATTRIBUTES, is_condition_failure
+from models.outbox_model import outbox_event, outbox_message
+from models.low_stock import detect_crossing
+from models.sales_counter import sales_counter
+from models.sharded_stock import MAX_STOCK_SHARDS, InsufficientStock, ShardedStock, stock_projection, unsharded_only
+from utils.serialization import json_response
+from utils.stock_levels import apply_low_stock_bucket, parse_quantity, with_low_stock_bucket
+import os
 from dotenv import load_dotenv
 from utils.logger import logger
+from utils.tracing import trace_methods
 
 
 load_dotenv()
 table_name = os.getenv("TABLE_NAME")  
 inventory_table_name = os.getenv("INVENTORY_TABLE_NAME")  
+outbox_table_name = os.getenv("OUTBOX_TABLE_NAME")
 bucket_name = os.getenv("S3_BUCKET_NAME")  
 
+# Attributes the search response itself reads, projected even when the client asks for fewer
+SEARCH_REQUIRED_FIELDS = ("product_id", "product_name", "price", "quantity")
+# Stock writes whose product row changed between the read and the write are re-read and retried this often
+STOCK_WRITE_MAX_ATTEMPTS = 3
+STOCK_CONFLICT_MESSAGE = "Stock kept changing while updating the product, please retry"
 
+
+def parse_fields(raw_fields):
+    """
+    Parse a comma separated ?fields= value into a tuple of whitelisted attributes.
+    product_id is always included so results stay addressable. Returns None when no fields are requested.
+    """
+    if not raw_fields:
+        return None
+
+    fields = tuple(dict.fromkeys(field.strip() for field in raw_fields.split(",") if field.strip()))
+    unknown = [field for field in fields if field not in PROJECTABLE_ATTRIBUTES]
+    if unknown:
+        raise ValueError(f"Unsupported fields: {', '.join(unknown)}. Allowed fields: {', '.join(PROJECTABLE_ATTRIBUTES)}")
+
+    if "product_id" not in fields:
+        fields = ("product_id",) + fields
+    return fields
+
+
+@trace_methods
 class ProductModel:
-    def __init__(self, table_name=table_name, inventory_table_name=inventory_table_name, bucket_name=bucket_name):
+    def __init__(self, table_name=table_name, inventory_table_name=inventory_table_name, bucket_name=bucket_name,
+                 outbox_table_name=outbox_table_name):
             self.product_table = DynamoGateway(table_name)  # For product-related operations
             self.inventory_table = DynamoGateway(inventory_table_name)  # For inventory-related operations
             self.s3_gateway = S3Gateway(bucket_name)
             self.sqs_gateway = SQSService()
+            self.outbox_table = DynamoGateway(outbox_table_name)  # Events written with the change they describe
+            self.sharded_stock = ShardedStock(self.product_table, self.inventory_table, self.outbox_table)
 
-    def get_all_products(self):
+    def get_all_products(self, fields=None):
         try:
-            items = self.product_table.get_all_items()
-            return {"items": items, "status": "success"}
+            items = self.product_table.get_all_items(stock_projection(fields))
+            return {"items": self.sharded_stock.resolve_totals(items, fields), "status": "success"}
         except Exception as e:
             return self.handle_exception(e, "Failed to fetch products")
 
-    def create_product(self, product_name, quantity, price, product_id):
+    def iter_product_pages(self, fields=None):
+        """Yield the catalog one scan page at a time, for streaming list responses."""
+        for page in self.product_table.iter_item_pages(stock_projection(fields)):
+            yield self.sharded_stock.resolve_totals(page, fields)
+
+    def get_products_by_ids(self, product_ids, fields=None):
+        """
+        Look up many products at once with BatchGetItem and resolve their ledger totals in the same pass.
+        Unknown ids are reported under "missing" instead of failing the whole lookup.
+        """
+        try:
+            # BatchGetItem rejects duplicate keys, so keep the first occurrence of each id
+            unique_ids = list(dict.fromkeys(product_ids))
+            products = self.product_table.batch_get_items([{"product_id": pid} for pid in unique_ids], fields)
+            products_by_id = {product["product_id"]: product for product in products}
+
+            # Skip the ledger pass entirely when the caller did not ask for quantity
+            stock_totals = {}
+            if fields is None or "quantity" in fields:
+                stock_totals = self.inventory_table.get_stock_totals(list(products_by_id))
+
+            items = []
+            for product_id in unique_ids:
+                product = products_by_id.get(product_id)
+                if not product:
+                    continue
+                if stock_totals.get(product_id) is not None:
+                    product["quantity"] = stock_totals[product_id]
+                items.append(product)
+
+            missing = [pid for pid in unique_ids if pid not in products_by_id]
+            logger.info("Bulk lookup found %d products, %d missing", len(items), len(missing))
+            return {"items": items, "missing": missing, "status": "success"}
+        except Exception as e:
+            return self.handle_exception(e, "Failed to fetch products")
+
+    def create_product(self, product_name, quantity, price, product_id, message_body=None, low_stock_threshold=None):
+        """
+        Write the product together with its product-created event (and, when message_body
+        is given, an SQS copy) in one transaction; the outbox relay publishes them.
+        """
         # Convert price to Decimal if it's not already
         if not isinstance(price, Decimal):
             price = Decimal(str(price))
@@ -45,47 +119,53 @@ class ProductModel:
             # Initialize sales_count to track best sellers
             "sales_count": 0
         }
+        if low_stock_threshold is not None:
+            product["low_stock_threshold"] = int(low_stock_threshold)
+        apply_low_stock_bucket(product)
         
         try:
             # The product is passed to DynamoDB with price as Decimal
-            response = self.product_table.create_item(product)
+            operations = [
+                self.product_table.put_operation(product),
+                self.outbox_table.put_operation(outbox_event('custom.products.mattenarle', 'product-created', {
+                    'product_id': product_id,
+                    'product_name': product_name,
+                    'quantity': quantity,
+                    'price': price,
+                    'timestamp': datetime.now().isoformat()
+                })),
+            ]
+            if message_body is not None:
+                operations.append(self.outbox_table.put_operation(outbox_message(message_body)))
+            self.product_table.transact_write(operations)
             
             # Create an enhanced response with the created product details
-            return {
-                "statusCode": 200,
-                "headers": {
-                    "Content-Type": "application/json"
+            return json_response(200, {
+                "message": "Product created successfully",
+                "product": {
+                    "product_id": product_id,
+                    "product_name": product_name,
+                    "quantity": quantity,
+                    "price": price,
+                    "created_at": datetime.now().isoformat()
                 },
-                "body": json.dumps({
-                    "message": "Product created successfully",
-                    "product": {
-                        "product_id": product_id,
-                        "product_name": product_name,
-                        "quantity": quantity,
-                        "price": price,
-                        "created_at": datetime.now().isoformat()
-                    },
-                    "status": "success"
-                }, cls=DecimalEncoder)
-            }
+                "status": "success"
+            })
         except Exception as e:
             return self.handle_exception(e, "Failed to create product")
 
-    def get_product(self, product_id):
+    def get_product(self, product_id, fields=None):
         try:
-            product = self.product_table.get_item({"product_id": product_id})
+            product = self.product_table.get_item({"product_id": product_id}, fields)
             if not product:
-                return {
-                    "statusCode": 404, 
-                    "headers": {
-                        "Content-Type": "application/json"
-                    },
-                    "body": json.dumps({"message": "Product not found"})
-                }
+                return json_response(404, {"message": "Product not found"})
+
+            if fields is not None and "quantity" not in fields:
+                return product
 
-            # Get stock entries and calculate total
-            stock_entries = self.inventory_table.get_stock_entries(product_id)
-            total_stock = sum(int(entry["quantity"]) for entry in stock_entries) if stock_entries else product.get("quantity", 0)
+            # Resolve the ledger total from the latest snapshot and newer entries
+            ledger_total = self.inventory_table.get_stock_total(product_id)
+            total_stock = ledger_total if ledger_total is not None else product.get("quantity", 0)
 
             # Update product with the correct quantity
             product["quantity"] = total_stock
@@ -103,13 +183,9 @@ class ProductModel:
             product = self.product_table.get_item({"product_id": product_id})
             
             if not product:
-                return {
-                    "statusCode": 404,
-                    "headers": {"Content-Type": "application/json"},
-                    "body": json.dumps({
-                        "message": f"Product with ID {product_id} not found"
-                    }, cls=DecimalEncoder)
-                }
+                return json_response(404, {
+                    "message": f"Product with ID {product_id} not found"
+                })
                 
             product_name = product.get('product_name', 'Unknown')
             
@@ -117,166 +193,281 @@ class ProductModel:
             self.product_table.delete_item({"product_id": product_id})
             
             # Return a more detailed response with the deleted product information
-            return {
-                "statusCode": 200,
-                "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({
-                    "message": "Product deleted successfully",
-                    "deleted_product": {
-                        "product_id": product_id,
-                        "product_name": product_name
-                    }
-                }, cls=DecimalEncoder)
-            }
+            return json_response(200, {
+                "message": "Product deleted successfully",
+                "deleted_product": {
+                    "product_id": product_id,
+                    "product_name": product_name
+                }
+            })
         except Exception as e:
             return self.handle_exception(e, "Failed to delete product")
 
     def modify_product(self, product_id, product_name, quantity, price):
+        try:
+            for attempt in range(1, STOCK_WRITE_MAX_ATTEMPTS + 1):
+                # The stored item carries the threshold that decides low_stock_bucket and any alert
+                stored = self.product_table.get_item({"product_id": product_id}, consistent_read=attempt > 1) or {}
+                product = {**stored, "product_id": product_id, "product_name": product_name}
+
+                if stored.get("stock_shards"):
+                    return self._modify_sharded_product(product, quantity, price)
+                try:
+                    return self._modify_unsharded_product(product, quantity, price)
+                except Exception as e:
+                    if not is_condition_failure(e) or attempt == STOCK_WRITE_MAX_ATTEMPTS:
+                        raise
+                    logger.info("Product %s was sharded during update, retrying (attempt %d)", product_id, attempt)
+
+        except Exception as e:
+            if is_condition_failure(e):
+                return json_response(409, {"message": STOCK_CONFLICT_MESSAGE})
+            return self.handle_exception(e, "Failed to update product")
+
+    def _modify_unsharded_product(self, product, quantity, price):
+        """
+        modify_product for a product whose stock lives on its row (or a new product). The new
+        quantity replaces whatever is stored, but not once the product has been sharded.
+        """
+        product_id = product["product_id"]
+        product_name = product["product_name"]
         update_expression = "SET product_name = :name, quantity = :quantity, price = :price"
         expression_values = {
             ":name": product_name,
             ":quantity": quantity,
             ":price": price,
         }
+        new_quantity = parse_quantity(quantity)
+
+        alert, alerted_at = detect_crossing(product, parse_quantity(product.get("quantity")), new_quantity)
+        if alerted_at:
+            update_expression += ", low_stock_alerted_at = :alerted_at"
+            expression_values[":alerted_at"] = alerted_at
+        update_expression, expression_values = with_low_stock_bucket(update_expression, expression_values, product, new_quantity)
+        condition, expression_values = unsharded_only(None, expression_values)
+
+        # Update the product and record its product-updated event atomically
+        operations = [
+            self.product_table.update_operation({"product_id": product_id}, update_expression, expression_values, condition),
+            self.outbox_table.put_operation(outbox_event('custom.products.mattenarle', 'product-updated', {
+                'product_id': product_id,
+                'product_name': product_name,
+                'quantity': quantity,
+                'price': price,
+                'timestamp': datetime.now().isoformat()
+            })),
+        ]
+        if alert:
+            operations.append(self.outbox_table.put_operation(alert))
+            logger.info("Low stock alert triggered for product %s", product_id)
+        self.product_table.transact_write(operations)
+
+        # Return a more detailed response with the updated product information
+        return json_response(200, {
+            "message": "Product updated successfully",
+            "product": {
+                "product_id": product_id,
+                "product_name": product_name,
+                "quantity": quantity,
+                "price": price
+            },
+            "low_stock_alert": alert is not None
+        })
+
+    def _modify_sharded_product(self, product, quantity, price):
+        """modify_product for a sharded product: the new quantity is spread over its shards."""
+        product_id = product["product_id"]
+        self.product_table.transact_write([
+            self.product_table.update_operation(
+                {"product_id": product_id}, "SET product_name = :name, price = :price",
+                {":name": product["product_name"], ":price": price},
+            ),
+            self.outbox_table.put_operation(outbox_event('custom.products.mattenarle', 'product-updated', {
+                'product_id': product_id,
+                'product_name': product["product_name"],
+                'quantity': quantity,
+                'price': price,
+                'timestamp': datetime.now().isoformat()
+            })),
+        ])
+        _, alerted = self.sharded_stock.rebalance(product, total=parse_quantity(quantity))
+
+        return json_response(200, {
+            "message": "Product updated successfully",
+            "product": {
+                "product_id": product_id,
+                "product_name": product["product_name"],
+                "quantity": quantity,
+                "price": price
+            },
+            "low_stock_alert": alerted
+        })
+
+    def configure_stock_shards(self, product_id, shards):
+        """
+        Switch a product to sharded stock counters (shards >= 1), change its shard count,
+        or fold the shards back into the product row (shards = 0).
+        """
+        if not 0 <= shards <= MAX_STOCK_SHARDS:
+            return json_response(400, {"message": f"shards must be between 0 and {MAX_STOCK_SHARDS}"})
+
         try:
-            # Update the product
-            self.product_table.update_item(
-                key={"product_id": product_id},
-                update_expression=update_expression,
-                expression_values=expression_values,
-            )
-            
-            # Return a more detailed response with the updated product information
-            return {
-                "statusCode": 200,
-                "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({
-                    "message": "Product updated successfully",
-                    "product": {
-                        "product_id": product_id,
-                        "product_name": product_name,
-                        "quantity": quantity,
-                        "price": price
-                    }
-                }, cls=DecimalEncoder)
-            }
+            product = self.product_table.get_item({"product_id": product_id})
+            if not product:
+                return json_response(404, {"message": f"Product with ID {product_id} not found"})
+
+            if product.get("stock_shards"):
+                product["quantity"] = self.sharded_stock.disable(product)
+            if shards:
+                self.sharded_stock.enable(product, shards)
+
+            return json_response(200, {
+                "message": "Stock shards updated successfully",
+                "product_id": product_id,
+                "stock_shards": shards,
+                "quantity": int(product.get("quantity", 0))
+            })
         except Exception as e:
-            return self.handle_exception(e, "Failed to update product")
+            return self.handle_exception(e, "Failed to configure stock shards")
 
     def batch_create_products(self, event):
         try:
             # Get the file from the S3 event
             key = self.s3_gateway.get_file_key_from_event(event)
-            logger.info(f"Processing file: {key}")
+            logger.info("Processing file: %s", key)
             
             # Validate file prefix
             if not self.s3_gateway.is_valid_file(key, "for_create/"):
-                logger.info(f"Skipping file {key}, as it's not in 'for_create' folder")
+                logger.info("Skipping file %s, as it's not in 'for_create' folder", key)
                 return {"statusCode": 200, "body": "Not in 'for_create' folder"}
 
             # Download the file and process it
             filename = os.path.basename(key)
             local_filename = f'/tmp/{filename}'
-            logger.info(f"Downloading file to {local_filename}")
+            logger.info("Downloading file to %s", local_filename)
             self.s3_gateway.download_file(key, local_filename)
 
             # Read the CSV file and prepare data
             products_data = self.s3_gateway.read_csv(local_filename)
-            logger.info(f"Read {len(products_data)} products from CSV")
-            logger.debug(f"Products data: {json.dumps(products_data, indent=2)}")
+            logger.info("Read %d products from CSV", len(products_data))
+            logger.debug("Products data", extra={"products": products_data})
+
+            alerts = self._low_stock_alerts_for_import(products_data)
 
             # Write directly to DynamoDB
-            logger.info(f"Writing {len(products_data)} products to DynamoDB table {self.product_table.table_name}")
+            logger.info("Writing %d products to DynamoDB table %s", len(products_data), self.product_table.table_name)
             response = self.product_table.batch_create_items(products_data)
-            logger.info(f"DynamoDB response: {json.dumps(response, indent=2)}")
-
-            return {
-                "statusCode": 200,
-                "body": json.dumps({
-                    "message": f"Successfully processed {len(products_data)} products",
-                    "response": response
-                })
-            }
+            logger.info("DynamoDB response", extra={"status_code": response.get("statusCode")})
+
+            # Imports use BatchWriteItem rather than transactions, so alerts follow the products they describe
+            if alerts:
+                logger.info("Import crossed the low-stock threshold for %d products", len(alerts))
+                self.outbox_table.batch_create_items(alerts)
+
+            return json_response(200, {
+                "message": f"Successfully processed {len(products_data)} products",
+                "response": response,
+                "low_stock_alerts": len(alerts)
+            })
         except Exception as e:
-            logger.error(f"Error processing batch create: {str(e)}")
+            logger.error("Error processing batch create: %s", e)
             return self.handle_exception(e, "Failed to create products in batch")
 
+    def _low_stock_alerts_for_import(self, rows):
+        """
+        Compare imported quantities with the stored ones (one BatchGetItem pass) and return
+        outbox rows for products the import takes below their low-stock threshold.
+        Rows replace whole items, so each row keeps the product's threshold and last alert time
+        and gets low_stock_bucket set or dropped for its new quantity.
+        """
+        product_ids = list(dict.fromkeys(row["product_id"] for row in rows if row.get("product_id")))
+        existing = {item["product_id"]: item for item in self.product_table.batch_get_items([{"product_id": pid} for pid in product_ids])}
+
+        alerts = []
+        for row in rows:
+            if not row.get("product_id"):
+                continue
+            previous = existing.get(row["product_id"])
+            if previous:
+                for attribute in ("low_stock_threshold", "low_stock_alerted_at"):
+                    if attribute in previous and attribute not in row:
+                        row[attribute] = previous[attribute]
+
+            new_quantity = parse_quantity(row.get("quantity"))
+            if new_quantity is None:
+                continue
+            alert, alerted_at = detect_crossing(row, parse_quantity(previous.get("quantity")) if previous else None, new_quantity)
+            if alert:
+                row["low_stock_alerted_at"] = alerted_at
+                alerts.append(alert)
+            # A product repeated later in the same file is compared with this row
+            existing[row["product_id"]] = row
+            apply_low_stock_bucket(row)
+        return alerts
+
     def batch_delete_products(self, event):
         try:
             # Get the file from the S3 event
             key = self.s3_gateway.get_file_key_from_event(event)
-            logger.info(f"Processing delete file: {key}")
+            logger.info("Processing delete file: %s", key)
             
             # Validate file prefix
             if not self.s3_gateway.is_valid_file(key, "for_delete/"):
-                logger.info(f"Skipping file {key}, as it's not in 'for_delete' folder")
+                logger.info("Skipping file %s, as it's not in 'for_delete' folder", key)
                 return {"statusCode": 200, "body": "Not in 'for_delete' folder"}
 
             # Download the file and process it
             filename = os.path.basename(key)
             local_filename = f'/tmp/{filename}'
-            logger.info(f"Downloading file to {local_filename}")
+            logger.info("Downloading file to %s", local_filename)
             self.s3_gateway.download_file(key, local_filename)
 
             # Read the CSV file and prepare data
             csv_data = self.s3_gateway.read_csv(local_filename)
-            logger.info(f"Read {len(csv_data)} items from CSV")
+            logger.info("Read %d items from CSV", len(csv_data))
             
             # Extract product IDs and prepare keys for deletion
             delete_keys = [{'product_id': row['product_id']} for row in csv_data]
-            logger.info(f"Preparing to delete {len(delete_keys)} products")
-            logger.debug(f"Products to delete: {json.dumps(delete_keys, indent=2)}")
+            logger.info("Preparing to delete %d products", len(delete_keys))
+            logger.debug("Products to delete", extra={"delete_keys": delete_keys})
 
             # Delete directly from DynamoDB
-            logger.info(f"Deleting {len(delete_keys)} products from DynamoDB table {self.product_table.table_name}")
+            logger.info("Deleting %d products from DynamoDB table %s", len(delete_keys), self.product_table.table_name)
             response = self.product_table.batch_delete_items(delete_keys)
-            logger.info(f"DynamoDB response: {json.dumps(response, indent=2)}")
+            logger.info("DynamoDB response", extra={"status_code": response.get("statusCode")})
 
-            return {
-                "statusCode": 200,
-                "body": json.dumps({
-                    "message": f"Successfully deleted {len(delete_keys)} products",
-                    "response": response
-                })
-            }
+            return json_response(200, {
+                "message": f"Successfully deleted {len(delete_keys)} products",
+                "response": response
+            })
         except Exception as e:
-            logger.error(f"Error processing batch delete: {str(e)}")
+            logger.error("Error processing batch delete: %s", e)
             return self.handle_exception(e, "Failed to delete products in batch")
     
     def validate_product_fields(self, fields):
         missing = [field for field, value in fields.items() if not value]
         if missing:
-            return {
-                "statusCode": 400, 
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({"message": f"Missing required fields: {', '.join(missing)}"})
-            }
+            return json_response(400, {"message": f"Missing required fields: {', '.join(missing)}"})
         return None
         
-    def search_products_by_name(self, product_name):
+    def search_products_by_name(self, product_name, fields=None):
         """
         Search for products by name and return detailed information.
         Format is optimized for Freshchat integration.
         Returns the most relevant single result to avoid duplicates.
+        When fields are given, entries in "products" are narrowed to those attributes.
         """
         try:
-            logger.info(f"Searching for products with name: {product_name}")
+            logger.info("Searching for products with name: %s", product_name)
             
             # Use the DynamoDB gateway to search for products by name
             # The gateway now returns results sorted by relevance
-            products = self.product_table.search_products_by_name(product_name)
+            scan_fields = tuple(dict.fromkeys(SEARCH_REQUIRED_FIELDS + fields)) if fields else None
+            products = self.product_table.search_products_by_name(product_name, scan_fields)
             
             if not products:
-                logger.info(f"No products found matching name: {product_name}")
-                return {
-                    "statusCode": 404,
-                    "headers": {
-                        "Content-Type": "application/json"
-                    },
-                    "body": json.dumps({"message": f"No products found matching '{product_name}'"})
-                }
+                logger.info("No products found matching name: %s", product_name)
+                return json_response(404, {"message": f"No products found matching '{product_name}'"})
             
             # Get the most relevant product (first in the sorted list)
             most_relevant_product = products[0]
@@ -284,10 +475,10 @@ class ProductModel:
             
             # Get stock entries and calculate total for the most relevant product
             if product_id:
-                stock_entries = self.inventory_table.get_stock_entries(product_id)
+                ledger_total = self.inventory_table.get_stock_total(product_id)
                 # Handle potential Decimal values properly
                 try:
-                    total_stock = sum(float(entry["quantity"]) for entry in stock_entries) if stock_entries else float(most_relevant_product.get("quantity", 0))
+                    total_stock = float(ledger_total) if ledger_total is not None else float(most_relevant_product.get("quantity", 0))
                 except (ValueError, TypeError):
                     # Fallback if conversion fails
                     total_stock = most_relevant_product.get("quantity", 0)
@@ -301,72 +492,61 @@ class ProductModel:
             for product in products:
                 if product.get("product_id") != product_id:  # Skip the most relevant one as we already processed it
                     pid = product.get("product_id")
-                    if pid:
-                        stock_entries = self.inventory_table.get_stock_entries(pid)
-                        total_stock = sum(int(entry["quantity"]) for entry in stock_entries) if stock_entries else product.get("quantity", 0)
+                    if pid and (fields is None or "quantity" in fields):
+                        ledger_total = self.inventory_table.get_stock_total(pid)
+                        total_stock = ledger_total if ledger_total is not None else product.get("quantity", 0)
                         product["quantity"] = total_stock
                     enhanced_products.append(product)
             
             # Add the most relevant product at the beginning
             enhanced_products.insert(0, most_relevant_product)
+
+            listed_products = enhanced_products
+            if fields:
+                listed_products = [{k: v for k, v in p.items() if k in fields} for p in enhanced_products]
             
-            logger.info(f"Found {len(enhanced_products)} products matching '{product_name}', returning most relevant: {most_relevant_product.get('product_name')}")
+            logger.info("Found %d products matching '%s', returning most relevant: %s", len(enhanced_products), product_name, most_relevant_product.get('product_name'))
             
             # Create a response that's easier to use with Freshchat conditions
             # and focuses on the single most relevant result
-            return {
-                "statusCode": 200,
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({
-                    # Include all products for reference, but the first one is the most relevant
-                    "products": enhanced_products,
-                    "count": len(enhanced_products),
-                    "search_term": product_name,
-                    # Focus on the most relevant product for Freshchat
-                    "product_id": most_relevant_product.get("product_id", ""),
-                    "product_name": most_relevant_product.get("product_name", ""),
+            return json_response(200, {
+                # Include all products for reference, but the first one is the most relevant
+                "products": listed_products,
+                "count": len(enhanced_products),
+                "search_term": product_name,
+                # Focus on the most relevant product for Freshchat
+                "product_id": most_relevant_product.get("product_id", ""),
+                "product_name": most_relevant_product.get("product_name", ""),
+                "price": most_relevant_product.get("price", 0),
+                "quantity": most_relevant_product.get("quantity", 0),
+                # Add more specific details about the matched product
+                "matched_product": {
+                    "id": most_relevant_product.get("product_id", ""),
+                    "name": most_relevant_product.get("product_name", ""),
                     "price": most_relevant_product.get("price", 0),
                     "quantity": most_relevant_product.get("quantity", 0),
-                    # Add more specific details about the matched product
-                    "matched_product": {
-                        "id": most_relevant_product.get("product_id", ""),
-                        "name": most_relevant_product.get("product_name", ""),
-                        "price": most_relevant_product.get("price", 0),
-                        "quantity": most_relevant_product.get("quantity", 0),
-                        "available": int(most_relevant_product.get("quantity", 0)) > 0,
-                        "price_formatted": f"${float(most_relevant_product.get('price', 0)):,.2f}"
-                    },
-                    "exact_match": product_name.lower() in most_relevant_product.get("product_name", "").lower(),
-                    # Convert array to string for Freshchat compatibility
-                    "search_keywords_string": ",".join([p.get("product_name", "").lower() for p in enhanced_products]),
-                    # Keep original array for backward compatibility
-                    "search_keywords": [p.get("product_name", "").lower() for p in enhanced_products],
-                    # Add direct string match for Freshchat comparison
-                    "matched_term": product_name,
-                    # Add a simple boolean flag for conditions
-                    "found": True,
-                    # Add a flag indicating this is the most relevant result
-                    "is_best_match": True
-                }, cls=DecimalEncoder)
-            }
+                    "available": int(most_relevant_product.get("quantity", 0)) > 0,
+                    "price_formatted": f"${float(most_relevant_product.get('price', 0)):,.2f}"
+                },
+                "exact_match": product_name.lower() in most_relevant_product.get("product_name", "").lower(),
+                # Convert array to string for Freshchat compatibility
+                "search_keywords_string": ",".join([p.get("product_name", "").lower() for p in enhanced_products]),
+                # Keep original array for backward compatibility
+                "search_keywords": [p.get("product_name", "").lower() for p in enhanced_products],
+                # Add direct string match for Freshchat comparison
+                "matched_term": product_name,
+                # Add a simple boolean flag for conditions
+                "found": True,
+                # Add a flag indicating this is the most relevant result
+                "is_best_match": True
+            })
             
         except Exception as e:
             return self.handle_exception(e, f"Failed to search for products with name '{product_name}'")
 
     def handle_exception(self, e, custom_message="An error occurred"):
-        logger.error(f"{custom_message}: {str(e)}")
-        return {
-            "statusCode": 500,
-            "headers": {
-                "Content-Type": "application/json"
-            },
-            "body": json.dumps(
-                {"message": custom_message, "error": str(e)},
-                cls=DecimalEncoder
-            )
-        }
+        logger.error("%s: %s", custom_message, e)
+        return json_response(500, {"message": custom_message, "error": str(e)})
         
     def buy_product(self, product_id, quantity=1):
         """
@@ -374,84 +554,125 @@ class ProductModel:
         Returns total cost and updated stock information.
         """
         try:
-            # Get current product details
-            product = self.product_table.get_item({"product_id": product_id})
-            if not product:
-                return {
-                    "statusCode": 404,
-                    "headers": {"Content-Type": "application/json"},
-                    "body": json.dumps({"message": f"Product with ID {product_id} not found"})
-                }
-            
             # Ensure quantity is a positive number
             quantity = abs(int(quantity))
             if quantity <= 0:
                 quantity = 1  # Default to 1 if invalid quantity provided
-                
-            # Get current stock directly from the product table
-            # This ensures consistency when buying by name or ID
-            current_stock = int(product.get("quantity", 0))
-            
-            # Check if enough stock is available
-            if current_stock < quantity:
-                return {
-                    "statusCode": 400,
-                    "headers": {"Content-Type": "application/json"},
-                    "body": json.dumps({
-                        "message": "Not enough stock available",
-                        "available": current_stock,
-                        "requested": quantity
-                    }, cls=DecimalEncoder)
-                }
-            
-            # Calculate total cost
-            price = float(product.get("price", 0))
-            total_cost = price * quantity
-            
-            # Update the product directly with the new quantity and increment sales_count
-            new_stock = current_stock - quantity
-            
-            # Get current sales count or default to 0 if not present
-            current_sales = int(product.get("sales_count", 0))
-            new_sales = current_sales + quantity
-            
-            # Update both quantity and sales_count
-            update_expression = "SET quantity = :quantity, sales_count = :sales_count"
-            expression_values = {
-                ":quantity": new_stock,
-                ":sales_count": new_sales
-            }
-            
-            # Update product quantity directly
-            self.product_table.update_item(
-                key={"product_id": product_id},
-                update_expression=update_expression,
-                expression_values=expression_values
-            )
-            
-            # Add a record of this purchase to the inventory table
-            self.inventory_table.add_stock_entry(product_id, -quantity, f"Purchase of {quantity} units")
-            
-            # Return success response with details
-            return {
-                "statusCode": 200,
-                "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({
-                    "message": "Purchase successful",
-                    "product": {
-                        "product_id": product_id,
-                        "product_name": product.get("product_name"),
-                        "quantity_purchased": quantity,
-                        "price_per_unit": price,
-                        "total_cost": total_cost,
-                        "remaining_stock": new_stock
-                    }
-                }, cls=DecimalEncoder)
-            }
-            
+
+            for attempt in range(1, STOCK_WRITE_MAX_ATTEMPTS + 1):
+                # Get current product details, strongly consistent once a write has conflicted
+                product = self.product_table.get_item({"product_id": product_id}, consistent_read=attempt > 1)
+                if not product:
+                    return json_response(404, {"message": f"Product with ID {product_id} not found"})
+
+                if product.get("stock_shards"):
+                    return self._buy_sharded_product(product, quantity)
+                try:
+                    return self._buy_unsharded_product(product, quantity)
+                except Exception as e:
+                    if not is_condition_failure(e) or attempt == STOCK_WRITE_MAX_ATTEMPTS:
+                        raise
+                    logger.info("Stock of product %s changed during purchase, retrying (attempt %d)", product_id, attempt)
+
         except Exception as e:
+            if is_condition_failure(e):
+                return json_response(409, {"message": STOCK_CONFLICT_MESSAGE})
             return self.handle_exception(e, "Failed to process purchase")
+
+    def _buy_unsharded_product(self, product, quantity):
+        """
+        buy_product for a product whose stock lives on its row. The update is conditional on
+        the quantity read, so a concurrent write makes it fail instead of being overwritten.
+        """
+        product_id = product["product_id"]
+        # Get current stock directly from the product table
+        # This ensures consistency when buying by name or ID
+        current_stock = int(product.get("quantity", 0))
+        
+        # Check if enough stock is available
+        if current_stock < quantity:
+            return json_response(400, {
+                "message": "Not enough stock available",
+                "available": current_stock,
+                "requested": quantity
+            })
+        
+        # Calculate total cost
+        price = float(product.get("price", 0))
+        total_cost = price * quantity
+        
+        # Update the product directly with the new quantity and increment sales_count
+        new_stock = current_stock - quantity
+        
+        # sales_count is added to in the same write rather than rewritten from the value read,
+        # so concurrent purchases cannot overwrite each other's counts
+        update_expression = "SET quantity = :quantity"
+        expression_values = {
+            ":quantity": new_stock,
+            ":sold": quantity
+        }
+
+        alert, alerted_at = detect_crossing(product, current_stock, new_stock)
+        if alerted_at:
+            update_expression += ", low_stock_alerted_at = :alerted_at"
+            expression_values[":alerted_at"] = alerted_at
+        update_expression, expression_values = with_low_stock_bucket(update_expression, expression_values, product, new_stock)
+
+        condition, expression_values = unsharded_only(
+            "quantity = :read", {**expression_values, ":read": product.get("quantity", 0)})
+
+        # The product update, the purchase's ledger entry and any low-stock alert commit together
+        operations = [
+            self.product_table.update_operation(
+                {"product_id": product_id}, f"{update_expression} ADD sales_count :sold", expression_values, condition),
+            self.inventory_table.stock_entry_operation(product_id, -quantity, f"Purchase of {quantity} units"),
+        ]
+        if alert:
+            operations.append(self.outbox_table.put_operation(alert))
+            logger.info("Low stock alert triggered for product %s", product_id)
+        self.product_table.transact_write(operations)
+        
+        # Return success response with details
+        return json_response(200, {
+            "message": "Purchase successful",
+            "product": {
+                "product_id": product_id,
+                "product_name": product.get("product_name"),
+                "quantity_purchased": quantity,
+                "price_per_unit": price,
+                "total_cost": total_cost,
+                "remaining_stock": new_stock
+            },
+            "low_stock_alert": alert is not None
+        })
     
+    def _buy_sharded_product(self, product, quantity):
+        """buy_product for a sharded product: the units come out of one of its shards."""
+        try:
+            self.sharded_stock.decrement(product, quantity, f"Purchase of {quantity} units")
+        except InsufficientStock as e:
+            return json_response(400, {
+                "message": "Not enough stock available",
+                "available": e.available,
+                "requested": quantity
+            })
+        sales_counter.add(product["product_id"], quantity)
+        remaining, alerted = self.sharded_stock.refresh(product)
+
+        price = float(product.get("price", 0))
+        return json_response(200, {
+            "message": "Purchase successful",
+            "product": {
+                "product_id": product["product_id"],
+                "product_name": product.get("product_name"),
+                "quantity_purchased": quantity,
+                "price_per_unit": price,
+                "total_cost": price * quantity,
+                "remaining_stock": remaining
+            },
+            "low_stock_alert": alerted
+        })
+
     def get_specialized_products(self, query_type=None):
         """
         Get specialized product data.
@@ -462,16 +683,10 @@ class ProductModel:
         """
         try:
             # Get all products
-            all_products = self.product_table.get_all_items()
+            all_products = self.sharded_stock.resolve_totals(self.product_table.get_all_items())
             
             if not all_products:
-                return {
-                    "statusCode": 404,
-                    "headers": {
-                        "Content-Type": "application/json"
-                    },
-                    "body": json.dumps({"message": "No products found"})
-                }
+                return json_response(404, {"message": "No products found"})
             
             # If query_type is None, return all specialized product types
             if query_type is None:
@@ -501,63 +716,57 @@ class ProductModel:
                 best_seller = sales_sorted[0] if sales_sorted else None
                 
                 # Format the response with all specialized product types
-                return {
-                    "statusCode": 200,
-                    "headers": {
-                        "Content-Type": "application/json"
+                return json_response(200, {
+                    "most_expensive": {
+                        "label": "Most Expensive Product",
+                        "product": most_expensive,
+                        "product_id": most_expensive.get("product_id", "") if most_expensive else "",
+                        "product_name": most_expensive.get("product_name", "") if most_expensive else "",
+                        "price": most_expensive.get("price", 0) if most_expensive else 0,
+                        "quantity": most_expensive.get("quantity", 0) if most_expensive else 0,
+                        "price_formatted": f"${float(most_expensive.get('price', 0)):,.2f}" if most_expensive else "$0.00"
                     },
-                    "body": json.dumps({
-                        "most_expensive": {
-                            "label": "Most Expensive Product",
-                            "product": most_expensive,
-                            "product_id": most_expensive.get("product_id", "") if most_expensive else "",
-                            "product_name": most_expensive.get("product_name", "") if most_expensive else "",
-                            "price": most_expensive.get("price", 0) if most_expensive else 0,
-                            "quantity": most_expensive.get("quantity", 0) if most_expensive else 0,
-                            "price_formatted": f"${float(most_expensive.get('price', 0)):,.2f}" if most_expensive else "$0.00"
-                        },
-                        "least_expensive": {
-                            "label": "Least Expensive Product",
-                            "product": least_expensive,
-                            "product_id": least_expensive.get("product_id", "") if least_expensive else "",
-                            "product_name": least_expensive.get("product_name", "") if least_expensive else "",
-                            "price": least_expensive.get("price", 0) if least_expensive else 0,
-                            "quantity": least_expensive.get("quantity", 0) if least_expensive else 0,
-                            "price_formatted": f"${float(least_expensive.get('price', 0)):,.2f}" if least_expensive else "$0.00"
-                        },
-                        "most_stock": {
-                            "label": "Most Stocked Product",
-                            "product": most_stock,
-                            "product_id": most_stock.get("product_id", "") if most_stock else "",
-                            "product_name": most_stock.get("product_name", "") if most_stock else "",
-                            "price": most_stock.get("price", 0) if most_stock else 0,
-                            "quantity": most_stock.get("quantity", 0) if most_stock else 0,
-                            "price_formatted": f"${float(most_stock.get('price', 0)):,.2f}" if most_stock else "$0.00"
-                        },
-                        "least_stock": {
-                            "label": "Least Stocked Product",
-                            "product": least_stock,
-                            "product_id": least_stock.get("product_id", "") if least_stock else "",
-                            "product_name": least_stock.get("product_name", "") if least_stock else "",
-                            "price": least_stock.get("price", 0) if least_stock else 0,
-                            "quantity": least_stock.get("quantity", 0) if least_stock else 0,
-                            "price_formatted": f"${float(least_stock.get('price', 0)):,.2f}" if least_stock else "$0.00"
-                        },
-                        "best_seller": {
-                            "label": "Best Selling Product",
-                            "product": best_seller,
-                            "product_id": best_seller.get("product_id", "") if best_seller else "",
-                            "product_name": best_seller.get("product_name", "") if best_seller else "",
-                            "price": best_seller.get("price", 0) if best_seller else 0,
-                            "quantity": best_seller.get("quantity", 0) if best_seller else 0,
-                            "sales_count": best_seller.get("sales_count", 0) if best_seller else 0,
-                            "price_formatted": f"${float(best_seller.get('price', 0)):,.2f}" if best_seller else "$0.00"
-                        }
-                    }, cls=DecimalEncoder)
-                }
+                    "least_expensive": {
+                        "label": "Least Expensive Product",
+                        "product": least_expensive,
+                        "product_id": least_expensive.get("product_id", "") if least_expensive else "",
+                        "product_name": least_expensive.get("product_name", "") if least_expensive else "",
+                        "price": least_expensive.get("price", 0) if least_expensive else 0,
+                        "quantity": least_expensive.get("quantity", 0) if least_expensive else 0,
+                        "price_formatted": f"${float(least_expensive.get('price', 0)):,.2f}" if least_expensive else "$0.00"
+                    },
+                    "most_stock": {
+                        "label": "Most Stocked Product",
+                        "product": most_stock,
+                        "product_id": most_stock.get("product_id", "") if most_stock else "",
+                        "product_name": most_stock.get("product_name", "") if most_stock else "",
+                        "price": most_stock.get("price", 0) if most_stock else 0,
+                        "quantity": most_stock.get("quantity", 0) if most_stock else 0,
+                        "price_formatted": f"${float(most_stock.get('price', 0)):,.2f}" if most_stock else "$0.00"
+                    },
+                    "least_stock": {
+                        "label": "Least Stocked Product",
+                        "product": least_stock,
+                        "product_id": least_stock.get("product_id", "") if least_stock else "",
+                        "product_name": least_stock.get("product_name", "") if least_stock else "",
+                        "price": least_stock.get("price", 0) if least_stock else 0,
+                        "quantity": least_stock.get("quantity", 0) if least_stock else 0,
+                        "price_formatted": f"${float(least_stock.get('price', 0)):,.2f}" if least_stock else "$0.00"
+                    },
+                    "best_seller": {
+                        "label": "Best Selling Product",
+                        "product": best_seller,
+                        "product_id": best_seller.get("product_id", "") if best_seller else "",
+                        "product_name": best_seller.get("product_name", "") if best_seller else "",
+                        "price": best_seller.get("price", 0) if best_seller else 0,
+                        "quantity": best_seller.get("quantity", 0) if best_seller else 0,
+                        "sales_count": best_seller.get("sales_count", 0) if best_seller else 0,
+                        "price_formatted": f"${float(best_seller.get('price', 0)):,.2f}" if best_seller else "$0.00"
+                    }
+                })
             
             # If query_type is specified, process as before
-            logger.info(f"Getting specialized product data: {query_type}")
+            logger.info("Getting specialized product data: %s", query_type)
             
             # Process products based on query_type
             if query_type == 'most_expensive':
@@ -581,43 +790,25 @@ class ProductModel:
                 sorted_products = sorted(all_products, key=lambda x: int(x.get('sales_count', 0)), reverse=True)
                 result_label = "Best Selling Product"
             else:
-                return {
-                    "statusCode": 400,
-                    "headers": {
-                        "Content-Type": "application/json"
-                    },
-                    "body": json.dumps({"message": f"Invalid query type: {query_type}"})
-                }
+                return json_response(400, {"message": f"Invalid query type: {query_type}"})
             
             # Get the top result
             top_product = sorted_products[0] if sorted_products else None
             
             if not top_product:
-                return {
-                    "statusCode": 404,
-                    "headers": {
-                        "Content-Type": "application/json"
-                    },
-                    "body": json.dumps({"message": "No matching products found"})
-                }
+                return json_response(404, {"message": "No matching products found"})
             
             # Format response for Freshchat compatibility
-            return {
-                "statusCode": 200,
-                "headers": {
-                    "Content-Type": "application/json"
-                },
-                "body": json.dumps({
-                    "query_type": query_type,
-                    "result_label": result_label,
-                    "product": top_product,
-                    "product_id": top_product.get("product_id", ""),
-                    "product_name": top_product.get("product_name", ""),
-                    "price": top_product.get("price", 0),
-                    "quantity": top_product.get("quantity", 0),
-                    "price_formatted": f"${float(top_product.get('price', 0)):,.2f}"
-                }, cls=DecimalEncoder)
-            }
+            return json_response(200, {
+                "query_type": query_type,
+                "result_label": result_label,
+                "product": top_product,
+                "product_id": top_product.get("product_id", ""),
+                "product_name": top_product.get("product_name", ""),
+                "price": top_product.get("price", 0),
+                "quantity": top_product.get("quantity", 0),
+                "price_formatted": f"${float(top_product.get('price', 0)):,.2f}"
+            })
             
         except Exception as e:
             return self.handle_exception(e, f"Failed to get specialized product data: {query_type}")
@@ -630,14 +821,12 @@ class ProductModel:
             # Get current product details
             product = self.product_table.get_item({"product_id": product_id})
             if not product:
-                return {
-                    "statusCode": 404,
-                    "headers": {"Content-Type": "application/json"},
-                    "body": json.dumps({"message": f"Product with ID {product_id} not found"})
-                }
+                return json_response(404, {"message": f"Product with ID {product_id} not found"})
             
             # Get current stock directly from the product table for consistency
             current_stock = int(product.get("quantity", 0))
+            if product.get("stock_shards"):
+                current_stock = self.sharded_stock.total(product_id)
             
             # Get availability status
             availability = "In Stock"
@@ -647,158 +836,133 @@ class ProductModel:
                 availability = "Low Stock"
             
             # Return stock information
-            return {
-                "statusCode": 200,
-                "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({
-                    "product": {
-                        "product_id": product_id,
-                        "product_name": product.get("product_name"),
-                        "current_stock": current_stock,
-                        "price": product.get("price"),
-                        "availability": availability,
-                        "formatted_price": f"${float(product.get('price', 0)):,.2f}"
-                    }
-                }, cls=DecimalEncoder)
-            }
+            return json_response(200, {
+                "product": {
+                    "product_id": product_id,
+                    "product_name": product.get("product_name"),
+                    "current_stock": current_stock,
+                    "price": product.get("price"),
+                    "availability": availability,
+                    "formatted_price": f"${float(product.get('price', 0)):,.2f}"
+                }
+            })
             
         except Exception as e:
             return self.handle_exception(e, "Failed to check stock")
     
     def add_stock_entry(self, product_id, quantity, remarks):
         try:
-            # Get current product details
-            product = self.product_table.get_item({"product_id": product_id})
-            if not product:
-                return {
-                    "statusCode": 404,
-                    "headers": {"Content-Type": "application/json"},
-                    "body": json.dumps({"message": f"Product with ID {product_id} not found"}, cls=DecimalEncoder)
-                }
-            
-            # Get current stock before making changes
-            current_stock_entries = self.inventory_table.get_stock_entries(product_id)
-            current_total_stock = sum(int(entry["quantity"]) for entry in current_stock_entries) if current_stock_entries else int(product.get("quantity", 0))
-            
-            # For purchases (negative quantity), check if there's enough stock
-            if quantity < 0 and current_total_stock < abs(quantity):
-                return {
-                    "statusCode": 400,
-                    "headers": {"Content-Type": "application/json"},
-                    "body": json.dumps({
-                        "message": "Not enough stock available",
-                        "available": current_total_stock,
-                        "requested": abs(quantity)
-                    }, cls=DecimalEncoder)
-                }
-
-            # Add stock entry to the inventory table
-            self.inventory_table.add_stock_entry(product_id, quantity, remarks)
-
-            # Fetch updated stock entries and calculate the new total quantity
-            stock_entries = self.inventory_table.get_stock_entries(product_id)
-            total_stock = sum(int(entry["quantity"]) for entry in stock_entries) if stock_entries else 0
-
-            # Ensure total_stock doesn't go negative (extra safety check)
-            if total_stock < 0:
-                logger.warning(f"Stock adjustment would result in negative inventory for product {product_id}")
-                # Revert the entry we just added by adding the opposite quantity
-                self.inventory_table.add_stock_entry(product_id, -quantity, f"Reverting invalid stock adjustment: {remarks}")
-                
-                return {
-                    "statusCode": 400,
-                    "headers": {"Content-Type": "application/json"},
-                    "body": json.dumps({
-                        "message": "Cannot reduce stock below 0",
-                        "current_stock": current_total_stock,
-                        "requested_reduction": abs(quantity)
-                    }, cls=DecimalEncoder)
-                }
-
-            # Update the product table with the new total quantity
-            update_expression = "SET quantity = :quantity"
-            expression_values = {
-                ":quantity": total_stock
-            }
-            
-            # Update product quantity
-            self.product_table.update_item(
-                key={"product_id": product_id},
-                update_expression=update_expression,
-                expression_values=expression_values
-            )
-
-            # Send event to EventBridge
-            event_model = EventModel()
-            event_entry = {
-                'Source': 'custom.inventory.mattenarle',
-                'DetailType': 'stock-updated',
-                'Detail': json.dumps({
-                    'product_id': product_id,
-                    'product_name': product.get('product_name'),
-                    'quantity_added': quantity,
-                    'total_quantity': total_stock,
-                    'remarks': remarks,
-                    'timestamp': datetime.now().isoformat()
-                }, cls=DecimalEncoder),
-                'EventBusName': os.getenv('EVENT_BUS_NAME')
-            }
-            event_model.eventbridge.put_events([event_entry])
-
-            # Get product name for the response
-            product_name = product.get('product_name', 'Unknown')
-            
-            return {
-                "statusCode": 200,
-                "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({
-                    "message": "Stock entry added successfully",
-                    "product_id": product_id,
-                    "product_name": product_name,
-                    "quantity_added": quantity,
-                    "remarks": remarks, 
-                    "total_quantity": total_stock
-                }, cls=DecimalEncoder)
-            }
+            for attempt in range(1, STOCK_WRITE_MAX_ATTEMPTS + 1):
+                # Get current product details, strongly consistent once a write has conflicted
+                product = self.product_table.get_item({"product_id": product_id}, consistent_read=attempt > 1)
+                if not product:
+                    return json_response(404, {"message": f"Product with ID {product_id} not found"})
+
+                if product.get("stock_shards"):
+                    return self._add_sharded_stock_entry(product, quantity, remarks)
+                try:
+                    return self._add_unsharded_stock_entry(product, quantity, remarks)
+                except Exception as e:
+                    if not is_condition_failure(e) or attempt == STOCK_WRITE_MAX_ATTEMPTS:
+                        raise
+                    logger.info("Stock of product %s changed during stock entry, retrying (attempt %d)", product_id, attempt)
 
         except Exception as e:
+            if is_condition_failure(e):
+                return json_response(409, {"message": STOCK_CONFLICT_MESSAGE})
             return self.handle_exception(e, "Failed to add stock entry")
-            expression_values = {":quantity": Decimal(str(total_stock))}  # Ensure Decimal format for DynamoDB
-
-            self.product_table.update_item(
-                key={"product_id": product_id},
-                update_expression=update_expression,
-                expression_values=expression_values,
-            )
-
-            # Check if we need to trigger a low stock alert (threshold set to 10)
-            if total_stock <= 10:
-                event_model = EventModel()
-                event_entry = {
-                    'Source': 'custom.inventory.mattenarle',
-                    'DetailType': 'low-stock-alert',
-                    'Detail': json.dumps({
-                        'product_id': product_id,
-                        'product_name': product.get('product_name', 'Unknown'),
-                        'current_quantity': total_stock,
-                        'threshold': 10,
-                        'timestamp': datetime.now().isoformat()
-                    }),
-                    'EventBusName': os.getenv('EVENT_BUS_NAME')
-                }
-                event_model.eventbridge.put_events([event_entry])
-                logger.info(f"Low stock alert triggered for product {product_id}")
-
-            operation = "added to" if quantity > 0 else "removed from"
-            return {
-                "statusCode": 200,
-                "body": json.dumps({
-                    "message": f"Stock {operation} inventory successfully",
-                    "total_quantity": total_stock,
-                    "adjustment": quantity,
-                    "low_stock_alert": total_stock <= 10
+
+    def _add_unsharded_stock_entry(self, product, quantity, remarks):
+        """
+        add_stock_entry for a product whose stock lives on its row. The update is conditional
+        on the quantity read, so the new total and crossing check never rest on a stale read.
+        """
+        product_id = product["product_id"]
+        # Get current stock before making changes
+        ledger_total = self.inventory_table.get_stock_total(product_id)
+        current_total_stock = ledger_total if ledger_total is not None else int(product.get("quantity", 0))
+        
+        # For purchases (negative quantity), check if there's enough stock
+        if quantity < 0 and current_total_stock < abs(quantity):
+            return json_response(400, {
+                "message": "Not enough stock available",
+                "available": current_total_stock,
+                "requested": abs(quantity)
+            })
+
+        total_stock = current_total_stock + quantity
+        update_expression = "SET quantity = :quantity"
+        expression_values = {":quantity": total_stock}
+
+        alert, alerted_at = detect_crossing(product, current_total_stock, total_stock)
+        if alerted_at:
+            update_expression += ", low_stock_alerted_at = :alerted_at"
+            expression_values[":alerted_at"] = alerted_at
+        update_expression, expression_values = with_low_stock_bucket(update_expression, expression_values, product, total_stock)
+
+        condition, expression_values = unsharded_only(
+            "quantity = :read", {**expression_values, ":read": product.get("quantity", 0)})
+
+        # The ledger entry, the product quantity, the stock-updated event and any low-stock alert commit together
+        operations = [
+            self.inventory_table.stock_entry_operation(product_id, quantity, remarks),
+            self.product_table.update_operation({"product_id": product_id}, update_expression, expression_values, condition),
+            self.outbox_table.put_operation(outbox_event('custom.inventory.mattenarle', 'stock-updated', {
+                'product_id': product_id,
+                'product_name': product.get('product_name'),
+                'quantity_added': quantity,
+                'total_quantity': total_stock,
+                'remarks': remarks,
+                'timestamp': datetime.now().isoformat()
+            })),
+        ]
+        if alert:
+            operations.append(self.outbox_table.put_operation(alert))
+            logger.info("Low stock alert triggered for product %s", product_id)
+        self.product_table.transact_write(operations)
+
+        # Get product name for the response
+        product_name = product.get('product_name', 'Unknown')
+        
+        return json_response(200, {
+            "message": "Stock entry added successfully",
+            "product_id": product_id,
+            "product_name": product_name,
+            "quantity_added": quantity,
+            "remarks": remarks, 
+            "total_quantity": total_stock,
+            "low_stock_alert": alert is not None
+        })
+
+    def _add_sharded_stock_entry(self, product, quantity, remarks):
+        """add_stock_entry for a sharded product: deliveries land on one shard, removals come out of one."""
+        product_id = product["product_id"]
+        event = self.outbox_table.put_operation(outbox_event('custom.inventory.mattenarle', 'stock-updated', {
+            'product_id': product_id,
+            'product_name': product.get('product_name'),
+            'quantity_added': quantity,
+            'remarks': remarks,
+            'timestamp': datetime.now().isoformat()
+        }))
+        if quantity >= 0:
+            self.sharded_stock.increment(product, quantity, remarks, [event])
+        else:
+            try:
+                self.sharded_stock.decrement(product, -quantity, remarks, [event])
+            except InsufficientStock as e:
+                return json_response(400, {
+                    "message": "Not enough stock available",
+                    "available": e.available,
+                    "requested": abs(quantity)
                 })
-            }
+        total_stock, alerted = self.sharded_stock.refresh(product)
 
-        except Exception as e:
-            return self.handle_exception(e, "Failed to add stock entry")
\ No newline at end of file
+        return json_response(200, {
+            "message": "Stock entry added successfully",
+            "product_id": product_id,
+            "product_name": product.get('product_name', 'Unknown'),
+            "quantity_added": quantity,
+            "remarks": remarks,
+            "total_quantity": total_stock,
+            "low_stock_alert": alerted
+        })
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from gateways.dynamo_gateway import DynamoGateway
+from gateways.transport import BATCH_MAX_WORKERS
+from utils.invocation import after_invocation
+from utils.logger import logger
+from utils.tracing import trace_methods
+
+load_dotenv()
+table_name = os.getenv("TABLE_NAME")
+
+# Write-behind sales_count for sharded products.
+#
+# Purchases of a sharded product never touch the product row, which is the point of
+# sharding, but the best-seller ranking reads sales_count from that row. Instead of one
+# product write per purchase, purchases add their units to a per-container buffer that is
+# flushed as one ADD sales_count update per product once SALES_FLUSH_INTERVAL_SECONDS have
+# passed since the oldest buffered delta or SALES_FLUSH_MAX_PRODUCTS products are waiting.
+# Due flushes also run at the end of every invocation (utils.invocation.after_invocation).
+# The ranking lags by up to the interval, and deltas still buffered when a container is shut
+# down are lost, so sales_count is approximate for sharded products; the ledger stays exact.
+# Unsharded purchases already write the product row and ADD sales_count in that same write.
+SALES_FLUSH_INTERVAL_SECONDS = float(os.getenv("SALES_FLUSH_INTERVAL_SECONDS", "30"))
+SALES_FLUSH_MAX_PRODUCTS = int(os.getenv("SALES_FLUSH_MAX_PRODUCTS", "100"))
+
+
+@trace_methods
+class SalesCounter:
+    def __init__(self, table_name=table_name):
+        self.product_table = DynamoGateway(table_name)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._oldest = None
+
+    def add(self, product_id, quantity):
+        """Buffer quantity units sold (negative to give them back) and flush when due."""
+        self._buffer(product_id, quantity)
+        self.flush_due()
+
+    def _buffer(self, product_id, quantity):
+        with self._lock:
+            self._pending[product_id] = self._pending.get(product_id, 0) + quantity
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def is_due(self):
+        with self._lock:
+            return bool(self._pending) and (
+                len(self._pending) >= SALES_FLUSH_MAX_PRODUCTS
+                or time.monotonic() - self._oldest >= SALES_FLUSH_INTERVAL_SECONDS
+            )
+
+    def flush_due(self):
+        if self.is_due():
+            self.flush()
+
+    def flush(self):
+        """
+        Apply every buffered delta as an ADD sales_count update, in parallel. Deltas whose
+        update failed go back into the buffer for the next flush; those of products deleted
+        in the meantime are dropped. Returns the number of products updated.
+        """
+        with self._lock:
+            pending = {pid: delta for pid, delta in self._pending.items() if delta}
+            self._pending, self._oldest = {}, None
+        if not pending:
+            return 0
+
+        def apply(item):
+            product_id, delta = item
+            # The condition keeps a late delta from recreating a deleted product as a bare counter
+            return self.product_table.update_item(
+                {"product_id": product_id}, "ADD sales_count :sold", {":sold": delta},
+                "attribute_exists(product_id)",
+            ).get("statusCode")
+
+        with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(pending))) as executor:
+            statuses = dict(zip(pending, executor.map(apply, pending.items())))
+
+        failed = [pid for pid, status in statuses.items() if status not in (200, 409)]
+        if failed:
+            logger.warning("Re-buffering sales_count deltas of %d products after failed updates", len(failed))
+            for product_id in failed:
+                self._buffer(product_id, pending[product_id])
+        updated = sum(1 for status in statuses.values() if status == 200)
+        logger.info("Flushed sales_count deltas for %d products", updated)
+        return updated
+
+
+sales_counter = SalesCounter()
+after_invocation(sales_counter.flush_due)
@@ -0,0 +1,278 @@
+import os
+import random
+
+from dotenv import load_dotenv
+
+from gateways.dynamo_gateway import DynamoGateway, is_condition_failure
+from models.low_stock import detect_crossing
+from utils.logger import logger
+from utils.stock_levels import is_low, parse_quantity, threshold_for, with_low_stock_bucket
+from utils.tracing import trace_methods
+
+load_dotenv()
+stock_shards_table_name = os.getenv("STOCK_SHARDS_TABLE_NAME")
+
+# Opt-in sharded stock counters for hot products.
+#
+# A product with stock_shards = N keeps its stock in N items of the stock shards table
+# ({product_id, shard_id "00".."N-1"}), so concurrent buyers update different items instead
+# of contending on the product row. A purchase takes its units from one random shard,
+# conditional on that shard holding enough. When the shards it tries are short it
+# rebalances, spreading the shards' total evenly again, and draws the units from as many
+# shards as needed. Reads sum the shards. The product row's quantity is kept as a synced
+# view, refreshed on rebalance and whenever a write moves the product across its low-stock
+# threshold. Purchases report their units to the write-behind sales_counter, which keeps
+# the product row's sales_count.
+MAX_STOCK_SHARDS = 50
+# Shards tried on their own before a purchase rebalances and draws on several
+SHARD_PROBES = 2
+# Attempts when other writers keep moving the shards under a rebalance or multi-shard draw
+SHARD_MAX_ATTEMPTS = 3
+
+
+class InsufficientStock(Exception):
+    """The shards together hold fewer units than requested."""
+
+    def __init__(self, available):
+        super().__init__(f"Only {available} units available")
+        self.available = available
+
+
+def shard_key(product_id, shard):
+    return {"product_id": product_id, "shard_id": f"{shard:02d}"}
+
+
+def unsharded_only(condition, expression_values):
+    """
+    Extend the condition of a write to the product row's stock so it fails once the product
+    is sharded: a write that read the row before enable committed must not land on a
+    quantity nothing reads any more. Returns the condition and expression values.
+    """
+    guard = "(attribute_not_exists(stock_shards) OR stock_shards = :unsharded)"
+    return (f"{condition} AND {guard}" if condition else guard), {**expression_values, ":unsharded": 0}
+
+
+def stock_projection(fields):
+    """Extend a scan projection that reads quantity with stock_shards, so sharded rows can be resolved."""
+    if fields is None or "quantity" not in fields:
+        return fields
+    return fields + ("stock_shards",)
+
+
+def split_evenly(total, shards):
+    """Spread total over shards, the first `total % shards` shards taking one extra unit."""
+    base, extra = divmod(max(total, 0), shards)
+    return [base + (1 if shard < extra else 0) for shard in range(shards)]
+
+
+@trace_methods
+class ShardedStock:
+    def __init__(self, product_table, inventory_table, outbox_table, table_name=stock_shards_table_name):
+        self.product_table = product_table
+        self.inventory_table = inventory_table
+        self.outbox_table = outbox_table
+        self.shard_table = DynamoGateway(table_name)
+
+    def shards(self, product_id, consistent_read=False):
+        return self.shard_table.query_partition("product_id", product_id, consistent_read)
+
+    def total(self, product_id, consistent_read=False):
+        """Units in stock summed over the product's shards."""
+        return sum(int(shard.get("quantity", 0)) for shard in self.shards(product_id, consistent_read))
+
+    def resolve_totals(self, items, fields=None):
+        """
+        Replace the row quantity of the sharded items of a scan (read with stock_projection(fields))
+        by their shard total, as the row is only synced on a rebalance or a threshold crossing.
+        stock_shards is dropped again when the caller asked for specific fields.
+        """
+        if fields is not None and "quantity" not in fields:
+            return items
+        for item in items:
+            stock_shards = item.pop("stock_shards", None) if fields is not None else item.get("stock_shards")
+            if stock_shards:
+                item["quantity"] = self.total(item["product_id"])
+        return items
+
+    def enable(self, product, shard_count):
+        """Split the product's current quantity over shard_count new shards."""
+        product_id = product["product_id"]
+        operations = [
+            self.shard_table.put_operation({**shard_key(product_id, shard), "quantity": quantity})
+            for shard, quantity in enumerate(split_evenly(int(product.get("quantity", 0)), shard_count))
+        ]
+        # Conditional on the quantity read, so no unsharded write slips in between
+        condition, expression_values = unsharded_only(
+            "quantity = :read", {":shards": shard_count, ":read": product.get("quantity", 0)})
+        operations.append(self.product_table.update_operation(
+            {"product_id": product_id}, "SET stock_shards = :shards", expression_values, condition))
+        self.product_table.transact_write(operations)
+        logger.info("Enabled %d stock shards for product %s", shard_count, product_id)
+
+    def disable(self, product):
+        """Fold the shards back into the product row and delete them. Returns the folded quantity."""
+        product_id = product["product_id"]
+        shards = self.shards(product_id, consistent_read=True)
+        quantity = sum(int(shard.get("quantity", 0)) for shard in shards)
+
+        # stock_shards = 0 marks the product unsharded; each shard must still hold what was summed
+        operations = self._sync_operations(product, quantity, extra_set=", stock_shards = :unsharded",
+                                           extra_values={":unsharded": 0})
+        operations.extend(
+            self.shard_table.delete_operation(
+                {"product_id": product_id, "shard_id": shard["shard_id"]},
+                "quantity = :read",
+                {":read": shard.get("quantity", 0)},
+            )
+            for shard in shards
+        )
+        self.product_table.transact_write(operations)
+        logger.info("Disabled stock shards for product %s", product_id)
+        return quantity
+
+    def decrement_operation(self, product_id, shard, quantity):
+        """Conditional take of quantity units from one shard."""
+        return self.shard_table.update_operation(
+            shard_key(product_id, shard),
+            "ADD quantity :taken",
+            {":taken": -quantity, ":needed": quantity},
+            "quantity >= :needed",
+        )
+
+    def take_operations(self, product_id, shards, quantity):
+        """Decrements drawing quantity units from the given shard items, fullest first. None when they cannot cover it."""
+        operations, remaining = [], quantity
+        for shard in sorted(shards, key=lambda shard: -int(shard.get("quantity", 0))):
+            taken = min(remaining, int(shard.get("quantity", 0)))
+            if taken > 0:
+                operations.append(self.decrement_operation(product_id, int(shard["shard_id"]), taken))
+                remaining -= taken
+            if remaining == 0:
+                return operations
+        return None
+
+    def random_shard(self, product):
+        return random.randrange(int(product["stock_shards"]))
+
+    def pick_shard(self, shards, quantity):
+        """A random shard item holding at least quantity units, None when there is none."""
+        candidates = [shard for shard in shards if int(shard.get("quantity", 0)) >= quantity]
+        return int(random.choice(candidates)["shard_id"]) if candidates else None
+
+    def decrement(self, product, quantity, remarks, extra_operations=()):
+        """
+        Take quantity units together with their ledger entry. Tries SHARD_PROBES random
+        shards on their own; when they run short the shards are rebalanced and the units
+        drawn from as many shards as it takes. Raises InsufficientStock when the shards
+        together hold too few units.
+        """
+        product_id = product["product_id"]
+        shard_count = int(product["stock_shards"])
+        ledger_operation = self.inventory_table.stock_entry_operation(product_id, -quantity, remarks)
+
+        for shard in random.sample(range(shard_count), min(SHARD_PROBES, shard_count)):
+            try:
+                self.product_table.transact_write(
+                    [self.decrement_operation(product_id, shard, quantity), ledger_operation, *extra_operations])
+                return
+            except Exception as e:
+                if not is_condition_failure(e):
+                    raise
+
+        self.rebalance(product)
+        for attempt in range(1, SHARD_MAX_ATTEMPTS + 1):
+            shards = self.shards(product_id, consistent_read=True)
+            operations = self.take_operations(product_id, shards, quantity)
+            if operations is None:
+                raise InsufficientStock(sum(int(shard.get("quantity", 0)) for shard in shards))
+            try:
+                self.product_table.transact_write([*operations, ledger_operation, *extra_operations])
+                return
+            except Exception as e:
+                if not is_condition_failure(e) or attempt == SHARD_MAX_ATTEMPTS:
+                    raise
+                logger.info("Shards of product %s changed during purchase, retrying (attempt %d)", product_id, attempt)
+
+    def increment(self, product, quantity, remarks, extra_operations=()):
+        """Add quantity units to a random shard together with its ledger entry."""
+        product_id = product["product_id"]
+        self.product_table.transact_write([
+            self.shard_table.update_operation(shard_key(product_id, self.random_shard(product)),
+                                              "ADD quantity :added", {":added": quantity}),
+            self.inventory_table.stock_entry_operation(product_id, quantity, remarks),
+            *extra_operations,
+        ])
+
+    def rebalance(self, product, total=None):
+        """
+        Spread the shards' total (or `total`, when the stock is being set) evenly again. Each
+        shard's update is conditional on the quantity read, so a purchase landing meanwhile
+        makes the attempt start over. Returns the new total and whether a low-stock alert was raised.
+        """
+        product_id = product["product_id"]
+        shard_count = int(product["stock_shards"])
+        for attempt in range(1, SHARD_MAX_ATTEMPTS + 1):
+            shards = {shard["shard_id"]: shard for shard in self.shards(product_id, consistent_read=True)}
+            current = sum(int(shard.get("quantity", 0)) for shard in shards.values())
+            target = current if total is None else total
+
+            operations = []
+            for shard, quantity in enumerate(split_evenly(target, shard_count)):
+                key = shard_key(product_id, shard)
+                stored = shards.get(key["shard_id"])
+                if stored is None:
+                    operations.append(self.shard_table.put_operation(
+                        {**key, "quantity": quantity}, "attribute_not_exists(product_id)"))
+                elif int(stored.get("quantity", 0)) != quantity:
+                    operations.append(self.shard_table.update_operation(
+                        key, "SET quantity = :quantity", {":quantity": quantity, ":read": stored.get("quantity", 0)},
+                        "quantity = :read"))
+            try:
+                if operations:
+                    self.product_table.transact_write(operations)
+                break
+            except Exception as e:
+                if not is_condition_failure(e) or attempt == SHARD_MAX_ATTEMPTS:
+                    raise
+                logger.info("Shards of product %s changed during rebalance, retrying (attempt %d)", product_id, attempt)
+
+        return target, self.sync(product, target)
+
+    def refresh(self, product):
+        """
+        After a sharded write: the new total, plus whether a low-stock alert was raised. The
+        product row is only re-synced when the write moved it across its threshold.
+        """
+        quantity = self.total(product["product_id"])
+        threshold = threshold_for(product)
+        synced = parse_quantity(product.get("synced_quantity", product.get("quantity")))
+        if is_low(quantity, threshold) == is_low(synced, threshold):
+            return quantity, False
+        return quantity, self.sync(product, quantity)
+
+    def sync(self, product, quantity):
+        """Write the shards' total to the product row. Returns True when a low-stock alert was raised."""
+        operations = self._sync_operations(product, quantity)
+        self.product_table.transact_write(operations)
+        return len(operations) > 1
+
+    def _sync_operations(self, product, quantity, extra_set="", extra_values=None):
+        synced = parse_quantity(product.get("synced_quantity", product.get("quantity")))
+        update_expression = f"SET quantity = :quantity{extra_set}"
+        expression_values = {
+            ":quantity": quantity,
+            ":shards": product["stock_shards"],
+            **(extra_values or {}),
+        }
+        alert, alerted_at = detect_crossing(product, synced, quantity)
+        if alerted_at:
+            update_expression += ", low_stock_alerted_at = :alerted_at"
+            expression_values[":alerted_at"] = alerted_at
+        update_expression, expression_values = with_low_stock_bucket(update_expression, expression_values, product, quantity)
+
+        operations = [self.product_table.update_operation(
+            {"product_id": product["product_id"]}, update_expression, expression_values, "stock_shards = :shards")]
+        if alert:
+            operations.append(self.outbox_table.put_operation(alert))
+            logger.info("Low stock alert triggered for product %s", product["product_id"])
+        return operations
@@ -0,0 +1,53 @@
+"""
+Shared fixtures: every test runs against a fresh in-process AWS stand-in (moto) holding
+the tables, bucket, queue and event bus declared in serverless.yml.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import harness  # noqa: E402
+
+# Before any model builds its clients, so they all point at the stand-in
+harness.configure_environment()
+
+from moto import mock_aws  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def aws():
+    with mock_aws():
+        harness.create_resources()
+        yield
+
+
+@pytest.fixture
+def product_table():
+    from gateways.dynamo_gateway import DynamoGateway
+    return DynamoGateway(harness.BENCH_ENV["TABLE_NAME"])
+
+
+@pytest.fixture
+def inventory_table():
+    from gateways.dynamo_gateway import DynamoGateway
+    return DynamoGateway(harness.BENCH_ENV["INVENTORY_TABLE_NAME"])
+
+
+@pytest.fixture
+def outbox_table():
+    from gateways.dynamo_gateway import DynamoGateway
+    return DynamoGateway(harness.BENCH_ENV["OUTBOX_TABLE_NAME"])
+
+
+@pytest.fixture
+def put_product(product_table):
+    """Write a product row directly, bypassing the model, and return it."""
+    def put(product_id, quantity, **attributes):
+        item = {"product_id": product_id, "product_name": f"Product {product_id}", "price": 2, "quantity": quantity,
+                **attributes}
+        product_table.table.put_item(Item=item)
+        return item
+    return put
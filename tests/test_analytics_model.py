@@ -0,0 +1,38 @@
+import pytest
+
+from models.analytics_model import (
+    CATALOG_ROLLUP_PARTITION, CATALOG_SOLD_PREFIX, AnalyticsModel, catalog_segment, day_range,
+)
+from models.product_model import ProductModel
+
+
+@pytest.fixture
+def model():
+    return AnalyticsModel()
+
+
+def put_catalog_sales(inventory_table, day, product_id, units):
+    inventory_table.table.put_item(Item={
+        "product_id": CATALOG_ROLLUP_PARTITION,
+        "datetime": f"rollup#{day}#{catalog_segment(product_id):02d}",
+        f"{CATALOG_SOLD_PREFIX}{product_id}": units,
+    })
+
+
+def days_to_stockout(model, product_id):
+    return next(item["days_to_stockout"] for item in model.forecast_stockouts()["items"]
+                if item["product_id"] == product_id)
+
+
+def test_forecast_uses_the_shard_total_of_sharded_products(model, put_product, inventory_table):
+    products = ProductModel()
+    products.sharded_stock.enable(put_product("a", 100), 4)
+    for day in day_range(7):
+        put_catalog_sales(inventory_table, day, "a", 10)
+    before = days_to_stockout(model, "a")
+
+    for _ in range(10):
+        assert products.buy_product("a", 5)["statusCode"] == 200
+
+    assert before == 10.0
+    assert days_to_stockout(model, "a") == 5.0
@@ -0,0 +1,154 @@
+import json
+from unittest import mock
+
+import pytest
+
+from handlers import order_handler
+from models import order_model as order_module
+from models.order_model import OrderModel
+
+
+@pytest.fixture
+def model():
+    return OrderModel()
+
+
+def quantity(product_table, product_id):
+    return int(product_table.get_item({"product_id": product_id}, consistent_read=True)["quantity"])
+
+
+def ledger(inventory_table, product_id):
+    return [entry for page in inventory_table.query_stock_entries(product_id) for entry in page]
+
+
+def body(response):
+    return json.loads(response["body"])
+
+
+def test_place_order_decrements_every_line(model, put_product, product_table, inventory_table, outbox_table):
+    put_product("a", 10)
+    put_product("b", 5)
+
+    response = model.place_order({"a": 3, "b": 5}, "order-1")
+
+    assert response["statusCode"] == 200
+    assert quantity(product_table, "a") == 7
+    assert quantity(product_table, "b") == 0
+    assert [int(entry["quantity"]) for entry in ledger(inventory_table, "a")] == [-3]
+    events = [item for item in outbox_table.get_all_items() if item.get("detail_type") == "order-placed"]
+    assert len(events) == 1
+
+
+def test_place_order_rejects_shortages_without_writing(model, put_product, product_table, inventory_table):
+    put_product("a", 10)
+    put_product("b", 1)
+
+    response = model.place_order({"a": 3, "b": 2})
+
+    assert response["statusCode"] == 409
+    assert body(response)["shortages"] == [{"product_id": "b", "available": 1, "requested": 2}]
+    assert quantity(product_table, "a") == 10
+    assert ledger(inventory_table, "a") == []
+
+
+def test_chunk_lines_fits_each_chunk_in_one_transaction(model):
+    lines = [(f"p{idx}", 1) for idx in range(70)]
+    products = {pid: {"product_id": pid} for pid, _ in lines}
+    products["p0"]["stock_shards"] = 40
+
+    chunks = model._chunk_lines(lines, products)
+
+    # p0 costs 41 items, every other line 3, and each chunk leaves room for the order event
+    assert [len(chunk) for chunk in chunks] == [20, 33, 17]
+    assert sum(chunks, []) == lines
+
+
+def test_order_spanning_chunks_commits_them_all(model, put_product, product_table, monkeypatch):
+    monkeypatch.setattr(order_module, "TRANSACTION_MAX_ITEMS", 7)
+    for idx in range(5):
+        put_product(f"p{idx}", 10)
+
+    with mock.patch.object(model.product_table, "transact_write", wraps=model.product_table.transact_write) as write:
+        response = model.place_order({f"p{idx}": 2 for idx in range(5)})
+
+    assert response["statusCode"] == 200
+    assert write.call_count == 3
+    assert all(quantity(product_table, f"p{idx}") == 8 for idx in range(5))
+
+
+def test_failed_chunk_reverses_committed_chunks(model, put_product, product_table, inventory_table, monkeypatch):
+    monkeypatch.setattr(order_module, "TRANSACTION_MAX_ITEMS", 7)
+    for idx in range(4):
+        put_product(f"p{idx}", 10)
+
+    real_write = model.product_table.transact_write
+    calls = []
+
+    def failing_second_chunk(operations):
+        calls.append(operations)
+        if len(calls) == 2:
+            raise RuntimeError("throttled")
+        return real_write(operations)
+
+    with mock.patch.object(model.product_table, "transact_write", failing_second_chunk):
+        response = model.place_order({f"p{idx}": 4 for idx in range(4)}, "order-2")
+
+    assert response["statusCode"] == 500
+    assert all(quantity(product_table, f"p{idx}") == 10 for idx in range(4))
+    # The committed first chunk's lines carry their purchase and its reversal
+    assert sorted(int(entry["quantity"]) for entry in ledger(inventory_table, "p0")) == [-4, 4]
+    assert ledger(inventory_table, "p3") == []
+
+
+def test_line_changed_between_read_and_write_is_retried(model, put_product, product_table):
+    put_product("a", 10)
+    real_write = model.product_table.transact_write
+    calls = []
+
+    def racing(operations):
+        calls.append(operations)
+        if len(calls) == 1:
+            product_table.table.update_item(Key={"product_id": "a"}, UpdateExpression="SET quantity = :q",
+                                            ExpressionAttributeValues={":q": 6})
+        return real_write(operations)
+
+    with mock.patch.object(model.product_table, "transact_write", racing):
+        response = model.place_order({"a": 4})
+
+    assert response["statusCode"] == 200
+    assert len(calls) == 2
+    assert quantity(product_table, "a") == 2
+
+
+def test_retry_that_finds_a_shortage_returns_409(model, put_product, product_table):
+    put_product("a", 10)
+    real_write = model.product_table.transact_write
+
+    def racing(operations):
+        product_table.table.update_item(Key={"product_id": "a"}, UpdateExpression="SET quantity = :q",
+                                        ExpressionAttributeValues={":q": 1})
+        return real_write(operations)
+
+    with mock.patch.object(model.product_table, "transact_write", racing):
+        response = model.place_order({"a": 4})
+
+    assert response["statusCode"] == 409
+    assert body(response)["shortages"] == [{"product_id": "a", "available": 1, "requested": 4}]
+    assert quantity(product_table, "a") == 1
+
+
+def test_order_line_for_a_sharded_product(model, put_product, product_table):
+    product = put_product("a", 12)
+    model.sharded_stock.enable(product, 3)
+
+    response = model.place_order({"a": 5})
+
+    assert response["statusCode"] == 200
+    assert model.sharded_stock.total("a", consistent_read=True) == 7
+
+
+@pytest.mark.parametrize("raw_body", ["[]", '"items"', "3"])
+def test_create_order_rejects_non_object_bodies(raw_body):
+    response = order_handler.create_order({"body": raw_body}, None)
+
+    assert response["statusCode"] == 400
@@ -0,0 +1,144 @@
+import json
+from unittest import mock
+
+import pytest
+
+from gateways.dynamo_gateway import is_condition_failure
+from models.product_model import ProductModel
+from models.sharded_stock import InsufficientStock, split_evenly
+
+
+@pytest.fixture
+def model():
+    return ProductModel()
+
+
+@pytest.fixture
+def sharded(model):
+    return model.sharded_stock
+
+
+def shard_quantities(sharded, product_id):
+    return [int(shard["quantity"]) for shard in sharded.shards(product_id, consistent_read=True)]
+
+
+def stored(product_table, product_id):
+    return product_table.get_item({"product_id": product_id}, consistent_read=True)
+
+
+def test_split_evenly_gives_the_remainder_to_the_first_shards():
+    assert split_evenly(10, 4) == [3, 3, 2, 2]
+    assert split_evenly(-5, 2) == [0, 0]
+
+
+def test_enable_splits_the_quantity_over_the_shards(sharded, put_product, product_table):
+    sharded.enable(put_product("a", 10), 4)
+
+    assert shard_quantities(sharded, "a") == [3, 3, 2, 2]
+    assert int(stored(product_table, "a")["stock_shards"]) == 4
+
+
+def test_enable_fails_when_the_quantity_changed_since_the_read(sharded, put_product, product_table):
+    product = put_product("a", 10)
+    product_table.table.update_item(Key={"product_id": "a"}, UpdateExpression="SET quantity = :q",
+                                    ExpressionAttributeValues={":q": 9})
+
+    with pytest.raises(Exception) as error:
+        sharded.enable(product, 2)
+
+    assert is_condition_failure(error.value)
+    assert sharded.shards("a", consistent_read=True) == []
+
+
+def test_decrement_takes_from_one_shard_and_writes_the_ledger(sharded, put_product, product_table, inventory_table):
+    sharded.enable(put_product("a", 10), 2)
+
+    sharded.decrement(stored(product_table, "a"), 3, "Purchase of 3 units")
+
+    assert sorted(shard_quantities(sharded, "a")) == [2, 5]
+    assert [int(entry["quantity"]) for page in inventory_table.query_stock_entries("a") for entry in page] == [-3]
+
+
+def test_decrement_larger_than_any_shard_draws_on_several(sharded, put_product, product_table):
+    sharded.enable(put_product("a", 9), 3)
+
+    sharded.decrement(stored(product_table, "a"), 7, "Purchase of 7 units")
+
+    assert sum(shard_quantities(sharded, "a")) == 2
+
+
+def test_decrement_beyond_the_total_raises(sharded, put_product, product_table):
+    sharded.enable(put_product("a", 4), 2)
+
+    with pytest.raises(InsufficientStock) as error:
+        sharded.decrement(stored(product_table, "a"), 5, "Purchase of 5 units")
+
+    assert error.value.available == 4
+    assert sum(shard_quantities(sharded, "a")) == 4
+
+
+def test_rebalance_sets_a_new_total_and_syncs_the_row(sharded, put_product, product_table):
+    sharded.enable(put_product("a", 10), 3)
+
+    total, _ = sharded.rebalance(stored(product_table, "a"), total=20)
+
+    assert total == 20
+    assert shard_quantities(sharded, "a") == [7, 7, 6]
+    assert int(stored(product_table, "a")["quantity"]) == 20
+
+
+def test_disable_folds_the_shards_back_into_the_row(sharded, put_product, product_table):
+    sharded.enable(put_product("a", 10), 3)
+    sharded.decrement(stored(product_table, "a"), 4, "Purchase of 4 units")
+
+    assert sharded.disable(stored(product_table, "a")) == 6
+
+    row = stored(product_table, "a")
+    assert int(row["quantity"]) == 6
+    assert int(row["stock_shards"]) == 0
+    assert sharded.shards("a", consistent_read=True) == []
+
+
+def test_unsharded_purchase_read_before_enable_lands_on_the_shards(model, sharded, put_product, product_table):
+    put_product("a", 10)
+    real_write = model.product_table.transact_write
+    calls = []
+
+    def enable_first(operations):
+        calls.append(operations)
+        if len(calls) == 1:
+            sharded.enable(stored(product_table, "a"), 2)
+        return real_write(operations)
+
+    with mock.patch.object(model.product_table, "transact_write", enable_first):
+        response = model.buy_product("a", 3)
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["product"]["remaining_stock"] == 7
+    assert sum(shard_quantities(sharded, "a")) == 7
+
+
+def test_stock_entry_on_a_sharded_product(model, sharded, put_product):
+    sharded.enable(put_product("a", 10), 2)
+
+    response = model.add_stock_entry("a", 5, "Delivery")
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["total_quantity"] == 15
+    assert sum(shard_quantities(sharded, "a")) == 15
+
+
+@pytest.mark.parametrize("fields", [None, ("product_id", "quantity")])
+def test_catalog_listing_reports_the_shard_total(model, sharded, put_product, fields):
+    sharded.enable(put_product("a", 100), 4)
+    put_product("b", 8)
+    for _ in range(10):
+        assert model.buy_product("a", 5)["statusCode"] == 200
+
+    listed = {item["product_id"]: item for item in model.get_all_products(fields)["items"]}
+    streamed = {item["product_id"]: item for page in model.iter_product_pages(fields) for item in page}
+
+    for items in (listed, streamed):
+        assert int(items["a"]["quantity"]) == sharded.total("a", consistent_read=True) == 50
+        assert int(items["b"]["quantity"]) == 8
+        assert fields is None or "stock_shards" not in items["a"]
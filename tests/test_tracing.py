@@ -0,0 +1,43 @@
+import pytest
+
+from handlers import product_handler
+from utils import tracing
+
+
+@pytest.fixture
+def exporter():
+    exporter = tracing.configure("memory")
+    exporter.clear()
+    yield exporter
+    tracing.configure("off")
+
+
+def children(spans, parent):
+    return [span for span in spans if span["parent_id"] == parent["span_id"]]
+
+
+def test_handler_span_contains_model_and_gateway_spans(exporter, put_product):
+    put_product("a", 10)
+
+    response = product_handler.get_product({"pathParameters": {"product_id": "a"}}, None)
+
+    assert response["statusCode"] == 200
+    spans = exporter.spans
+    [handler] = [span for span in spans if span["name"] == "handler.get_product"]
+    assert handler["parent_id"] is None
+    assert handler["annotations"] == {"product_id": "a"}
+
+    [model] = [span for span in children(spans, handler) if span["name"] == "ProductModel.get_product"]
+    assert model["annotations"] == {"product_id": "a"}
+    assert "dynamodb.get_item" in [span["name"] for span in children(spans, model)]
+
+
+def test_failing_span_records_the_error(exporter):
+    with pytest.raises(ValueError):
+        with tracing.span("outer"):
+            with tracing.span("inner", product_id="a"):
+                raise ValueError("boom")
+
+    inner, outer = exporter.spans
+    assert (inner["name"], inner["error"], inner["parent_id"]) == ("inner", "ValueError", outer["span_id"])
+    assert outer["error"] == "ValueError"
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+from utils.logger import logger
+from utils.metrics import metrics
+
+# Per-dependency circuit breakers for side effects (EventBridge, SQS).
+#
+#     breaker = get_breaker("eventbridge")
+#     if breaker.allow():
+#         try:
+#             ...call the dependency...
+#             breaker.record_success(latency_ms)
+#         except Exception:
+#             breaker.record_failure()
+#
+# A breaker opens after CIRCUIT_FAILURE_THRESHOLD consecutive failures, where a call
+# slower than CIRCUIT_SLOW_CALL_MS also counts as a failure. While open no calls are
+# attempted; after CIRCUIT_RESET_SECONDS a single trial call is let through (half-open)
+# and its outcome closes or re-opens the breaker. State lives in the Lambda container,
+# so one breaker is shared by every gateway instance and invocation it serves.
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+CIRCUIT_SLOW_CALL_MS = float(os.getenv("CIRCUIT_SLOW_CALL_MS", "2000"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS,
+                 slow_call_ms=CIRCUIT_SLOW_CALL_MS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.slow_call_ms = slow_call_ms
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def allow(self):
+        """Return True if a call may be attempted now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self, latency_ms=0.0):
+        if latency_ms > self.slow_call_ms:
+            logger.warning("%s call took %.0f ms, counting it as a failure", self.name, latency_ms)
+            self.record_failure()
+            return
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Circuit for %s closed", self.name)
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning("Circuit for %s opened after %d consecutive failures", self.name, self.consecutive_failures)
+                    metrics.record(self.name, "CircuitOpened", 0.0)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Return the container-wide breaker for a dependency, creating it on first use."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
@@ -0,0 +1,137 @@
+import base64
+import gzip
+import hashlib
+import io
+import os
+
+from utils.tracing import annotate
+
+# Bodies below this size are not worth the gzip CPU and base64 overhead
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+GZIP_LEVEL = 5
+
+
+def get_header(event, name):
+    """Case-insensitive request header lookup (HTTP API v2 lowercases names, REST APIs do not)."""
+    headers = event.get("headers") or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def etag_for_digest(digest):
+    # Weak validator: the gzip and identity encodings of a body are the same resource version
+    return f'W/"{digest.hexdigest()}"'
+
+
+def compute_etag(body: str):
+    return etag_for_digest(hashlib.blake2b(body.encode("utf-8"), digest_size=16))
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag[2:]
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
+
+
+def accepts_gzip(event):
+    return "gzip" in (get_header(event, "Accept-Encoding") or "").lower()
+
+
+def cache_headers(response, etag):
+    headers = dict(response.get("headers") or {})
+    headers["ETag"] = etag
+    headers["Cache-Control"] = "no-cache"
+    headers["Vary"] = "Accept-Encoding"
+    return headers
+
+
+def not_modified(headers):
+    annotate("etag_cache", "hit")
+    return {
+        "statusCode": 304,
+        "headers": {key: headers[key] for key in ("ETag", "Cache-Control", "Vary")},
+        "body": "",
+    }
+
+
+def conditional_response(event, response):
+    """
+    Make a successful JSON response cacheable by pollers.
+    Adds an ETag, answers a matching If-None-Match with 304 and gzip-compresses
+    large bodies (base64 encoded for API Gateway) when the client accepts gzip.
+    """
+    body = response.get("body")
+    if response.get("statusCode") != 200 or not isinstance(body, str):
+        return response
+
+    etag = compute_etag(body)
+    headers = cache_headers(response, etag)
+    if etag_matches(get_header(event, "If-None-Match"), etag):
+        return not_modified(headers)
+
+    annotate("etag_cache", "miss")
+    body_bytes = body.encode("utf-8")
+    if accepts_gzip(event) and len(body_bytes) >= GZIP_MIN_BYTES:
+        headers["Content-Encoding"] = "gzip"
+        return {
+            **response,
+            "headers": headers,
+            "body": base64.b64encode(gzip.compress(body_bytes, compresslevel=GZIP_LEVEL)).decode("ascii"),
+            "isBase64Encoded": True,
+        }
+
+    return {**response, "headers": headers}
+
+
+class StreamedBody:
+    """
+    A response body written chunk by chunk. Each chunk is hashed for the ETag and written
+    once, straight into a gzip stream when the client accepts gzip, so the body is never
+    held both whole and encoded; streamed_response turns it into the response.
+    Streamed bodies are compressed whatever their size, since the size is only known at the end.
+    """
+
+    def __init__(self, event):
+        self.gzip = accepts_gzip(event)
+        self._digest = hashlib.blake2b(digest_size=16)
+        self._buffer = io.BytesIO()
+        self._writer = (gzip.GzipFile(fileobj=self._buffer, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)
+                        if self.gzip else self._buffer)
+
+    def write(self, chunk: bytes):
+        self._digest.update(chunk)
+        self._writer.write(chunk)
+
+    def etag(self):
+        return etag_for_digest(self._digest)
+
+    def close(self):
+        if self.gzip:
+            self._writer.close()
+        return self._buffer
+
+
+def streamed_response(event, body: StreamedBody, headers):
+    """The streamed counterpart of conditional_response for a 200 built in a StreamedBody."""
+    etag = body.etag()
+    headers = cache_headers({"headers": headers}, etag)
+    buffer = body.close()
+    if etag_matches(get_header(event, "If-None-Match"), etag):
+        return not_modified(headers)
+
+    annotate("etag_cache", "miss")
+    if body.gzip:
+        headers["Content-Encoding"] = "gzip"
+        return {
+            "statusCode": 200,
+            "headers": headers,
+            "body": base64.b64encode(buffer.getbuffer()).decode("ascii"),
+            "isBase64Encoded": True,
+        }
+    return {"statusCode": 200, "headers": headers, "body": str(buffer.getbuffer(), "utf-8")}
@@ -0,0 +1,60 @@
+import functools
+
+from utils.logger import end_invocation, logger, start_invocation
+from utils.metrics import metrics
+from utils.profiling import profile_invocation
+from utils.tracing import span
+
+# Callbacks run after every decorated invocation, before its metrics are flushed, so
+# write-behind buffers can flush whatever has come due in the same container
+_after_invocation = []
+
+
+def after_invocation(callback):
+    """Register callback to run at the end of every invocation; usable as a decorator."""
+    _after_invocation.append(callback)
+    return callback
+
+
+def run_after_invocation():
+    for callback in _after_invocation:
+        try:
+            callback()
+        except Exception as e:
+            # The invocation's own result stands; the callback retries on its next turn
+            logger.error("After-invocation callback %s failed: %s", getattr(callback, "__name__", callback), e)
+
+
+def lambda_handler(func=None, *, allocation_sites=False):
+    """
+    Decorate a Lambda entry point with per-invocation setup and teardown:
+    tags log lines with the request id and handler name, resets the log line budget
+    runs the after_invocation callbacks, flushes the gateway metrics recorded during
+    the call as EMF and wraps the call in a tracing span so model and gateway spans
+    nest under the handler.
+
+    Invocations selected by PROFILE_INVOCATIONS / PROFILE_SAMPLE_RATE run under the
+    profiler; pass allocation_sites=True (batch handlers) to also report where memory
+    peaked: ``@lambda_handler(allocation_sites=True)``.
+    """
+    if func is None:
+        return functools.partial(lambda_handler, allocation_sites=allocation_sites)
+
+    span_name = f"handler.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(event, context):
+        start_invocation(context, handler=func.__name__)
+        metrics.reset()
+        path_parameters = (event.get("pathParameters") if isinstance(event, dict) else None) or {}
+        annotations = {"product_id": path_parameters["product_id"]} if "product_id" in path_parameters else {}
+        try:
+            with span(span_name, **annotations), \
+                    profile_invocation(func.__name__, context, allocation_sites=allocation_sites):
+                return func(event, context)
+        finally:
+            run_after_invocation()
+            metrics.flush()
+            end_invocation()
+
+    return wrapper
@@ -1,25 +1,129 @@
 import logging
+import os
+import random
+import sys
+import time
+import traceback
 
-# Configure the root logger
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+from utils.serialization import dumps
 
-# Create a logger instance
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+# Structured JSON logging for Lambda.
+#
+# Messages use %-style arguments and payloads go in `extra=`, so nothing is formatted
+# or serialized unless a line is actually emitted:
+#
+#     logger.debug("Item preview", extra={"item": item})
+#     logger.info("Fetched %d items from table: %s", len(items), table_name)
+#
+# Environment:
+#   LOG_LEVEL                     minimum level, defaults to INFO
+#   LOG_SAMPLE_RATES              per-level sampling, e.g. "DEBUG=0.05,INFO=0.5"
+#   LOG_MAX_LINES_PER_INVOCATION  cap on lines below WARNING per invocation (0 disables)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MAX_LINES_PER_INVOCATION = int(os.getenv("LOG_MAX_LINES_PER_INVOCATION", "1000"))
+
+# Attributes every LogRecord has; anything else on a record came from `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_log_context = {}
+
+
+def _parse_sample_rates(raw):
+    rates = {}
+    for part in filter(None, (chunk.strip() for chunk in raw.split(","))):
+        level_name, _, rate = part.partition("=")
+        rates[logging.getLevelName(level_name.strip().upper())] = float(rate)
+    return rates
+
+
+class InvocationFilter(logging.Filter):
+    """Applies per-level sampling and the per-invocation line cap. WARNING and above always pass."""
+
+    def __init__(self, sample_rates, max_lines):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.max_lines = max_lines
+        self.reset()
+
+    def reset(self):
+        self.emitted = 0
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        rate = self.sample_rates.get(record.levelno, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return False
+
+        if self.max_lines:
+            if self.emitted >= self.max_lines:
+                self.suppressed += 1
+                if self.suppressed > 1:
+                    return False
+                # Turn the first dropped line into a single notice so the cut-off is visible
+                record.msg = "Log line cap of %d reached, suppressing further lines below WARNING"
+                record.args = (self.max_lines,)
+                record.levelno, record.levelname = logging.WARNING, "WARNING"
+                return True
+            self.emitted += 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "location": f"{record.module}.{record.funcName}:{record.lineno}",
+            **_log_context,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        try:
+            return dumps(entry)
+        except TypeError:
+            return dumps({key: value if isinstance(value, (str, int, float, bool, type(None))) else repr(value)
+                          for key, value in entry.items()})
+
+
+def start_invocation(context=None, **fields):
+    """Reset per-invocation state and tag every following line with the request id."""
+    _log_context.clear()
+    request_id = getattr(context, "aws_request_id", None)
+    if request_id:
+        _log_context["request_id"] = request_id
+    _log_context.update(fields)
+    invocation_filter.reset()
+
+
+def append_context(**fields):
+    """Add keys to every line logged for the rest of the invocation."""
+    _log_context.update(fields)
+
+
+def end_invocation():
+    if invocation_filter.suppressed > 1:
+        logger.warning("Suppressed %d log lines this invocation", invocation_filter.suppressed - 1)
+    _log_context.clear()
+    invocation_filter.reset()
+
+
+invocation_filter = InvocationFilter(_parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "")), LOG_MAX_LINES_PER_INVOCATION)
+
+logger = logging.getLogger("products")
+logger.setLevel(LOG_LEVEL)
+# Our handler writes JSON lines itself; don't duplicate them through the Lambda root handler
+logger.propagate = False
 
-# Add handler if not already added
 if not logger.handlers:
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(invocation_filter)
     logger.addHandler(handler)
-
-# Ensure all log methods are available
-logger.debug = logger.debug
-logger.info = logger.info
-logger.warning = logger.warning
-logger.error = logger.error
-logger.critical = logger.critical
@@ -0,0 +1,212 @@
+import functools
+import inspect
+import os
+import threading
+import time
+
+from utils.serialization import dumps
+from utils.tracing import span
+
+# Per-invocation gateway instrumentation, flushed as CloudWatch Embedded Metric Format.
+#
+# Gateway methods (decorated with @instrument_gateway) record latency, item counts and
+# errors under their method name, e.g. ("dynamodb", "get_item"). botocore hooks
+# (register_client_hooks) record the underlying API calls under the API name, e.g.
+# ("dynamodb", "GetItem"), including retries and DynamoDB ConsumedCapacity.
+# flush() prints one EMF document per (dependency, operation) to stdout, where the
+# Lambda log agent turns it into metrics; locally it is just JSON on stdout.
+
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "ProductService")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# EMF accepts at most 100 values per metric in one document
+MAX_VALUES_PER_METRIC = 100
+
+# DynamoDB operations that can report ConsumedCapacity
+CAPACITY_OPERATIONS = {
+    "GetItem", "PutItem", "UpdateItem", "DeleteItem", "Query", "Scan",
+    "BatchGetItem", "BatchWriteItem", "TransactGetItems", "TransactWriteItems",
+}
+
+METRIC_UNITS = {
+    "Latency": "Milliseconds",
+    "Calls": "Count",
+    "Errors": "Count",
+    "Items": "Count",
+    "Retries": "Count",
+    "ConsumedCapacity": "Count",
+}
+
+
+class MetricsRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+
+    def _stats(self, dependency, operation):
+        key = (dependency, operation)
+        if key not in self.operations:
+            self.operations[key] = {"Latency": [], "Calls": 0, "Errors": 0, "Items": 0, "Retries": 0, "ConsumedCapacity": 0.0}
+        return self.operations[key]
+
+    def record(self, dependency, operation, latency_ms, error=False, items=0, retries=0, consumed_capacity=0.0):
+        with self._lock:
+            stats = self._stats(dependency, operation)
+            stats["Calls"] += 1
+            if len(stats["Latency"]) < MAX_VALUES_PER_METRIC:
+                stats["Latency"].append(round(latency_ms, 3))
+            stats["Errors"] += int(error)
+            stats["Items"] += items
+            stats["Retries"] += retries
+            stats["ConsumedCapacity"] += consumed_capacity
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(stats, Latency=list(stats["Latency"])) for key, stats in self.operations.items()}
+
+    def to_emf(self):
+        """Build one EMF document per (dependency, operation) recorded this invocation."""
+        timestamp = int(time.time() * 1000)
+        function_name = os.getenv("AWS_LAMBDA_FUNCTION_NAME", "local")
+        documents = []
+        for (dependency, operation), stats in self.snapshot().items():
+            metric_names = [name for name, value in stats.items() if value or name == "Calls"]
+            documents.append({
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [["Dependency", "Operation"]],
+                        "Metrics": [{"Name": name, "Unit": METRIC_UNITS[name]} for name in metric_names],
+                    }],
+                },
+                "Dependency": dependency,
+                "Operation": operation,
+                "FunctionName": function_name,
+                **{name: stats[name] for name in metric_names},
+            })
+        return documents
+
+    def flush(self):
+        if METRICS_ENABLED:
+            for document in self.to_emf():
+                print(dumps(document), flush=True)
+        self.reset()
+
+
+metrics = MetricsRecorder()
+
+
+def _count_items(result, args):
+    if isinstance(result, list):
+        return len(result)
+    # Batch writes return an envelope; the number of items written is the list argument
+    if args and isinstance(args[0], list):
+        return len(args[0])
+    return 0
+
+
+def _instrument_generator(generator, dependency, operation, start):
+    items, error = 0, False
+    try:
+        for page in generator:
+            items += len(page) if isinstance(page, list) else 1
+            yield page
+    except Exception:
+        error = True
+        raise
+    finally:
+        metrics.record(dependency, operation, (time.perf_counter() - start) * 1000, error=error, items=items)
+
+
+def instrument_method(func, dependency):
+    operation = func.__name__
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(self, *args, **kwargs):
+            return _instrument_generator(func(self, *args, **kwargs), dependency, operation, time.perf_counter())
+
+        return generator_wrapper
+
+    span_name = f"{dependency}.{operation}"
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with span(span_name) as current:
+            start = time.perf_counter()
+            try:
+                result = func(self, *args, **kwargs)
+            except Exception:
+                metrics.record(dependency, operation, (time.perf_counter() - start) * 1000, error=True)
+                raise
+            # Gateways that report failures as 5xx envelopes instead of raising still count as errors
+            error = isinstance(result, dict) and result.get("statusCode", 200) >= 500
+            items = _count_items(result, args)
+            metrics.record(dependency, operation, (time.perf_counter() - start) * 1000, error=error, items=items)
+            current.annotate("item_count", items)
+            return result
+
+    return wrapper
+
+
+def instrument_gateway(dependency, exclude=()):
+    """Class decorator that instruments every public method defined on a gateway, except pure helpers in exclude."""
+    def decorate(cls):
+        for name, member in list(vars(cls).items()):
+            if not name.startswith("_") and name not in exclude and inspect.isfunction(member):
+                setattr(cls, name, instrument_method(member, dependency))
+        return cls
+
+    return decorate
+
+
+def _sum_capacity(consumed):
+    if not consumed:
+        return 0.0
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return float(sum(entry.get("CapacityUnits", 0) for entry in consumed))
+
+
+def register_client_hooks(client, dependency):
+    """Record every API call made by a boto3 client, with retries and DynamoDB consumed capacity."""
+    events = client.meta.events
+
+    def request_capacity(params, model, **kwargs):
+        if model.name in CAPACITY_OPERATIONS:
+            params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+    def before_call(context, **kwargs):
+        context["metrics_start"] = time.perf_counter()
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        start = context.get("metrics_start")
+        latency_ms = (time.perf_counter() - start) * 1000 if start else 0.0
+        metrics.record(
+            dependency,
+            model.name,
+            latency_ms,
+            error=http_response.status_code >= 400,
+            retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+            consumed_capacity=_sum_capacity(parsed.get("ConsumedCapacity")),
+        )
+
+    def after_call_error(context, event_name, **kwargs):
+        # Connection errors and timeouts never reach after-call
+        start = context.get("metrics_start")
+        latency_ms = (time.perf_counter() - start) * 1000 if start else 0.0
+        metrics.record(dependency, event_name.rsplit(".", 1)[-1], latency_ms, error=True)
+
+    # Event names use the hyphenized service id, e.g. "eventbridge" for the "events" client
+    service = client.meta.service_model.service_id.hyphenize()
+    if service == "dynamodb":
+        events.register(f"provide-client-params.{service}", request_capacity, unique_id="metrics-request-capacity")
+    events.register(f"before-call.{service}", before_call, unique_id="metrics-before-call")
+    events.register(f"after-call.{service}", after_call, unique_id="metrics-after-call")
+    events.register(f"after-call-error.{service}", after_call_error, unique_id="metrics-after-call-error")
+    return client
@@ -0,0 +1,157 @@
+import cProfile
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from utils.logger import logger
+
+# Opt-in profiling of single invocations.
+#
+# When an invocation is selected it runs under cProfile and tracemalloc. The pstats
+# dump (and, for handlers that ask for allocation sites, a tracemalloc snapshot
+# taken at peak memory) goes to PROFILE_OUTPUT_DIR and optionally to S3, and a
+# summary line with the hottest functions is logged.
+#
+# Environment:
+#   PROFILE_INVOCATIONS   "true" to profile every invocation, or comma separated handler names
+#   PROFILE_SAMPLE_RATE   fraction of the remaining invocations to profile, e.g. "0.01"
+#   PROFILE_OUTPUT_DIR    where stats files are written, defaults to /tmp
+#   PROFILE_S3_BUCKET     upload stats files here under PROFILE_S3_PREFIX (default "profiles/")
+#   PROFILE_TOP_N         functions and allocation sites listed in the summary, defaults to 10
+
+PROFILE_INVOCATIONS = os.getenv("PROFILE_INVOCATIONS", "").strip()
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", "/tmp")
+PROFILE_S3_BUCKET = os.getenv("PROFILE_S3_BUCKET")
+PROFILE_S3_PREFIX = os.getenv("PROFILE_S3_PREFIX", "profiles/")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "10"))
+
+# Frames kept per allocation; enough to see the caller of a gateway or csv call
+TRACEMALLOC_FRAMES = 10
+PEAK_POLL_SECONDS = 0.05
+
+_profiled_handlers = {name.strip() for name in PROFILE_INVOCATIONS.split(",") if name.strip()}
+
+
+def should_profile(handler_name):
+    if _profiled_handlers & {"1", "true", "all"} or handler_name in _profiled_handlers:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+class PeakSnapshotter(threading.Thread):
+    """
+    Polls traced memory and keeps a tracemalloc snapshot from the moment usage peaked.
+    A snapshot taken after the handler returns only shows what survived it, which for
+    batch handlers is almost nothing.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = 0
+        self.snapshot = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(PEAK_POLL_SECONDS):
+            current, _ = tracemalloc.get_traced_memory()
+            # Snapshots are not free; only retake one when usage grew by a meaningful amount
+            if current > self.peak * 1.25:
+                self.peak = current
+                self.snapshot = tracemalloc.take_snapshot()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        current, _ = tracemalloc.get_traced_memory()
+        if self.snapshot is None or current > self.peak:
+            self.peak = current
+            self.snapshot = tracemalloc.take_snapshot()
+
+
+def top_functions(profiler, limit):
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [
+        {"function": f"{os.path.basename(filename)}:{line}({name})", "calls": calls, "cumulative_ms": round(cumulative * 1000, 2)}
+        for (filename, line, name), (_, calls, _, cumulative, _) in rows[:limit]
+    ]
+
+
+def top_allocation_sites(snapshot, limit):
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, threading.__file__),
+    ))
+    return [
+        {"site": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+         "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+        for stat in snapshot.statistics("lineno")[:limit]
+    ]
+
+
+def upload_profiles(paths, handler_name, request_id):
+    from gateways.s3_gateway import S3Gateway
+
+    gateway = S3Gateway(PROFILE_S3_BUCKET)
+    for path in paths:
+        gateway.upload_file(path, f"{PROFILE_S3_PREFIX}{handler_name}/{request_id}/{os.path.basename(path)}")
+
+
+@contextmanager
+def profile_invocation(handler_name, context=None, allocation_sites=False):
+    """Profile the enclosed block when this invocation is selected; otherwise a no-op."""
+    if not should_profile(handler_name):
+        yield
+        return
+
+    request_id = getattr(context, "aws_request_id", None) or f"local-{int(time.time() * 1000)}"
+    started_tracemalloc = not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    snapshotter = PeakSnapshotter() if allocation_sites else None
+    if snapshotter:
+        snapshotter.start()
+
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        duration_ms = (time.perf_counter() - started) * 1000
+        if snapshotter:
+            snapshotter.stop()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        if started_tracemalloc:
+            tracemalloc.stop()
+
+        try:
+            base_path = os.path.join(PROFILE_OUTPUT_DIR, f"profile-{handler_name}-{request_id}")
+            paths = [f"{base_path}.prof"]
+            profiler.dump_stats(paths[0])
+            summary = {
+                "handler": handler_name,
+                "duration_ms": round(duration_ms, 2),
+                "peak_memory_kb": round(peak_bytes / 1024, 1),
+                "top_functions": top_functions(profiler, PROFILE_TOP_N),
+                "stats_files": paths,
+            }
+            if snapshotter:
+                paths.append(f"{base_path}.tracemalloc")
+                snapshotter.snapshot.dump(paths[1])
+                summary["allocation_sites"] = top_allocation_sites(snapshotter.snapshot, PROFILE_TOP_N)
+            if PROFILE_S3_BUCKET:
+                upload_profiles(paths, handler_name, request_id)
+                summary["s3_prefix"] = f"s3://{PROFILE_S3_BUCKET}/{PROFILE_S3_PREFIX}{handler_name}/{request_id}/"
+            logger.info("Invocation profile", extra={"profile": summary})
+        except Exception as e:
+            # A failed profile must never fail the invocation it was attached to
+            logger.warning("Could not write invocation profile: %s", e)
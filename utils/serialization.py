@@ -0,0 +1,47 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the deployment package
+    orjson = None
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# DynamoDB hands numbers back as Decimal. Using the float builtin as the fallback hook
+# converts them without entering a Python-level frame per value, unlike
+# DecimalEncoder.default; anything float() cannot handle still raises TypeError.
+_default = float
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        """Serialize obj to a JSON string, converting Decimal values to floats."""
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode("utf-8")
+
+    def dumps_bytes(obj):
+        """Serialize obj to UTF-8 JSON bytes, for callers that write bytes anyway."""
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    _encoder = json.JSONEncoder(default=_default)
+
+    def dumps(obj):
+        """Serialize obj to a JSON string, converting Decimal values to floats."""
+        return _encoder.encode(obj)
+
+    def dumps_bytes(obj):
+        """Serialize obj to UTF-8 JSON bytes, for callers that write bytes anyway."""
+        return _encoder.encode(obj).encode("utf-8")
+
+    loads = json.loads
+
+
+def json_response(status_code, body, headers=None):
+    """Build the API Gateway proxy response envelope shared by every handler."""
+    return {
+        "statusCode": status_code,
+        "headers": {**JSON_HEADERS, **headers} if headers else dict(JSON_HEADERS),
+        "body": dumps(body),
+    }
@@ -0,0 +1,52 @@
+import os
+
+# Low-stock levels, shared by the models and the gateways that write products.
+#
+# A product is low once its quantity is at or below its threshold (the product's
+# low_stock_threshold attribute, else LOW_STOCK_THRESHOLD). Nothing here touches a
+# table or the outbox; alerting on crossings lives in models.low_stock.
+
+DEFAULT_LOW_STOCK_THRESHOLD = int(os.getenv("LOW_STOCK_THRESHOLD", "10"))
+
+
+def parse_quantity(value):
+    """Quantities from CSV imports arrive as strings and may be dirty; None when unusable."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def threshold_for(product, default=DEFAULT_LOW_STOCK_THRESHOLD):
+    threshold = parse_quantity(product.get("low_stock_threshold")) if product else None
+    return threshold if threshold is not None else default
+
+
+def is_low(quantity, threshold):
+    return quantity is not None and quantity <= threshold
+
+
+# Sparse index: low_stock_bucket exists only on products that are currently low, so
+# LowStockIndex holds just those and check_low_inventory queries it instead of scanning.
+LOW_STOCK_BUCKET = "LOW"
+LOW_STOCK_INDEX = "LowStockIndex"
+
+
+def with_low_stock_bucket(update_expression, expression_values, product, new_quantity):
+    """
+    Extend a SET update expression so low_stock_bucket follows the new quantity:
+    set while the product is low, removed otherwise. Returns (expression, values).
+    """
+    if is_low(new_quantity, threshold_for(product)):
+        return (f"{update_expression}, low_stock_bucket = :low_stock_bucket",
+                {**expression_values, ":low_stock_bucket": LOW_STOCK_BUCKET})
+    return f"{update_expression} REMOVE low_stock_bucket", expression_values
+
+
+def apply_low_stock_bucket(item):
+    """Set or drop low_stock_bucket on an item about to be written with a full put."""
+    if is_low(parse_quantity(item.get("quantity")), threshold_for(item)):
+        item["low_stock_bucket"] = LOW_STOCK_BUCKET
+    else:
+        item.pop("low_stock_bucket", None)
+    return item
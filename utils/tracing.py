@@ -0,0 +1,200 @@
+import functools
+import inspect
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Tracing spans for handlers, models and gateways.
+#
+#     with span("dynamodb.get_item", product_id=product_id) as current:
+#         ...
+#         current.annotate("item_count", 1)
+#
+#     @traced()
+#     def buy_product(self, product_id, quantity=1): ...
+#
+# TRACING_MODE selects the backend:
+#   xray    X-Ray subsegments through aws_xray_sdk (default inside Lambda when the SDK is installed)
+#   memory  nested spans kept by InMemoryExporter, for tests and local runs
+#   off     no-op; a disabled span costs one global lookup and a branch (default elsewhere)
+
+try:
+    from aws_xray_sdk.core import xray_recorder
+except ImportError:  # pragma: no cover - depends on the deployment package
+    xray_recorder = None
+
+
+class _NoopSpan:
+    def annotate(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class MemorySpan:
+    _ids = itertools.count(1)
+
+    def __init__(self, name, parent_id):
+        self.span_id = next(self._ids)
+        self.parent_id = parent_id
+        self.name = name
+        self.annotations = {}
+        self.error = None
+        self.start = time.perf_counter()
+        self.duration_ms = None
+
+    def annotate(self, key, value):
+        self.annotations[key] = value
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "duration_ms": self.duration_ms,
+            "annotations": dict(self.annotations),
+            "error": self.error,
+        }
+
+
+class InMemoryExporter:
+    """Collects finished spans in memory, keeping parent links per thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.spans = []
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, annotations):
+        stack = self._stack()
+        current = MemorySpan(name, stack[-1].span_id if stack else None)
+        current.annotations.update(annotations)
+        stack.append(current)
+        try:
+            yield current
+        except Exception as e:
+            current.error = type(e).__name__
+            raise
+        finally:
+            stack.pop()
+            current.duration_ms = (time.perf_counter() - current.start) * 1000
+            with self._lock:
+                self.spans.append(current.to_dict())
+
+    def current(self):
+        stack = self._stack()
+        return stack[-1] if stack else NOOP_SPAN
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+
+class _XRaySpan:
+    def __init__(self, subsegment):
+        self.subsegment = subsegment
+
+    def annotate(self, key, value):
+        # X-Ray annotations are indexed and only accept strings, numbers and booleans
+        if not isinstance(value, (str, int, float, bool)):
+            value = str(value)
+        self.subsegment.put_annotation(key, value)
+
+
+class XRayBackend:
+    @contextmanager
+    def span(self, name, annotations):
+        with xray_recorder.in_subsegment(name) as subsegment:
+            current = _XRaySpan(subsegment)
+            for key, value in annotations.items():
+                current.annotate(key, value)
+            yield current
+
+    def current(self):
+        subsegment = xray_recorder.current_subsegment()
+        return _XRaySpan(subsegment) if subsegment else NOOP_SPAN
+
+
+_backend = None
+exporter = None
+
+
+def configure(mode):
+    """Switch the tracing backend at runtime ("xray", "memory" or "off")."""
+    global _backend, exporter
+    if mode == "xray" and xray_recorder is not None:
+        _backend = XRayBackend()
+    elif mode == "memory":
+        exporter = exporter or InMemoryExporter()
+        _backend = exporter
+    else:
+        _backend = None
+    return _backend
+
+
+def _default_mode():
+    if os.getenv("AWS_LAMBDA_FUNCTION_NAME") and xray_recorder is not None:
+        return "xray"
+    return "off"
+
+
+configure(os.getenv("TRACING_MODE", _default_mode()).lower())
+
+
+@contextmanager
+def _noop_span():
+    yield NOOP_SPAN
+
+
+def span(name, **annotations):
+    if _backend is None:
+        return _noop_span()
+    return _backend.span(name, annotations)
+
+
+def annotate(key, value):
+    """Annotate the innermost open span, if any."""
+    if _backend is not None:
+        _backend.current().annotate(key, value)
+
+
+def traced(name=None):
+    """Trace every call of the decorated function, annotating its product_id argument when it has one."""
+    def decorate(func):
+        span_name = name or func.__qualname__
+        parameters = list(inspect.signature(func).parameters)
+        product_id_index = parameters.index("product_id") if "product_id" in parameters else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _backend is None:
+                return func(*args, **kwargs)
+
+            annotations = {}
+            if product_id_index is not None:
+                product_id = kwargs.get("product_id", args[product_id_index] if len(args) > product_id_index else None)
+                if product_id is not None:
+                    annotations["product_id"] = product_id
+            with _backend.span(span_name, annotations):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def trace_methods(cls):
+    """Class decorator that applies @traced to every public method defined on cls."""
+    for attr, member in list(vars(cls).items()):
+        if not attr.startswith("_") and inspect.isfunction(member) and not inspect.isgeneratorfunction(member):
+            setattr(cls, attr, traced(f"{cls.__name__}.{attr}")(member))
+    return cls